@@ -1,315 +1,1949 @@
-from typing import Tuple, List, Set
+import functools
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
-def clear_database(mydb):
+logger = logging.getLogger(__name__)
+
+# Number of input records processed (and committed) together by the loaders.
+DEFAULT_BATCH_SIZE = 1000
+
+# Migration range-partitioning Rating by year (MySQL only, see music_db_partitions).
+PARTITIONING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "music_db_partitioning.sql")
+
+# Names kept per table by the default dimension cache of each database, so
+# its memory stays bounded however many distinct names the loaders see.
+DEFAULT_DIMENSION_CACHE_SIZE = 100_000
+
+# Number of rows fetched per round trip by the streaming iter_get_* queries.
+DEFAULT_FETCH_SIZE = 1000
+
+# Upper bound on the rows sent in one multi-row INSERT or IN (...) list, so a
+# large batch never produces a statement bigger than max_allowed_packet.
+MAX_ROWS_PER_STATEMENT = 500
+
+# Scripts replayed, in order, by clear_database(mode="recreate"). music_db.sql
+# creates every table; music_db_rollups.sql, music_db_import_checkpoints.sql,
+# music_db_feed_fingerprints.sql and music_db_artist_summaries.sql only
+# upgrade databases created from an older music_db.sql.
+SCHEMA_FILES = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "music_db.sql"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "music_db_indexes.sql"),
+)
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Split an iterable into lists of at most `size` items.
+    """
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _row_placeholders(width: int, count: int) -> str:
+    """
+    Build "(%s,%s),(%s,%s),..." for `count` rows of `width` columns.
+    """
+    row = "(" + ",".join(["%s"] * width) + ")"
+    return ",".join([row] * count)
+
+def _fold(name: str) -> str:
+    """
+    Normalize a name the way the case- and accent-insensitive default MySQL
+    collation compares it, so in-memory matching agrees with the UNIQUE keys.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+class DimensionCache:
+    """
+    In-process cache from names to ids for the Artist, Genre and User tables.
+
+    Entries are kept per table. With `maxsize` set, each table keeps at most
+    that many names and evicts the least recently used one first; with
+    `maxsize=None` the cache is unbounded. Only ids that exist in the database
+    are cached, never misses.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables: Dict[str,OrderedDict] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, table: str, names: Iterable[str]) -> Dict[str,int]:
+        """
+        Return the cached ids of `names`; names that are not cached are left out.
+        """
+        found = {}
+        with self._lock:
+            entries = self._tables.get(table)
+            for name in names:
+                if entries is not None and name in entries:
+                    entries.move_to_end(name)
+                    found[name] = entries[name]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, table: str, ids: Dict[str,int]):
+        """
+        Cache name -> id pairs for a table, evicting old entries if bounded.
+        """
+        with self._lock:
+            entries = self._tables.setdefault(table, OrderedDict())
+            for name, id_ in ids.items():
+                entries[name] = id_
+                entries.move_to_end(name)
+            if self.maxsize is not None:
+                while len(entries) > self.maxsize:
+                    entries.popitem(last=False)
+
+    def invalidate(self, table: Optional[str] = None):
+        """
+        Drop the cached ids of one table, or of every table if none is given.
+        """
+        with self._lock:
+            if table is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table, None)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._tables.values())
+
+# Caches used by the loaders when no cache is passed explicitly, one per
+# connection or PooledDatabase, so ids read from one database are never used
+# with another; each goes away with its connection or pool. Like query_cache,
+# they only see this process's clear_database: after another process empties
+# the tables (AUTO_INCREMENT restarts), call
+# default_dimension_cache(mydb).invalidate() before loading again.
+_dimension_caches: "weakref.WeakKeyDictionary[object,DimensionCache]" = weakref.WeakKeyDictionary()
+# Numbers standing for the databases in the keys of the query cache.
+_database_keys: "weakref.WeakKeyDictionary[object,int]" = weakref.WeakKeyDictionary()
+_next_database_key = itertools.count(1)
+# Whether Rating is partitioned in each database, i.e. whether
+# music_db_partitioning.sql has moved its (user_id, song_id) keys to
+# RatingKey: probed the first time it matters (see _partitioned_steps) and
+# forgotten by clear_database, which may apply or drop the partitioning.
+_partitioned_databases: "weakref.WeakKeyDictionary[object,bool]" = weakref.WeakKeyDictionary()
+_databases_lock = threading.Lock()
+
+def _database(mydb):
+    """
+    The object standing for the database behind `mydb`: the PooledDatabase a
+    pooled session was borrowed from, else the connection itself.
+    """
+    return mydb.pool if isinstance(mydb, _PooledSession) else mydb
+
+def _database_key(mydb) -> int:
+    """
+    Number identifying the database behind `mydb` (see _database) in cache
+    keys; unlike id(), it is never reused once the connection or pool is gone.
+    """
+    with _databases_lock:
+        key = _database_keys.get(_database(mydb))
+        if key is None:
+            key = _database_keys[_database(mydb)] = next(_next_database_key)
+        return key
+
+def default_dimension_cache(mydb) -> DimensionCache:
+    """
+    Return the DimensionCache the loaders use for `mydb` (a connection or a
+    PooledDatabase) when they are not given one, holding at most
+    DEFAULT_DIMENSION_CACHE_SIZE names per table.
+    """
+    with _databases_lock:
+        cache = _dimension_caches.get(_database(mydb))
+        if cache is None:
+            cache = _dimension_caches[_database(mydb)] = DimensionCache(DEFAULT_DIMENSION_CACHE_SIZE)
+        return cache
+
+def _invalidate_dimension_caches():
+    """
+    Empty the default cache of every database.
+    """
+    with _databases_lock:
+        caches = list(_dimension_caches.values())
+    for cache in caches:
+        cache.invalidate()
+
+@contextmanager
+def _invalidating(cache: DimensionCache):
+    """
+    Drop everything from `cache` if the enclosed transaction fails, since ids
+    cached for rows it inserted are rolled back with it.
+    """
+    try:
+        yield
+    except BaseException:
+        cache.invalidate()
+        raise
+
+class PooledDatabase:
+    """
+    A pool of database connections that every loader and query function
+    accepts in place of a single connection.
+
+    Each call borrows a connection for its duration, so calls from different
+    threads run in parallel on separate connections. Every pooled connection
+    keeps one cursor that is reused by all the calls that borrow it; with
+    `prepared=True` that cursor uses server-side prepared statements.
+
+    Args:
+        pool_size: maximum number of open connections; callers block when all are busy
+        prepared: use server-side prepared statement cursors
+        connect: connection factory, mysql.connector.connect by default
+        **connect_kwargs: arguments for the factory (host, user, database, ...)
+    """
+
+    def __init__(self, pool_size: int = 5, prepared: bool = False,
+                 connect: Optional[Callable] = None, **connect_kwargs):
+        if connect is None:
+            import mysql.connector
+            connect = mysql.connector.connect
+        self.pool_size = pool_size
+        self.prepared = prepared
+        self._connect = functools.partial(connect, **connect_kwargs)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _open(self):
+        connection = self._connect()
+        if self.prepared:
+            cursor = connection.cursor(prepared=True)
+        else:
+            cursor = connection.cursor(buffered=True)
+        return connection, cursor
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow a connection; yields an object with the cursor()/commit()/rollback()
+        interface of a connection. Whatever the session leaves uncommitted,
+        including the read view of a query, is rolled back when it ends, so
+        the next borrower starts a fresh transaction and sees the rows other
+        sessions committed in the meantime; the connection is discarded if
+        even that fails.
+        """
+        with self._slots:
+            try:
+                connection, cursor = self._idle.get_nowait()
+            except queue.Empty:
+                connection, cursor = self._open()
+            try:
+                yield _PooledSession(self, connection, cursor)
+            finally:
+                try:
+                    # in_transaction (mysql.connector, sqlite3) saves the round
+                    # trip after a commit; without it, always roll back.
+                    if getattr(connection, "in_transaction", True):
+                        connection.rollback()
+                except Exception:
+                    connection.close()
+                    raise
+                self._idle.put((connection, cursor))
+
+    def close(self):
+        """
+        Close the idle connections of the pool.
+        """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+
+class _PooledSession:
+    """
+    A borrowed pooled connection whose cursor() returns the reused cursor.
+    """
+
+    def __init__(self, pool: PooledDatabase, connection, cursor):
+        self.pool = pool
+        self.connection = connection
+        self._cursor = cursor
+
+    def cursor(self, *args, **kwargs):
+        if args or kwargs:
+            return self.connection.cursor(*args, **kwargs)
+        return self._cursor
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+@contextmanager
+def _connection(mydb):
+    """
+    Yield a connection for one call: `mydb` itself, or a session borrowed
+    from `mydb` when it is a PooledDatabase.
+    """
+    if isinstance(mydb, PooledDatabase):
+        with mydb.session() as session:
+            yield session
+    else:
+        yield mydb
+
+class _Operation:
+    """
+    One call of a public function; instrumentation (music_db_metrics)
+    attributes the statements it sees to the operation active in its context.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+_current_operation: ContextVar[Optional[_Operation]] = ContextVar("music_db_operation", default=None)
+
+@contextmanager
+def _operation_scope(name: str, operation: Optional[_Operation] = None):
+    """
+    Make `operation` (or a new one called `name`) the active operation,
+    unless one is active already: nested calls belong to the outermost call.
+    """
+    if _current_operation.get() is not None:
+        yield _current_operation.get()
+        return
+    operation = _Operation(name) if operation is None else operation
+    token = _current_operation.set(operation)
+    try:
+        yield operation
+    finally:
+        _current_operation.reset(token)
+
+def _operation(func):
+    """
+    Decorator making each call of `func` an operation (see _Operation).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _operation_scope(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def _pooled(func):
+    """
+    Decorator running a function whose first argument is `mydb` on a
+    connection from _connection, as one operation.
+    """
+    @functools.wraps(func)
+    def wrapper(mydb, *args, **kwargs):
+        with _operation_scope(func.__name__), _connection(mydb) as connection:
+            return func(connection, *args, **kwargs)
+    return wrapper
+
+def run_concurrently(mydb: PooledDatabase, calls: Iterable[Tuple], max_workers: Optional[int] = None) -> list:
+    """
+    Run several calls on a thread pool, each on its own pooled connection.
+
+    Args:
+        mydb: the PooledDatabase every call is made against
+        calls: (function, *args) tuples, e.g. (get_most_rated_songs, (2019, 2022), 10)
+        max_workers: number of threads, the pool size by default
+
+    Returns:
+        the results of the calls, in the order given
+    """
+    with ThreadPoolExecutor(max_workers or mydb.pool_size) as executor:
+        futures = [executor.submit(func, mydb, *args) for func, *args in calls]
+        return [future.result() for future in futures]
+
+class QueryCache:
+    """
+    Memoizes the results of the get_* query functions.
+
+    Entries are keyed on the database (the connection or PooledDatabase the
+    function was called with), the function name and its other arguments,
+    expire after `ttl` seconds if a ttl is given, and are evicted least
+    recently used first beyond `maxsize` entries. Each entry remembers its
+    database and the tables its query reads, so a write only invalidates the
+    entries of its database that depend on the tables it touched. `hits` and
+    `misses` count lookups while the cache is enabled.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or _MISS if absent or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return _MISS
+
+    def put(self, key, tables: Iterable[str], value, database: Optional[int] = None):
+        """
+        Cache `value` for `key` as depending on `tables` of `database` (a _database_key).
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, database, frozenset(tables), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None, database: Optional[int] = None):
+        """
+        Drop the entries that read any of `tables` (every entry if None), of
+        `database` only if one is given (a _database_key).
+        """
+        with self._lock:
+            if tables is None and database is None:
+                self._entries.clear()
+                return
+            tables = None if tables is None else set(tables)
+            for key in [key for key, (_, of, read, _) in self._entries.items()
+                        if (database is None or of == database) and (tables is None or read & tables)]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str,int]:
+        """
+        Return the hit and miss counters and the current number of entries.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+_MISS = object()
+
+# Cache consulted by the get_* functions. Disabled by default because writes
+# made outside this module (other processes, manual SQL, other connections to
+# the same database) cannot invalidate it; enable it with
+# `query_cache.enabled = True` when this process owns the writes and makes
+# them through the connection or pool it queries.
+query_cache = QueryCache(enabled=False)
+
+# Callables notified after every committed batch of load_song_ratings (or
+# ImportJob.load_song_ratings, music_db_async.load_song_ratings) with the
+# (user_id, song_id, rating_date) of the ratings it wrote, e.g.
+# music_db_leaderboard.Leaderboard. Exceptions they raise are logged, not
+# propagated: the batch is already committed.
+rating_listeners: List[Callable[[Sequence[Tuple[int,int,str]]], None]] = []
+
+def _freeze(value):
+    """
+    Hashable equivalent of a get_* argument: sequences become tuples, sets frozensets.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+def _copy_result(value):
+    """
+    Copy of a cached get_* result down to its immutable leaves (tuples, strings, numbers).
+    """
+    if isinstance(value, dict):
+        return {key: _copy_result(item) for key, item in value.items()}
+    if isinstance(value, (list, set)):
+        return type(value)(_copy_result(item) for item in value)
+    return value
+
+def _query_cache_key(name: str, mydb, args: tuple, kwargs: dict) -> Optional[tuple]:
+    """
+    Key of a get_* call in query_cache, or None if its arguments can't be hashed.
+    """
+    key = (_database_key(mydb), name, _freeze(args),
+           tuple(sorted((keyword, _freeze(value)) for keyword, value in kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _cached_query(*tables: str):
+    """
+    Decorator routing a get_* function through query_cache; `tables` are the
+    tables whose writes invalidate its results.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(mydb, *args, **kwargs):
+            if not query_cache.enabled:
+                return func(mydb, *args, **kwargs)
+            key = _query_cache_key(func.__name__, mydb, args, kwargs)
+            if key is None:
+                return func(mydb, *args, **kwargs)
+            value = query_cache.get(key)
+            if value is _MISS:
+                value = func(mydb, *args, **kwargs)
+                query_cache.put(key, tables, value, key[0])
+            # Hand out a copy so callers can't mutate the cached result.
+            return _copy_result(value)
+        return wrapper
+    return decorate
+
+# The SQL of every operation is written once, as a generator of steps: each
+# `yield` hands a (kind, sql, params) statement to a driver and gets back its
+# result -- the rows for FETCHALL, one row for FETCHONE, the first generated id
+# for INSERT, None otherwise -- and the generator's return value is the result
+# of the operation. _run_steps drives them on a DB-API cursor; music_db_async
+# drives the same generators on an asyncio connection.
+FETCHALL = "fetchall"
+FETCHONE = "fetchone"
+INSERT = "insert"
+EXECUTE = "execute"
+EXECUTEMANY = "executemany"
+
+def _execute_step(cursor, kind: str, sql: str, params):
+    """
+    Run one step on a DB-API cursor and return what the step asks for.
+    """
+    if kind == EXECUTEMANY:
+        cursor.executemany(sql, params)
+        return None
+    cursor.execute(sql, params)
+    if kind == FETCHALL:
+        return cursor.fetchall()
+    if kind == FETCHONE:
+        return cursor.fetchone()
+    if kind == INSERT:
+        return cursor.lastrowid
+    return None
+
+def _run_steps(cursor, steps):
+    """
+    Drive a step generator to completion on `cursor` and return its result.
+    A failing statement is raised inside the generator, so it can clean up.
+    """
+    result, error = None, None
+    while True:
+        try:
+            if error is None:
+                kind, sql, params = steps.send(result)
+            else:
+                kind, sql, params = steps.throw(error)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = _execute_step(cursor, kind, sql, params), None
+        except Exception as err:
+            result, error = None, err
+
+def _select_name_ids(table: str, id_col: str, name_col: str, names: Iterable[str]):
+    """
+    Look up the ids of the given names with chunked IN (...) queries.
+
+    A name that the column collation matches under a different spelling is
+    returned under the spelling that was asked for.
+    """
+    ids = {}
+    for chunk in _chunked(names, MAX_ROWS_PER_STATEMENT):
+        rows = dict((yield FETCHALL,
+                     f"SELECT {name_col}, {id_col} FROM {table} "
+                     f"WHERE {name_col} IN ({','.join(['%s'] * len(chunk))})",
+                     tuple(chunk)))
+        folded = {_fold(name): id_ for name, id_ in rows.items()}
+        for name in chunk:
+            if name in rows:
+                ids[name] = rows[name]
+            elif _fold(name) in folded:
+                ids[name] = folded[_fold(name)]
+    return ids
+
+def _lookup_name_ids(table: str, id_col: str, name_col: str, names: Iterable[str],
+                     cache: DimensionCache):
+    """
+    Map the distinct names that exist in a dimension table to their ids,
+    consulting `cache` first and caching what the database returns.
+    """
+    wanted = set(names)
+    ids = cache.get_many(table, wanted)
+    missing = [name for name in wanted if name not in ids]
+    if missing:
+        found = yield from _select_name_ids(table, id_col, name_col, missing)
+        cache.put_many(table, found)
+        ids.update(found)
+    return ids
+
+def _resolve_name_ids(table: str, id_col: str, name_col: str, names: Iterable[str],
+                      cache: DimensionCache):
+    """
+    Map every distinct name to its id, inserting the names that do not exist yet.
+
+    Args:
+        table: dimension table (Artist, Genre, ...)
+        id_col: auto-increment key column of the table
+        name_col: unique name column of the table
+        names: names to resolve, duplicates allowed
+        cache: name -> id cache consulted before the database
+
+    Returns:
+        dict from each requested name to its id (as the step generator's result)
+    """
+    wanted = list(dict.fromkeys(names))
+    ids = yield from _lookup_name_ids(table, id_col, name_col, wanted, cache)
+    missing = [name for name in wanted if name not in ids]
+    if missing:
+        # One row per name as the collation compares them, spelled as first
+        # seen, like the row-by-row inserts would store it.
+        new_names = {}
+        for name in missing:
+            new_names.setdefault(_fold(name), name)
+        # INSERT IGNORE so a name created concurrently is not an error; sorted
+        # by collation key so concurrent loaders take the unique-key locks in
+        # the same order, whatever spelling each of them brings.
+        yield (EXECUTEMANY, f"INSERT IGNORE INTO {table} ({name_col}) VALUES (%s)",
+               [(new_names[key],) for key in sorted(new_names)])
+        found = yield from _select_name_ids(table, id_col, name_col, missing)
+        for name in missing:
+            if name not in found:
+                # Matched by the collation in a way _fold does not model.
+                row = yield FETCHONE, f"SELECT {id_col} FROM {table} WHERE {name_col}=%s", (name,)
+                found[name] = row[0]
+        cache.put_many(table, found)
+        ids.update(found)
+    return ids
+
+def _existing_pairs(table: str, columns: Tuple[str,str], pairs: Iterable[Tuple]):
+    """
+    Return the pairs among `pairs` whose values of `columns` are already in `table`.
+    """
+    found = set()
+    for chunk in _chunked(set(pairs), MAX_ROWS_PER_STATEMENT):
+        rows = yield (FETCHALL,
+                      f"SELECT {','.join(columns)} FROM {table} "
+                      f"WHERE ({','.join(columns)}) IN ({_row_placeholders(len(columns), len(chunk))})",
+                      tuple(value for pair in chunk for value in pair))
+        found.update(tuple(row) for row in rows)
+    return found
+
+def _existing_keys(table: str, columns: Tuple[str,str], keys: Iterable[Tuple[int,str]]):
+    """
+    Return the (id, name) keys among `keys` that are already in `table`, with
+    the name folded (see _fold) so callers compare the way the UNIQUE key does.
+    """
+    pairs = yield from _existing_pairs(table, columns, keys)
+    return {(id_, _fold(name)) for id_, name in pairs}
+
+def _select_song_ids(keys: Iterable[Tuple[int,str]]):
+    """
+    Map the (artist_id, title) keys that exist in Song to their song_id, keyed
+    by (artist_id, folded title).
+    """
+    ids = {}
+    for chunk in _chunked(set(keys), MAX_ROWS_PER_STATEMENT):
+        rows = yield (FETCHALL,
+                      "SELECT artist_id, title, song_id FROM Song "
+                      f"WHERE (artist_id, title) IN ({_row_placeholders(2, len(chunk))})",
+                      tuple(value for key in chunk for value in key))
+        ids.update(((artist_id, _fold(title)), song_id) for artist_id, title, song_id in rows)
+    return ids
+
+def _insert_rows(table: str, columns: Sequence[str], rows: Sequence[tuple]):
+    """
+    Insert rows with multi-row INSERT statements and return their new ids.
+
+    The ids are taken from the insert itself: a single multi-row INSERT gets a
+    consecutive auto-increment range starting at LAST_INSERT_ID(). The caller
+    must have filtered out duplicates beforehand; a plain INSERT is used so an
+    unexpected conflict raises instead of silently shifting the id range.
+    """
+    ids = []
+    for chunk in _chunked(rows, MAX_ROWS_PER_STATEMENT):
+        first_id = yield (INSERT,
+                          f"INSERT INTO {table} ({','.join(columns)}) "
+                          f"VALUES {_row_placeholders(len(columns), len(chunk))}",
+                          tuple(value for row in chunk for value in row))
+        ids.extend(range(first_id, first_id + len(chunk)))
+    return ids
+
+def _year_bounds(start_year: int, end_year: int) -> Tuple[str,str]:
+    """
+    Turn an inclusive year range into a half-open [first day, day after) date
+    range, so date columns can be compared directly and their indexes used
+    instead of being wrapped in YEAR().
+    """
+    return f"{start_year:04d}-01-01", f"{end_year + 1:04d}-01-01"
+
+def _start_checkpoint_steps(job_id: str, step: str):
+    """
+    Steps creating the checkpoint of (job_id, step) if needed;
+    the result is the number of input records it has consumed.
+    """
+    yield (EXECUTE,
+           "INSERT IGNORE INTO ImportCheckpoint (job_id, step, records_done, rejected) VALUES (%s,%s,0,0)",
+           (job_id, step))
+    row = yield (FETCHONE,
+                 "SELECT records_done FROM ImportCheckpoint WHERE job_id = %s AND step = %s",
+                 (job_id, step))
+    return row[0]
+
+def _advance_checkpoint_steps(job_id: str, step: str, records: int, rejected: int):
+    yield (EXECUTE,
+           "UPDATE ImportCheckpoint SET records_done = records_done + %s, rejected = rejected + %s "
+           "WHERE job_id = %s AND step = %s",
+           (records, rejected, job_id, step))
+
+def _stream_batches(mydb, items: Iterable, batch_size: int, cache: Optional[DimensionCache],
+                    load_batch: Callable, tables: Sequence[str], name: str,
+                    checkpoint: Optional[Tuple[str,str]] = None,
+                    on_commit: Optional[Callable[[], None]] = None) -> Iterator:
+    """
+    Feed `items` to the step generator `load_batch(batch, cache)` in chunks of `batch_size`,
+    committing after each chunk and yielding the chunk's rejections. Cached
+    query results that read `tables` are invalidated after every chunk.
+
+    Only one chunk is held in memory at a time, so `items` can be any
+    iterable or generator, however long. All chunks belong to one operation,
+    the caller's or a new one called `name`.
+
+    With a (job_id, step) `checkpoint`, the ImportCheckpoint row of that step
+    counts the records consumed, updated in each chunk's transaction, and
+    the records it already counts are skipped (see ImportJob). `on_commit`,
+    if given, is called after each chunk's commit.
+    """
+    cache = default_dimension_cache(mydb) if cache is None else cache
+    operation = _current_operation.get() or _Operation(name)
+    with _connection(mydb) as connection:
+        cursor = connection.cursor()
+        if checkpoint is not None:
+            with _operation_scope(name, operation):
+                done = _run_steps(cursor, _start_checkpoint_steps(*checkpoint))
+                connection.commit()
+            items = islice(items, done, None)
+        for batch in _chunked(items, batch_size):
+            # Entered per chunk, not around the yield, so the operation never
+            # leaks into the consumer's context between chunks.
+            with _operation_scope(name, operation), _invalidating(cache):
+                try:
+                    rejected = _run_steps(cursor, load_batch(batch, cache))
+                    if checkpoint is not None:
+                        _run_steps(cursor, _advance_checkpoint_steps(*checkpoint, len(batch), len(rejected)))
+                    connection.commit()
+                finally:
+                    query_cache.invalidate(tables, _database_key(mydb))
+                if on_commit is not None:
+                    on_commit()
+            yield from rejected
+
+def _collect_rejections(rejections: Iterable, on_reject: Optional[Callable]) -> Set:
+    """
+    Gather the output of a streaming loader into a set, or hand every item to
+    `on_reject` instead (and return an empty set) when a callback is given.
+    """
+    if on_reject is None:
+        return set(rejections)
+    for rejection in rejections:
+        on_reject(rejection)
+    return set()
+
+def _stream_query(mydb, steps, fetch_size: int, name: str, first_column: bool = False) -> Iterator:
+    """
+    Run the single query of the step generator `steps` (one of the get_*
+    step functions) on an unbuffered cursor and yield its rows, `fetch_size`
+    at a time, instead of letting `steps` build the result in memory. With
+    `first_column`, each row's first value is yielded instead of the row.
+
+    The connection is held until the generator is exhausted or closed;
+    closing it early reads (and drops) the rest of the result, which the
+    MySQL protocol requires before the connection can run another statement.
+    """
+    kind, sql, params = next(steps)
+    steps.close()
+    operation = _current_operation.get() or _Operation(name)
+    with _connection(mydb) as connection:
+        cursor = connection.cursor(buffered=False)
+        with _operation_scope(name, operation):
+            cursor.execute(sql, params)
+        try:
+            while True:
+                # Entered per chunk, not around the yield (see _stream_batches).
+                with _operation_scope(name, operation):
+                    rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                if first_column:
+                    for row in rows:
+                        yield row[0]
+                else:
+                    yield from rows
+        finally:
+            with _operation_scope(name, operation):
+                while cursor.fetchmany(fetch_size):
+                    pass
+                cursor.close()
+                connection.commit()
+
+def _sql_statements(path: str) -> List[str]:
+    """
+    Split a schema script into its statements. Expects the layout of
+    music_db.sql: `--` comment lines and statements ending with `;` at the end
+    of a line (no DELIMITER blocks).
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if not line.lstrip().startswith("--")]
+    statements, current = [], []
+    for line in lines:
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("".join(current).strip().rstrip(";"))
+            current = []
+    if "".join(current).strip():
+        statements.append("".join(current).strip())
+    return statements
+
+def _partitioned_steps(database=None):
+    """
+    Steps returning whether Rating is partitioned in `database` (see
+    _database), which holds if RatingKey exists. The answer is cached per
+    database; without one, RatingKey is probed every time.
+    """
+    with _databases_lock:
+        partitioned = None if database is None else _partitioned_databases.get(database)
+    if partitioned is None:
+        try:
+            yield FETCHALL, "SELECT 1 FROM RatingKey WHERE 1 = 0", ()
+            partitioned = True
+        except Exception:
+            partitioned = False
+        if database is not None:
+            with _databases_lock:
+                _partitioned_databases[database] = partitioned
+    return partitioned
+
+def _rating_key_table(partitioned: bool) -> str:
+    """
+    The table holding every (user_id, song_id) that has been rated: Rating,
+    or RatingKey once Rating is partitioned, which also keeps the keys of
+    archived ratings.
+    """
+    return "RatingKey" if partitioned else "Rating"
+
+def _forget_partitioning(mydb):
+    with _databases_lock:
+        _partitioned_databases.pop(_database(mydb), None)
+
+def _default_schema_files(mydb, partitioned: bool) -> Tuple[str,...]:
+    """
+    The scripts clear_database(mode="recreate") runs unless told otherwise.
+    """
+    schema_files = tuple(getattr(mydb, "schema_files", SCHEMA_FILES))
+    if partitioned:
+        schema_files += (PARTITIONING_FILE,)
+    return schema_files
+
+def _clear_database_steps(mode: str = "delete", schema_files: Sequence[str] = SCHEMA_FILES,
+                          partitioned: bool = False):
+    if mode not in ("delete", "truncate", "recreate"):
+        raise ValueError(f"unknown clear_database mode: {mode!r}")
+    # Deleting in order of Foreign Key dependencies (Child -> Parent)
+    # ImportCheckpoint and FeedFingerprint go too: they would skip input on the emptied tables.
+    tables = ['ImportCheckpoint', 'FeedFingerprint', 'ArtistYearSingleCount', 'ArtistSummary',
+              'UserYearRatingCount', 'SongYearRatingCount', 'GenreSongCount',
+              'Rating', 'SongGenre', 'Song', 'Album', 'User', 'Genre', 'Artist']
+    if partitioned:
+        # Archived years: the tables their partitions were exchanged into,
+        # then their log and keys.
+        try:
+            rows = yield FETCHALL, "SELECT archive_table FROM RatingArchive WHERE archive_table IS NOT NULL", ()
+        except Exception:
+            # Not partitioned yet: "recreate" is about to apply music_db_partitioning.sql.
+            rows = []
+        for (archive_table,) in rows:
+            yield EXECUTE, f"DROP TABLE IF EXISTS {archive_table}", ()
+        tables.insert(0, 'RatingArchive')
+        tables.insert(tables.index('Rating'), 'RatingKey')
+    if mode == "delete":
+        for table in tables:
+            yield EXECUTE, f"DELETE FROM {table}", ()
+    elif mode == "truncate":
+        yield EXECUTE, "SET FOREIGN_KEY_CHECKS = 0", ()
+        try:
+            for table in tables:
+                yield EXECUTE, f"TRUNCATE TABLE {table}", ()
+        finally:
+            # Session setting: restore it even if a TRUNCATE failed, since a
+            # pooled connection goes on to serve other calls.
+            yield EXECUTE, "SET FOREIGN_KEY_CHECKS = 1", ()
+    else:
+        for path in schema_files:
+            for statement in _sql_statements(path):
+                yield EXECUTE, statement, ()
+
+@_pooled
+def clear_database(mydb, mode: str = "delete", schema_files: Optional[Sequence[str]] = None):
     """
     Deletes all the rows from all the tables of the database.
     If a table has a foreign key to a parent table, it is deleted before 
     deleting the parent table, otherwise the database system will throw an error. 
 
+    "delete" removes the rows one by one and is logged row by row, so its cost
+    grows with the data. "truncate" turns foreign key checks off for the
+    session, truncates every table (which also resets AUTO_INCREMENT) and turns
+    them back on; "recreate" drops and recreates the tables, triggers and
+    indexes from `schema_files`. Both take about the same time however many
+    rows there are, but commit implicitly and cannot be rolled back. When
+    Rating is partitioned, RatingArchive is emptied too and the tables of
+    archived partitions (see music_db_partitions) are dropped, whatever the
+    mode.
+
+    Also invalidates the dimension caches of every database (another
+    connection may have cached ids of the rows deleted) and the query cache.
+
     Args:
         mydb: database connection
+        mode: "delete", "truncate" or "recreate"
+        schema_files: scripts run by "recreate"; by default the connection's
+            `schema_files` if it has them (other backends), else SCHEMA_FILES
+            (music_db.sql and music_db_indexes.sql), followed by music_db_partitioning.sql
+            when Rating is partitioned
     """
     cursor = mydb.cursor()
-    # Deleting in order of Foreign Key dependencies (Child -> Parent)
-    tables = ['Rating', 'SongGenre', 'Song', 'Album', 'User', 'Genre', 'Artist']
-    for table in tables:
-        cursor.execute(f"DELETE FROM {table}")
+    partitioned = _run_steps(cursor, _partitioned_steps())
+    if schema_files is None:
+        schema_files = _default_schema_files(mydb, partitioned)
+    _run_steps(cursor, _clear_database_steps(mode, schema_files, partitioned))
     mydb.commit()
+    _forget_partitioning(mydb)
+    _invalidate_dimension_caches()
+    query_cache.invalidate()
 
-def load_single_songs(mydb, single_songs: List[Tuple[str,Tuple[str,...],str,str]]) -> Set[Tuple[str,str]]:
+def iter_load_single_songs(mydb, single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]],
+                           batch_size: int = DEFAULT_BATCH_SIZE,
+                           cache: Optional[DimensionCache] = None) -> Iterator[Tuple[str,str]]:
+    """
+    Streaming version of load_single_songs: consumes `single_songs` lazily and
+    yields each rejected (title, artist_name) once its batch is committed.
+    A rejection that occurs in several batches is yielded once per batch.
+    """
+    return _stream_batches(mydb, single_songs, batch_size, cache, _load_single_songs_batch,
+                           ("Artist", "Song", "Genre", "SongGenre"), "iter_load_single_songs")
+
+@_operation
+def load_single_songs(mydb, single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]],
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      cache: Optional[DimensionCache] = None,
+                      on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
     """
     Add single songs to the database. 
+
+    Songs are processed in batches of `batch_size`: all artists and genres of a
+    batch are resolved with a few set-based statements, the songs and their
+    SongGenre rows are written with multi-row inserts, and the batch is
+    committed once.
+
+    Args:
+        mydb: database connection
+        single_songs: (title, genres, artist_name, release_date) tuples
+        batch_size: number of songs written per transaction
+        cache: artist/genre id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of
+            collecting them, which keeps memory flat on huge inputs
+
+    Returns:
+        set of (title, artist_name) for the songs that were rejected because
+        the artist already has a song with that title (empty with on_reject)
+    """
+    return _collect_rejections(iter_load_single_songs(mydb, single_songs, batch_size, cache), on_reject)
+
+def _load_single_songs_batch(batch: List[Tuple[str,Tuple[str,...],str,str]], cache: DimensionCache):
+    """
+    Steps writing one batch of single songs, without committing;
+    the result is the set of rejections.
     """
-    cursor = mydb.cursor()
     rejected_songs = set()
 
-    for title, genres, artist_name, release_date in single_songs:
-        # 1. Get or Insert Artist
-        cursor.execute("SELECT artist_id FROM Artist WHERE name=%s", (artist_name,))
-        res = cursor.fetchone()
-        if res:
-            artist_id = res[0]
-        else:
-            cursor.execute("INSERT INTO Artist (name) VALUES (%s)", (artist_name,))
-            mydb.commit()
-            artist_id = cursor.lastrowid
-
-        # 2. Insert Song (Single -> album_id is NULL)
-        cursor.execute(
-            "INSERT IGNORE INTO Song (title, artist_id, album_id, release_date) VALUES (%s,%s,NULL,%s)",
-            (title, artist_id, release_date)
-        )
-        mydb.commit()
-
-        # Check if insertion was ignored (duplicate)
-        if cursor.rowcount == 0:
+    # 1. Get or Insert every Artist of the batch
+    artist_ids = yield from _resolve_name_ids("Artist", "artist_id", "name",
+                                              (artist_name for _, _, artist_name, _ in batch), cache)
+
+    # 2. Reject titles the artist already has, in the database or earlier in the batch
+    taken = yield from _existing_keys("Song", ("artist_id", "title"),
+                                      ((artist_ids[artist_name], title) for title, _, artist_name, _ in batch))
+    new_songs = []
+    for title, genres, artist_name, release_date in batch:
+        key = (artist_ids[artist_name], _fold(title))
+        if key in taken:
             rejected_songs.add((title, artist_name))
-            continue 
-
-        # Retrieve the new song_id
-        cursor.execute("SELECT song_id FROM Song WHERE title=%s AND artist_id=%s", (title, artist_id))
-        song_id = cursor.fetchone()[0]
-
-        # 3. Handle Genres
-        for genre_name in genres:
-            cursor.execute("SELECT genre_id FROM Genre WHERE name=%s", (genre_name,))
-            res = cursor.fetchone()
-            if res:
-                genre_id = res[0]
-            else:
-                cursor.execute("INSERT INTO Genre (name) VALUES (%s)", (genre_name,))
-                mydb.commit()
-                genre_id = cursor.lastrowid
+            continue
+        taken.add(key)
+        new_songs.append((title, key[0], release_date, genres))
+
+    if not new_songs:
+        return rejected_songs
 
-            cursor.execute(
-                "INSERT IGNORE INTO SongGenre (song_id, genre_id) VALUES (%s,%s)",
-                (song_id, genre_id)
-            )
-            mydb.commit()
+    # 3. Insert Songs (Single -> album_id is NULL)
+    song_ids = yield from _insert_rows("Song", ("title", "artist_id", "album_id", "release_date"),
+                                       [(title, artist_id, None, release_date)
+                                       for title, artist_id, release_date, _ in new_songs])
+
+    # 4. Handle Genres
+    genre_ids = yield from _resolve_name_ids("Genre", "genre_id", "name",
+                                             (genre for *_, genres in new_songs for genre in genres), cache)
+    song_genres = {(song_id, genre_ids[genre])
+                   for song_id, (*_, genres) in zip(song_ids, new_songs) for genre in genres}
+    for chunk in _chunked(song_genres, MAX_ROWS_PER_STATEMENT):
+        yield EXECUTEMANY, "INSERT IGNORE INTO SongGenre (song_id, genre_id) VALUES (%s,%s)", chunk
 
     return rejected_songs
 
-def get_most_prolific_individual_artists(mydb, n: int, year_range: Tuple[int,int]) -> List[Tuple[str,int]]:   
+def _most_prolific_individual_artists_steps(n: int, year_range: Tuple[int,int], use_rollups: bool):
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT a.name, CAST(SUM(c.single_count) AS SIGNED) as song_count "
+                      "FROM ArtistYearSingleCount c JOIN Artist a ON a.artist_id = c.artist_id "
+                      "WHERE c.release_year BETWEEN %s AND %s "
+                      "GROUP BY a.artist_id "
+                      "ORDER BY song_count DESC, a.name ASC LIMIT %s",
+                      (year_range[0], year_range[1], n))
+        return list(rows)
+    start_date, end_date = _year_bounds(*year_range)
+    rows = yield (FETCHALL,
+                  "SELECT a.name, COUNT(s.song_id) as song_count "
+                  "FROM Artist a JOIN Song s ON a.artist_id = s.artist_id "
+                  "WHERE s.album_id IS NULL AND s.release_date >= %s AND s.release_date < %s "
+                  "GROUP BY a.artist_id "
+                  "ORDER BY song_count DESC, a.name ASC LIMIT %s",
+                  (start_date, end_date, n))
+    return list(rows)
+
+@_cached_query("Artist", "Song")
+@_pooled
+def get_most_prolific_individual_artists(mydb, n: int, year_range: Tuple[int,int],
+                                         use_rollups: bool = True) -> List[Tuple[str,int]]:   
     """
     Get the top n most prolific individual artists by number of singles released in a year range. 
     Break ties by alphabetical order of artist name.
+
+    Sums the per-(artist, year) ArtistYearSingleCount rollup unless
+    `use_rollups` is False, in which case Song is aggregated directly.
     """
-    cursor = mydb.cursor()
-    start_year, end_year = year_range
-    cursor.execute(
-        "SELECT a.name, COUNT(s.song_id) as song_count "
-        "FROM Artist a JOIN Song s ON a.artist_id = s.artist_id "
-        "WHERE s.album_id IS NULL AND YEAR(s.release_date) BETWEEN %s AND %s "
-        "GROUP BY a.artist_id "
-        "ORDER BY song_count DESC, a.name ASC LIMIT %s",
-        (start_year, end_year, n)
-    )
-    return cursor.fetchall()
-
-def get_artists_last_single_in_year(mydb, year: int) -> Set[str]:
+    return _run_steps(mydb.cursor(), _most_prolific_individual_artists_steps(n, year_range, use_rollups))
+
+def iter_get_most_prolific_individual_artists(mydb, n: int, year_range: Tuple[int,int], use_rollups: bool = True,
+                                              fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Tuple[str,int]]:
+    """
+    Streaming version of get_most_prolific_individual_artists: yields the rows
+    as they are fetched, `fetch_size` per round trip, without the query cache.
+    """
+    return _stream_query(mydb, _most_prolific_individual_artists_steps(n, year_range, use_rollups), fetch_size,
+                         "iter_get_most_prolific_individual_artists")
+
+def _artists_last_single_in_year_steps(year: int, use_rollups: bool):
+    start_date, end_date = _year_bounds(year, year)
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT a.name "
+                      "FROM ArtistSummary sm JOIN Artist a ON a.artist_id = sm.artist_id "
+                      "WHERE sm.last_single_date >= %s AND sm.last_single_date < %s",
+                      (start_date, end_date))
+        return {row[0] for row in rows}
+    rows = yield (FETCHALL,
+                  "SELECT a.name "
+                  "FROM Artist a "
+                  "JOIN Song s ON a.artist_id = s.artist_id "
+                  "WHERE s.album_id IS NULL "
+                  "GROUP BY a.artist_id "
+                  "HAVING MAX(s.release_date) >= %s AND MAX(s.release_date) < %s",
+                  (start_date, end_date))
+    return {row[0] for row in rows}
+
+@_cached_query("Artist", "Song")
+@_pooled
+def get_artists_last_single_in_year(mydb, year: int, use_rollups: bool = True) -> Set[str]:
     """
     Get all artists who released their last single in the given year.
+
+    Reads the indexed last_single_date of ArtistSummary unless `use_rollups`
+    is False, in which case the singles in Song are grouped by artist.
     """
-    cursor = mydb.cursor()
-    cursor.execute(
-        "SELECT a.name "
-        "FROM Artist a "
-        "JOIN Song s ON a.artist_id = s.artist_id "
-        "WHERE s.album_id IS NULL "
-        "GROUP BY a.artist_id "
-        "HAVING YEAR(MAX(s.release_date)) = %s",
-        (year,)
-    )
-    return {row[0] for row in cursor.fetchall()}
-    
-def load_albums(mydb, albums: List[Tuple[str,str,str,str,List[str]]]) -> Set[Tuple[str,str]]:
+    return _run_steps(mydb.cursor(), _artists_last_single_in_year_steps(year, use_rollups))
+
+def iter_get_artists_last_single_in_year(mydb, year: int, use_rollups: bool = True,
+                                         fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[str]:
+    """
+    Streaming version of get_artists_last_single_in_year: yields each artist
+    name once, as fetched, without the query cache.
+    """
+    return _stream_query(mydb, _artists_last_single_in_year_steps(year, use_rollups), fetch_size,
+                         "iter_get_artists_last_single_in_year", first_column=True)
+
+def iter_load_albums(mydb, albums: Iterable[Tuple[str,str,str,str,List[str]]],
+                     batch_size: int = DEFAULT_BATCH_SIZE,
+                     cache: Optional[DimensionCache] = None) -> Iterator[Tuple[str,str]]:
+    """
+    Streaming version of load_albums: consumes `albums` lazily and yields each
+    rejected (album_name, artist_name) once its batch is committed.
+    """
+    return _stream_batches(mydb, albums, batch_size, cache, _load_albums_batch,
+                           ("Artist", "Album", "Song", "Genre", "SongGenre"), "iter_load_albums")
+
+@_operation
+def load_albums(mydb, albums: Iterable[Tuple[str,str,str,str,List[str]]],
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                cache: Optional[DimensionCache] = None,
+                on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
     """
     Add albums to the database. 
+
+    Albums are processed in batches of `batch_size`. For each batch the existing
+    (artist_id, title) and (artist_id, album name) pairs are fetched at once,
+    Album, Song and SongGenre rows go in with multi-row inserts, and the batch
+    is committed once.
+
+    Args:
+        mydb: database connection
+        albums: (album_name, genre_name, artist_name, release_date, songs) tuples
+        batch_size: number of albums written per transaction
+        cache: artist/genre id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of collecting them
+
+    Returns:
+        set of (album_name, artist_name) for the albums that were rejected,
+        either because the artist already has an album with that name or
+        because one of its songs duplicates a title the artist already has
+        (empty with on_reject)
+    """
+    return _collect_rejections(iter_load_albums(mydb, albums, batch_size, cache), on_reject)
+
+def _load_albums_batch(batch: List[Tuple[str,str,str,str,List[str]]], cache: DimensionCache):
+    """
+    Steps writing one batch of albums, without committing;
+    the result is the set of rejections.
     """
-    cursor = mydb.cursor()
     rejected_albums = set()
 
-    for album_name, genre_name, artist_name, release_date, songs in albums:
-        # 1. Get or Insert Artist
-        cursor.execute("SELECT artist_id FROM Artist WHERE name=%s", (artist_name,))
-        res = cursor.fetchone()
-        if res:
-            artist_id = res[0]
-        else:
-            cursor.execute("INSERT INTO Artist (name) VALUES (%s)", (artist_name,))
-            mydb.commit()
-            artist_id = cursor.lastrowid
-        
-        # --- FIX START: CHECK FOR DUPLICATE SONGS BEFORE INSERTING ALBUM ---
-        # The prompt implies if an artist already has a song with a title, 
-        # they can't record it again. If this album contains such a song, reject the album.
-        
-        # Get all existing song titles for this artist
-        cursor.execute("SELECT title FROM Song WHERE artist_id=%s", (artist_id,))
-        existing_artist_songs = {row[0] for row in cursor.fetchall()}
-        
-        # Check if any song in the new album is already in the database for this artist
-        has_duplicate_song = False
-        for song in songs:
-            if song in existing_artist_songs:
-                has_duplicate_song = True
-                break
-        
-        if has_duplicate_song:
+    # 1. Get or Insert every Artist of the batch
+    artist_ids = yield from _resolve_name_ids("Artist", "artist_id", "name",
+                                              (artist_name for _, _, artist_name, _, _ in batch), cache)
+
+    # 2. Prefetch the song titles and album names these artists already use
+    taken_titles = yield from _existing_keys("Song", ("artist_id", "title"),
+                                             ((artist_ids[artist_name], song)
+                                             for _, _, artist_name, _, songs in batch for song in songs))
+    taken_albums = yield from _existing_keys("Album", ("artist_id", "name"),
+                                             ((artist_ids[artist_name], album_name)
+                                             for album_name, _, artist_name, _, _ in batch))
+
+    # 3. Decide album by album, in input order, so that an album is also checked
+    # against the songs and names of the albums accepted before it in the batch.
+    # If an artist already has a song with one of the album's titles, they can't
+    # record it again and the whole album is rejected.
+    # In input order, so a new genre is stored as first spelled.
+    genre_names = {}
+    new_albums = []
+    for album_name, genre_name, artist_name, release_date, songs in batch:
+        artist_id = artist_ids[artist_name]
+        if any((artist_id, _fold(song)) in taken_titles for song in songs):
             rejected_albums.add((album_name, artist_name))
             continue
-        # --- FIX END ---
-
-        # 2. Get or Insert Genre
-        cursor.execute("SELECT genre_id FROM Genre WHERE name=%s", (genre_name,))
-        res = cursor.fetchone()
-        if res:
-            genre_id = res[0]
-        else:
-            cursor.execute("INSERT INTO Genre (name) VALUES (%s)", (genre_name,))
-            mydb.commit()
-            genre_id = cursor.lastrowid
-
-        # 3. Insert Album
-        cursor.execute(
-            "INSERT IGNORE INTO Album (name, artist_id, release_date, genre_id) VALUES (%s,%s,%s,%s)",
-            (album_name, artist_id, release_date, genre_id)
-        )
-        mydb.commit()
-
-        if cursor.rowcount == 0:
+        genre_names.setdefault(genre_name)
+        if (artist_id, _fold(album_name)) in taken_albums:
             rejected_albums.add((album_name, artist_name))
-            continue 
-
-        # Get album_id for linking songs
-        cursor.execute("SELECT album_id FROM Album WHERE name=%s AND artist_id=%s", (album_name, artist_id))
-        album_id = cursor.fetchone()[0]
-
-        # 4. Insert Songs
-        for song_title in songs:
-            # We already checked for duplicates above, so these should insert fine.
-            # But we still use INSERT IGNORE just in case.
-            cursor.execute(
-                "INSERT IGNORE INTO Song (title, artist_id, album_id, release_date) VALUES (%s,%s,%s,%s)",
-                (song_title, artist_id, album_id, release_date)
-            )
-            mydb.commit()
-            
-            # Map song to the album's genre
-            cursor.execute("SELECT song_id FROM Song WHERE title=%s AND artist_id=%s AND album_id=%s", 
-                           (song_title, artist_id, album_id))
-            song_res = cursor.fetchone()
-            
-            if song_res:
-                song_id = song_res[0]
-                cursor.execute(
-                    "INSERT IGNORE INTO SongGenre (song_id, genre_id) VALUES (%s,%s)",
-                    (song_id, genre_id)
-                )
-                mydb.commit()
+            continue
+        taken_albums.add((artist_id, _fold(album_name)))
+        # A title repeated inside the album is only recorded once.
+        titles, seen = [], set()
+        for song in songs:
+            if _fold(song) not in seen:
+                seen.add(_fold(song))
+                titles.append(song)
+        taken_titles.update((artist_id, _fold(title)) for title in titles)
+        new_albums.append((album_name, genre_name, artist_id, release_date, titles))
+
+    # 4. Get or Insert Genres
+    genre_ids = yield from _resolve_name_ids("Genre", "genre_id", "name", genre_names, cache)
+    if not new_albums:
+        return rejected_albums
+
+    # 5. Insert Albums
+    album_ids = yield from _insert_rows("Album", ("name", "artist_id", "release_date", "genre_id"),
+                                        [(album_name, artist_id, release_date, genre_ids[genre_name])
+                                        for album_name, genre_name, artist_id, release_date, _ in new_albums])
+
+    # 6. Insert Songs, each mapped to its album's genre
+    tracks = [(title, artist_id, album_id, release_date, genre_ids[genre_name])
+              for album_id, (_, genre_name, artist_id, release_date, titles) in zip(album_ids, new_albums)
+              for title in titles]
+    song_ids = yield from _insert_rows("Song", ("title", "artist_id", "album_id", "release_date"),
+                                       [track[:4] for track in tracks])
+    song_genres = [(song_id, track[4]) for song_id, track in zip(song_ids, tracks)]
+    for chunk in _chunked(song_genres, MAX_ROWS_PER_STATEMENT):
+        yield EXECUTEMANY, "INSERT IGNORE INTO SongGenre (song_id, genre_id) VALUES (%s,%s)", chunk
 
     return rejected_albums
 
-def get_top_song_genres(mydb, n: int) -> List[Tuple[str,int]]:
+def _fingerprint(*fields) -> bytes:
+    """
+    16-byte digest of a feed record's fields, names folded (see _fold) so
+    that spellings the loaders treat as equal give the same fingerprint.
+    """
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=16).digest()
+
+def _single_song_fingerprint(single_song: Tuple[str,Tuple[str,...],str,str]) -> bytes:
+    title, genres, artist_name, release_date = single_song
+    return _fingerprint("single", _fold(title), _fold(artist_name), str(release_date),
+                        *sorted({_fold(genre) for genre in genres}))
+
+def _album_fingerprint(album: Tuple[str,str,str,str,List[str]]) -> bytes:
+    album_name, genre_name, artist_name, release_date, songs = album
+    return _fingerprint("album", _fold(album_name), _fold(genre_name), _fold(artist_name), str(release_date),
+                        *(_fold(song) for song in songs))
+
+def _sync_batch(fingerprint: Callable, load_batch: Callable, batch: list, cache: DimensionCache):
+    """
+    Steps passing the records of `batch` whose fingerprint is not in
+    FeedFingerprint on to `load_batch`, then recording their fingerprints;
+    the result is the set of rejections.
+    """
+    prints = [fingerprint(record) for record in batch]
+    known = set()
+    for chunk in _chunked(set(prints), MAX_ROWS_PER_STATEMENT):
+        rows = yield (FETCHALL,
+                      f"SELECT fingerprint FROM FeedFingerprint WHERE fingerprint IN ({','.join(['%s'] * len(chunk))})",
+                      tuple(chunk))
+        known.update(bytes(row[0]) for row in rows)
+    pending, new_prints = [], []
+    for record, print_ in zip(batch, prints):
+        if print_ in known:
+            continue
+        known.add(print_)
+        pending.append(record)
+        new_prints.append((print_,))
+    if not pending:
+        return set()
+    rejected = yield from load_batch(pending, cache)
+    # A rejection is final (rows are never updated or deleted), so the
+    # fingerprint of a rejected record is kept too.
+    for chunk in _chunked(new_prints, MAX_ROWS_PER_STATEMENT):
+        yield EXECUTEMANY, "INSERT IGNORE INTO FeedFingerprint (fingerprint) VALUES (%s)", chunk
+    return rejected
+
+@_operation
+def sync_single_songs(mydb, single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]],
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      cache: Optional[DimensionCache] = None,
+                      on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+    """
+    Delta-sync a full feed of single songs: like load_single_songs, but a
+    record identical to one synced before (same title, artist, genres and
+    date, see FeedFingerprint) is skipped with one indexed lookup per chunk
+    of the batch, so a feed that barely changed costs about as much as its changes.
+
+    New and changed records go through the load_single_songs insert path;
+    a changed record whose song already exists is rejected there as usual.
+    The first sync of songs loaded with load_single_songs costs a full load.
+
+    Args:
+        mydb: database connection
+        single_songs: (title, genres, artist_name, release_date) tuples
+        batch_size: number of songs checked and written per transaction
+        cache: artist/genre id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of collecting them
+
+    Returns:
+        set of (title, artist_name) for the new or changed songs that were
+        rejected (empty with on_reject)
+    """
+    load_batch = functools.partial(_sync_batch, _single_song_fingerprint, _load_single_songs_batch)
+    return _collect_rejections(_stream_batches(mydb, single_songs, batch_size, cache, load_batch,
+                                               ("Artist", "Song", "Genre", "SongGenre"), "sync_single_songs"),
+                               on_reject)
+
+@_operation
+def sync_albums(mydb, albums: Iterable[Tuple[str,str,str,str,List[str]]],
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                cache: Optional[DimensionCache] = None,
+                on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+    """
+    Delta-sync a full feed of albums: like load_albums, but an album identical
+    to one synced before (same name, genre, artist, date and song list) is
+    skipped (see sync_single_songs).
+
+    Args:
+        mydb: database connection
+        albums: (album_name, genre_name, artist_name, release_date, songs) tuples
+        batch_size: number of albums checked and written per transaction
+        cache: artist/genre id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of collecting them
+
+    Returns:
+        set of (album_name, artist_name) for the new or changed albums that
+        were rejected (empty with on_reject)
+    """
+    load_batch = functools.partial(_sync_batch, _album_fingerprint, _load_albums_batch)
+    return _collect_rejections(_stream_batches(mydb, albums, batch_size, cache, load_batch,
+                                               ("Artist", "Album", "Song", "Genre", "SongGenre"), "sync_albums"),
+                               on_reject)
+
+def _top_song_genres_steps(n: int, use_rollups: bool):
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT g.name, gc.song_count "
+                      "FROM GenreSongCount gc JOIN Genre g ON g.genre_id = gc.genre_id "
+                      "WHERE gc.song_count > 0 "
+                      "ORDER BY gc.song_count DESC, g.name ASC LIMIT %s",
+                      (n,))
+        return list(rows)
+    rows = yield (FETCHALL,
+                  "SELECT g.name, COUNT(sg.song_id) as song_count "
+                  "FROM Genre g JOIN SongGenre sg ON g.genre_id = sg.genre_id "
+                  "GROUP BY g.genre_id "
+                  "ORDER BY song_count DESC, g.name ASC LIMIT %s",
+                  (n,))
+    return list(rows)
+
+@_cached_query("Genre", "SongGenre")
+@_pooled
+def get_top_song_genres(mydb, n: int, use_rollups: bool = True) -> List[Tuple[str,int]]:
     """
     Get n genres that are most represented in terms of number of songs in that genre.
+
+    Reads the GenreSongCount rollup unless `use_rollups` is False, in which
+    case SongGenre is aggregated directly.
     """
-    cursor = mydb.cursor()
-    cursor.execute(
-        "SELECT g.name, COUNT(sg.song_id) as song_count "
-        "FROM Genre g JOIN SongGenre sg ON g.genre_id = sg.genre_id "
-        "GROUP BY g.genre_id "
-        "ORDER BY song_count DESC, g.name ASC LIMIT %s",
-        (n,)
-    )
-    return cursor.fetchall()
+    return _run_steps(mydb.cursor(), _top_song_genres_steps(n, use_rollups))
 
-def get_album_and_single_artists(mydb) -> Set[str]:
+def iter_get_top_song_genres(mydb, n: int, use_rollups: bool = True,
+                             fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Tuple[str,int]]:
     """
-    Get artists who have released albums as well as singles.
+    Streaming version of get_top_song_genres, without the query cache.
     """
-    cursor = mydb.cursor()
+    return _stream_query(mydb, _top_song_genres_steps(n, use_rollups), fetch_size, "iter_get_top_song_genres")
+
+def _album_and_single_artists_steps(use_rollups: bool):
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT a.name "
+                      "FROM ArtistSummary sm JOIN Artist a ON a.artist_id = sm.artist_id "
+                      "WHERE sm.single_count > 0 AND sm.album_song_count > 0",
+                      ())
+        return {row[0] for row in rows}
     # Updated to use a cleaner subquery logic that is more robust
-    cursor.execute(
-        "SELECT name FROM Artist "
-        "WHERE artist_id IN (SELECT artist_id FROM Song WHERE album_id IS NULL) "
-        "AND artist_id IN (SELECT artist_id FROM Song WHERE album_id IS NOT NULL)"
-    )
-    return {row[0] for row in cursor.fetchall()}
-    
-def load_users(mydb, users: List[str]) -> Set[str]:
+    rows = yield (FETCHALL,
+                  "SELECT name FROM Artist "
+                  "WHERE artist_id IN (SELECT artist_id FROM Song WHERE album_id IS NULL) "
+                  "AND artist_id IN (SELECT artist_id FROM Song WHERE album_id IS NOT NULL)",
+                  ())
+    return {row[0] for row in rows}
+
+@_cached_query("Artist", "Song")
+@_pooled
+def get_album_and_single_artists(mydb, use_rollups: bool = True) -> Set[str]:
+    """
+    Get artists who have released albums as well as singles.
+
+    Reads the per-artist counts of ArtistSummary unless `use_rollups` is
+    False, in which case Song is searched directly.
+    """
+    return _run_steps(mydb.cursor(), _album_and_single_artists_steps(use_rollups))
+
+def iter_get_album_and_single_artists(mydb, use_rollups: bool = True,
+                                      fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[str]:
+    """
+    Streaming version of get_album_and_single_artists: yields each artist
+    name once, as fetched, without the query cache.
+    """
+    return _stream_query(mydb, _album_and_single_artists_steps(use_rollups), fetch_size,
+                         "iter_get_album_and_single_artists", first_column=True)
+
+def iter_load_users(mydb, users: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                    cache: Optional[DimensionCache] = None) -> Iterator[str]:
+    """
+    Streaming version of load_users: consumes `users` lazily and yields each
+    rejected username once its batch is committed.
+    """
+    return _stream_batches(mydb, users, batch_size, cache, _load_users_batch, ("User",), "iter_load_users")
+
+@_operation
+def load_users(mydb, users: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+               cache: Optional[DimensionCache] = None,
+               on_reject: Optional[Callable[[str], None]] = None) -> Set[str]:
     """
     Add users to the database. 
+
+    Args:
+        mydb: database connection
+        users: usernames
+        batch_size: number of users written per transaction
+        cache: user id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of collecting them
+
+    Returns:
+        set of usernames that already existed (empty with on_reject)
+    """
+    return _collect_rejections(iter_load_users(mydb, users, batch_size, cache), on_reject)
+
+def _load_users_batch(batch: List[str], cache: DimensionCache):
+    """
+    Steps writing one batch of users, without committing;
+    the result is the set of rejections.
     """
-    cursor = mydb.cursor()
     rejected_users = set()
-    for username in users:
-        cursor.execute("INSERT IGNORE INTO User (username) VALUES (%s)", (username,))
-        mydb.commit()
-        if cursor.rowcount == 0:
+    existing = yield from _lookup_name_ids("User", "user_id", "username", batch, cache)
+    taken = {_fold(username) for username in existing}
+    new_users = []
+    for username in batch:
+        if _fold(username) in taken:
             rejected_users.add(username)
+            continue
+        taken.add(_fold(username))
+        new_users.append(username)
+    user_ids = yield from _insert_rows("User", ("username",), [(username,) for username in new_users])
+    cache.put_many("User", dict(zip(new_users, user_ids)))
     return rejected_users
 
-def load_song_ratings(mydb, song_ratings: List[Tuple[str,Tuple[str,str],int, str]]) -> Set[Tuple[str,str,str]]:
+def iter_load_song_ratings(mydb, song_ratings: Iterable[Tuple[str,Tuple[str,str],int, str]],
+                           batch_size: int = DEFAULT_BATCH_SIZE,
+                           cache: Optional[DimensionCache] = None) -> Iterator[Tuple[str,str,str]]:
+    """
+    Streaming version of load_song_ratings: consumes `song_ratings` lazily and
+    yields each rejected (username, artist_name, song_title) once its batch is
+    committed.
+    """
+    return _song_rating_batches(mydb, song_ratings, batch_size, cache, "iter_load_song_ratings")
+
+def _notify_rating_listeners(ratings: Sequence[Tuple[int,int,str]]):
+    """
+    Hand committed ratings to every rating listener. The batch is committed
+    whatever a listener does, so a failing one is logged and the load goes on.
+    """
+    for listener in list(rating_listeners):
+        try:
+            listener(ratings)
+        except Exception:
+            logger.exception("rating listener %r failed", listener)
+
+def _rating_batch_loader(database) -> Tuple[Callable, Optional[Callable[[], None]]]:
+    """
+    The load_batch of _stream_batches for ratings into `database` (see
+    _database), recording the rows each batch writes, and the on_commit
+    handing them to the rating_listeners (None when there are none).
+    """
+    inserted = []
+
+    def load_batch(batch, cache):
+        inserted.clear()
+        return _load_song_ratings_batch(batch, cache, inserted, database)
+
+    def notify():
+        _notify_rating_listeners(inserted)
+
+    return load_batch, notify if rating_listeners else None
+
+def _song_rating_batches(mydb, song_ratings: Iterable, batch_size: int, cache: Optional[DimensionCache],
+                         name: str, checkpoint: Optional[Tuple[str,str]] = None) -> Iterator:
+    """
+    _stream_batches over _load_song_ratings_batch that hands the rows of
+    each committed batch to the rating_listeners.
+    """
+    load_batch, notify = _rating_batch_loader(_database(mydb))
+    return _stream_batches(mydb, song_ratings, batch_size, cache, load_batch, ("Rating",), name,
+                           checkpoint, notify)
+
+@_operation
+def load_song_ratings(mydb, song_ratings: Iterable[Tuple[str,Tuple[str,str],int, str]],
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      cache: Optional[DimensionCache] = None,
+                      on_reject: Optional[Callable[[Tuple[str,str,str]], None]] = None) -> Set[Tuple[str,str,str]]:
     """
     Load ratings for songs, which are either singles or songs in albums. 
+
+    Usernames and artist names are resolved through `cache` (the
+    default_dimension_cache of mydb by default), so repeated names cost no extra query.
+
+    Args:
+        mydb: database connection
+        song_ratings: (username, (artist_name, song_title), rating, rating_date) tuples
+        batch_size: number of ratings written per transaction
+        cache: user/artist id cache, the default_dimension_cache of mydb
+        on_reject: if given, called with every rejection instead of collecting them
+
+    Returns:
+        set of (username, artist_name, song_title) for the ratings that were
+        rejected (empty with on_reject)
+    """
+    return _collect_rejections(iter_load_song_ratings(mydb, song_ratings, batch_size, cache), on_reject)
+
+def _load_song_ratings_batch(batch: List[Tuple[str,Tuple[str,str],int, str]], cache: DimensionCache,
+                             inserted: Optional[list] = None, database=None):
+    """
+    Steps writing one batch of ratings into `database` (see _database), without committing;
+    the result is the set of rejections. The (user_id, song_id, rating_date)
+    of every rating written are appended to `inserted` if it is given.
+
+    Every distinct username, artist and (artist, title) key of the batch is
+    resolved with a few set-based queries; a rating is rejected, in this order
+    of checks, if its value is out of range, its user or song does not exist,
+    or the user already rated the song (in the database or earlier in the batch).
     """
-    cursor = mydb.cursor()
     rejected_ratings = set()
 
-    for username, (artist_name, song_title), rating, rating_date in song_ratings:
-        # Condition (d): Check rating range
-        if not (1 <= rating <= 5):
+    # Condition (d): Check rating range before touching the database
+    in_range = []
+    for username, (artist_name, song_title), rating, rating_date in batch:
+        if 1 <= rating <= 5:
+            in_range.append((username, artist_name, song_title, rating, rating_date))
+        else:
             rejected_ratings.add((username, artist_name, song_title))
-            continue
 
-        # Condition (a): Check username exists
-        cursor.execute("SELECT user_id FROM User WHERE username=%s", (username,))
-        user_res = cursor.fetchone()
-        if not user_res:
+    # Conditions (a) and (b): resolve users, artists and songs for the whole batch
+    user_ids = yield from _lookup_name_ids("User", "user_id", "username",
+                                           (username for username, *_ in in_range), cache)
+    artist_ids = yield from _lookup_name_ids("Artist", "artist_id", "name",
+                                             (artist_name for _, artist_name, *_ in in_range), cache)
+    song_ids = yield from _select_song_ids(((artist_ids[artist_name], song_title)
+                                         for _, artist_name, song_title, *_ in in_range
+                                         if artist_name in artist_ids))
+    resolved = []
+    for username, artist_name, song_title, rating, rating_date in in_range:
+        user_id = user_ids.get(username)
+        song_id = song_ids.get((artist_ids.get(artist_name), _fold(song_title)))
+        if user_id is None or song_id is None:
             rejected_ratings.add((username, artist_name, song_title))
             continue
-        user_id = user_res[0]
-
-        # Condition (b): Check song (Artist, Title) exists
-        cursor.execute(
-            "SELECT s.song_id FROM Song s JOIN Artist a ON s.artist_id = a.artist_id "
-            "WHERE s.title=%s AND a.name=%s",
-            (song_title, artist_name)
-        )
-        song_res = cursor.fetchone()
-        if not song_res:
-            rejected_ratings.add((username, artist_name, song_title))
-            continue
-        song_id = song_res[0]
+        resolved.append((user_id, song_id, rating, rating_date, (username, artist_name, song_title)))
 
-        # Condition (c): Check duplicate rating (handled via INSERT IGNORE)
-        cursor.execute(
-            "INSERT IGNORE INTO Rating (user_id, song_id, rating, rating_date) VALUES (%s,%s,%s,%s)",
-            (user_id, song_id, rating, rating_date)
-        )
-        mydb.commit()
+    # Condition (c): Check duplicate ratings against the table and the batch itself
+    partitioned = yield from _partitioned_steps(database)
+    rated = yield from _existing_pairs(_rating_key_table(partitioned), ("user_id", "song_id"),
+                                       ((user_id, song_id) for user_id, song_id, *_ in resolved))
+    new_ratings = []
+    for user_id, song_id, rating, rating_date, rejection in resolved:
+        if (user_id, song_id) in rated:
+            rejected_ratings.add(rejection)
+            continue
+        rated.add((user_id, song_id))
+        new_ratings.append((user_id, song_id, rating, rating_date))
 
-        if cursor.rowcount == 0:
-            # Rating was ignored (likely because it already exists)
-            rejected_ratings.add((username, artist_name, song_title))
+    for chunk in _chunked(new_ratings, MAX_ROWS_PER_STATEMENT):
+        yield EXECUTEMANY, "INSERT INTO Rating (user_id, song_id, rating, rating_date) VALUES (%s,%s,%s,%s)", chunk
+    if inserted is not None:
+        inserted.extend((user_id, song_id, rating_date) for user_id, song_id, _, rating_date in new_ratings)
 
     return rejected_ratings
 
-def get_most_rated_songs(mydb, year_range: Tuple[int,int], n: int) -> List[Tuple[str,str,int]]:
+def _most_rated_songs_steps(year_range: Tuple[int,int], n: int, use_rollups: bool):
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT s.title, a.name, CAST(SUM(c.rating_count) AS SIGNED) as rating_count "
+                      "FROM SongYearRatingCount c "
+                      "JOIN Song s ON s.song_id = c.song_id "
+                      "JOIN Artist a ON s.artist_id = a.artist_id "
+                      "WHERE c.rating_year BETWEEN %s AND %s "
+                      "GROUP BY s.song_id "
+                      "HAVING rating_count > 0 "
+                      "ORDER BY rating_count DESC, s.title ASC LIMIT %s",
+                      (year_range[0], year_range[1], n))
+        return list(rows)
+    start_date, end_date = _year_bounds(*year_range)
+    rows = yield (FETCHALL,
+                  "SELECT s.title, a.name, COUNT(r.rating_id) as rating_count "
+                  "FROM Song s "
+                  "JOIN Artist a ON s.artist_id = a.artist_id "
+                  "JOIN Rating r ON s.song_id = r.song_id "
+                  "WHERE r.rating_date >= %s AND r.rating_date < %s "
+                  "GROUP BY s.song_id "
+                  "ORDER BY rating_count DESC, s.title ASC LIMIT %s",
+                  (start_date, end_date, n))
+    return list(rows)
+
+@_cached_query("Artist", "Song", "Rating")
+@_pooled
+def get_most_rated_songs(mydb, year_range: Tuple[int,int], n: int,
+                         use_rollups: bool = True) -> List[Tuple[str,str,int]]:
     """
     Get the top n most rated songs in the given year range (both inclusive).
+
+    Sums the per-(song, year) SongYearRatingCount rollup unless `use_rollups`
+    is False, in which case Rating is aggregated directly.
     """
-    cursor = mydb.cursor()
-    start_year, end_year = year_range
-    cursor.execute(
-        "SELECT s.title, a.name, COUNT(r.rating_id) as rating_count "
-        "FROM Song s "
-        "JOIN Artist a ON s.artist_id = a.artist_id "
-        "JOIN Rating r ON s.song_id = r.song_id "
-        "WHERE YEAR(r.rating_date) BETWEEN %s AND %s "
-        "GROUP BY s.song_id "
-        "ORDER BY rating_count DESC, s.title ASC LIMIT %s",
-        (start_year, end_year, n)
-    )
-    return cursor.fetchall()
-
-def get_most_engaged_users(mydb, year_range: Tuple[int,int], n: int) -> List[Tuple[str,int]]:
+    return _run_steps(mydb.cursor(), _most_rated_songs_steps(year_range, n, use_rollups))
+
+def iter_get_most_rated_songs(mydb, year_range: Tuple[int,int], n: int, use_rollups: bool = True,
+                              fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Tuple[str,str,int]]:
+    """
+    Streaming version of get_most_rated_songs, without the query cache.
+    """
+    return _stream_query(mydb, _most_rated_songs_steps(year_range, n, use_rollups), fetch_size,
+                         "iter_get_most_rated_songs")
+
+def _most_engaged_users_steps(year_range: Tuple[int,int], n: int, use_rollups: bool):
+    if use_rollups:
+        rows = yield (FETCHALL,
+                      "SELECT u.username, CAST(SUM(c.rating_count) AS SIGNED) as rating_count "
+                      "FROM UserYearRatingCount c "
+                      "JOIN User u ON u.user_id = c.user_id "
+                      "WHERE c.rating_year BETWEEN %s AND %s "
+                      "GROUP BY u.user_id "
+                      "HAVING rating_count > 0 "
+                      "ORDER BY rating_count DESC, u.username ASC LIMIT %s",
+                      (year_range[0], year_range[1], n))
+        return list(rows)
+    start_date, end_date = _year_bounds(*year_range)
+    rows = yield (FETCHALL,
+                  "SELECT u.username, COUNT(r.rating_id) as rating_count "
+                  "FROM User u "
+                  "JOIN Rating r ON u.user_id = r.user_id "
+                  "WHERE r.rating_date >= %s AND r.rating_date < %s "
+                  "GROUP BY u.user_id "
+                  "ORDER BY rating_count DESC, u.username ASC LIMIT %s",
+                  (start_date, end_date, n))
+    return list(rows)
+
+@_cached_query("User", "Rating")
+@_pooled
+def get_most_engaged_users(mydb, year_range: Tuple[int,int], n: int,
+                           use_rollups: bool = True) -> List[Tuple[str,int]]:
     """
     Get the top n most engaged users.
+
+    Sums the per-(user, year) UserYearRatingCount rollup unless `use_rollups`
+    is False, in which case Rating is aggregated directly.
+    """
+    return _run_steps(mydb.cursor(), _most_engaged_users_steps(year_range, n, use_rollups))
+
+def iter_get_most_engaged_users(mydb, year_range: Tuple[int,int], n: int, use_rollups: bool = True,
+                                fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[Tuple[str,int]]:
+    """
+    Streaming version of get_most_engaged_users, without the query cache.
+    """
+    return _stream_query(mydb, _most_engaged_users_steps(year_range, n, use_rollups), fetch_size,
+                         "iter_get_most_engaged_users")
+
+def _year_ranges_cte(year_ranges: Sequence[Tuple[int,int]]) -> Tuple[str,tuple]:
+    """
+    SQL of a `ranges (range_id, start_year, end_year)` CTE listing
+    `year_ranges`, numbered in order, and its parameters.
+    """
+    rows = " UNION ALL ".join(["SELECT %s, %s, %s"] * len(year_ranges))
+    params = tuple(value for range_id, (start_year, end_year) in enumerate(year_ranges)
+                   for value in (range_id, start_year, end_year))
+    return f"ranges (range_id, start_year, end_year) AS ({rows})", params
+
+def _yearly_counts_cte(key: str, rollup: str, year_ranges: Sequence[Tuple[int,int]],
+                       use_rollups: bool) -> Tuple[str,tuple]:
     """
+    SQL of a `yearly (<key>, rating_year, rating_count)` CTE covering every
+    year of `year_ranges` in one scan, from the rollup table or from Rating.
+    """
+    first_year = min(start_year for start_year, _ in year_ranges)
+    last_year = max(end_year for _, end_year in year_ranges)
+    if use_rollups:
+        return (f"yearly AS (SELECT {key}, rating_year, rating_count FROM {rollup} "
+                "WHERE rating_year BETWEEN %s AND %s)", (first_year, last_year))
+    return (f"yearly AS (SELECT {key}, YEAR(rating_date) AS rating_year, COUNT(*) AS rating_count "
+            "FROM Rating WHERE rating_date >= %s AND rating_date < %s "
+            f"GROUP BY {key}, YEAR(rating_date))", _year_bounds(first_year, last_year))
+
+def _most_rated_songs_batch_steps(year_ranges: Sequence[Tuple[int,int]], n: int, use_rollups: bool):
+    ranges = list(dict.fromkeys(tuple(year_range) for year_range in year_ranges))
+    results = {year_range: [] for year_range in ranges}
+    if not ranges or n <= 0:
+        return results
+    ranges_cte, ranges_params = _year_ranges_cte(ranges)
+    yearly_cte, yearly_params = _yearly_counts_cte("song_id", "SongYearRatingCount", ranges, use_rollups)
+    rows = yield (FETCHALL,
+                  f"WITH {ranges_cte}, {yearly_cte}, "
+                  "totals AS (SELECT g.range_id, y.song_id, CAST(SUM(y.rating_count) AS SIGNED) AS rating_count "
+                  "FROM ranges g JOIN yearly y ON y.rating_year BETWEEN g.start_year AND g.end_year "
+                  "GROUP BY g.range_id, y.song_id HAVING SUM(y.rating_count) > 0) "
+                  "SELECT range_id, title, name, rating_count FROM ("
+                  "SELECT t.range_id, s.title, a.name, t.rating_count, "
+                  "ROW_NUMBER() OVER (PARTITION BY t.range_id ORDER BY t.rating_count DESC, s.title ASC) AS range_rank "
+                  "FROM totals t "
+                  "JOIN Song s ON s.song_id = t.song_id "
+                  "JOIN Artist a ON a.artist_id = s.artist_id"
+                  ") ranked WHERE range_rank <= %s ORDER BY range_id, range_rank",
+                  ranges_params + yearly_params + (n,))
+    for range_id, title, name, rating_count in rows:
+        results[ranges[range_id]].append((title, name, rating_count))
+    return results
+
+@_cached_query("Artist", "Song", "Rating")
+@_pooled
+def get_most_rated_songs_batch(mydb, year_ranges: Sequence[Tuple[int,int]], n: int,
+                               use_rollups: bool = True) -> Dict[Tuple[int,int],List[Tuple[str,str,int]]]:
+    """
+    get_most_rated_songs for many year ranges in a single query.
+
+    The ratings of all the ranges' years are counted per (song, year) in one
+    scan (or read from the SongYearRatingCount rollup), summed per range, and
+    ranked within each range with ROW_NUMBER() OVER (PARTITION BY range).
+
+    Args:
+        mydb: database connection
+        year_ranges: (start_year, end_year) pairs, both inclusive
+        n: number of songs per range
+        use_rollups: read SongYearRatingCount instead of aggregating Rating
+
+    Returns:
+        dict from each year range to what get_most_rated_songs returns for it
+    """
+    return _run_steps(mydb.cursor(), _most_rated_songs_batch_steps(year_ranges, n, use_rollups))
+
+def _most_engaged_users_batch_steps(year_ranges: Sequence[Tuple[int,int]], n: int, use_rollups: bool):
+    ranges = list(dict.fromkeys(tuple(year_range) for year_range in year_ranges))
+    results = {year_range: [] for year_range in ranges}
+    if not ranges or n <= 0:
+        return results
+    ranges_cte, ranges_params = _year_ranges_cte(ranges)
+    yearly_cte, yearly_params = _yearly_counts_cte("user_id", "UserYearRatingCount", ranges, use_rollups)
+    rows = yield (FETCHALL,
+                  f"WITH {ranges_cte}, {yearly_cte}, "
+                  "totals AS (SELECT g.range_id, y.user_id, CAST(SUM(y.rating_count) AS SIGNED) AS rating_count "
+                  "FROM ranges g JOIN yearly y ON y.rating_year BETWEEN g.start_year AND g.end_year "
+                  "GROUP BY g.range_id, y.user_id HAVING SUM(y.rating_count) > 0) "
+                  "SELECT range_id, username, rating_count FROM ("
+                  "SELECT t.range_id, u.username, t.rating_count, "
+                  "ROW_NUMBER() OVER (PARTITION BY t.range_id ORDER BY t.rating_count DESC, u.username ASC) AS range_rank "
+                  "FROM totals t "
+                  "JOIN User u ON u.user_id = t.user_id"
+                  ") ranked WHERE range_rank <= %s ORDER BY range_id, range_rank",
+                  ranges_params + yearly_params + (n,))
+    for range_id, username, rating_count in rows:
+        results[ranges[range_id]].append((username, rating_count))
+    return results
+
+@_cached_query("User", "Rating")
+@_pooled
+def get_most_engaged_users_batch(mydb, year_ranges: Sequence[Tuple[int,int]], n: int,
+                                 use_rollups: bool = True) -> Dict[Tuple[int,int],List[Tuple[str,int]]]:
+    """
+    get_most_engaged_users for many year ranges in a single query, ranked
+    per range like get_most_rated_songs_batch.
+
+    Returns:
+        dict from each year range to what get_most_engaged_users returns for it
+    """
+    return _run_steps(mydb.cursor(), _most_engaged_users_batch_steps(year_ranges, n, use_rollups))
+
+def _artists_last_single_in_years_steps(years: Sequence[int], use_rollups: bool):
+    years = list(dict.fromkeys(years))
+    results = {year: set() for year in years}
+    if not years:
+        return results
+    if use_rollups:
+        # One date range per year, so the index on last_single_date is used.
+        rows = yield (FETCHALL,
+                      "SELECT YEAR(sm.last_single_date) AS last_year, a.name "
+                      "FROM ArtistSummary sm JOIN Artist a ON a.artist_id = sm.artist_id "
+                      "WHERE " + " OR ".join(["(sm.last_single_date >= %s AND sm.last_single_date < %s)"] * len(years)),
+                      tuple(bound for year in years for bound in _year_bounds(year, year)))
+        for last_year, name in rows:
+            results[last_year].add(name)
+        return results
+    rows = yield (FETCHALL,
+                  "SELECT YEAR(MAX(s.release_date)) AS last_year, a.name "
+                  "FROM Artist a "
+                  "JOIN Song s ON a.artist_id = s.artist_id "
+                  "WHERE s.album_id IS NULL "
+                  "GROUP BY a.artist_id "
+                  f"HAVING YEAR(MAX(s.release_date)) IN ({','.join(['%s'] * len(years))})",
+                  tuple(years))
+    for last_year, name in rows:
+        results[last_year].add(name)
+    return results
+
+@_cached_query("Artist", "Song")
+@_pooled
+def get_artists_last_single_in_years(mydb, years: Sequence[int],
+                                     use_rollups: bool = True) -> Dict[int,Set[str]]:
+    """
+    get_artists_last_single_in_year for many years in a single query: the
+    last single of every artist is found once and bucketed by its year.
+
+    Returns:
+        dict from each year to the artists whose last single came out in it
+    """
+    return _run_steps(mydb.cursor(), _artists_last_single_in_years_steps(years, use_rollups))
+
+def _rebuild_rollups_steps(database=None):
+    yield EXECUTE, "DELETE FROM GenreSongCount", ()
+    yield (EXECUTE,
+           "INSERT INTO GenreSongCount (genre_id, song_count) "
+           "SELECT genre_id, COUNT(*) FROM SongGenre GROUP BY genre_id", ())
+    # The years of archived Rating partitions are only counted in the
+    # rollups any more: keep their rows and recompute the later years.
+    first_year = 0
+    if (yield from _partitioned_steps(database)):
+        row = yield FETCHONE, "SELECT MAX(upper_bound) FROM RatingArchive", ()
+        if row[0] is not None:
+            first_year = int(str(row[0])[:4])
+    first_day, _ = _year_bounds(first_year, first_year)
+    for table, key in (("SongYearRatingCount", "song_id"), ("UserYearRatingCount", "user_id")):
+        yield EXECUTE, f"DELETE FROM {table} WHERE rating_year >= %s", (first_year,)
+        yield (EXECUTE,
+               f"INSERT INTO {table} ({key}, rating_year, rating_count) "
+               f"SELECT {key}, YEAR(rating_date), COUNT(*) FROM Rating WHERE rating_date >= %s "
+               f"GROUP BY {key}, YEAR(rating_date)", (first_day,))
+    yield EXECUTE, "DELETE FROM ArtistSummary", ()
+    yield (EXECUTE,
+           "INSERT INTO ArtistSummary (artist_id, single_count, album_song_count, "
+           "first_single_date, last_single_date, last_album_date) "
+           "SELECT artist_id, SUM(album_id IS NULL), SUM(album_id IS NOT NULL), "
+           "MIN(CASE WHEN album_id IS NULL THEN release_date END), "
+           "MAX(CASE WHEN album_id IS NULL THEN release_date END), "
+           "MAX(CASE WHEN album_id IS NOT NULL THEN release_date END) "
+           "FROM Song GROUP BY artist_id", ())
+    yield EXECUTE, "DELETE FROM ArtistYearSingleCount", ()
+    yield (EXECUTE,
+           "INSERT INTO ArtistYearSingleCount (artist_id, release_year, single_count) "
+           "SELECT artist_id, YEAR(release_date), COUNT(*) FROM Song "
+           "WHERE album_id IS NULL GROUP BY artist_id, YEAR(release_date)", ())
+
+@_pooled
+def rebuild_rollups(mydb):
+    """
+    Recompute the GenreSongCount, SongYearRatingCount and UserYearRatingCount
+    rollups from SongGenre and Rating, and ArtistSummary and
+    ArtistYearSingleCount from Song, e.g. after applying
+    music_db_rollups.sql or music_db_artist_summaries.sql to a database
+    that already holds data or after deleting rows by hand.
+
+    Once Rating years have been archived (see music_db_partitions), the
+    rating rollups of those years are the only count left of them: they are
+    kept as they are, and only the later years are recomputed.
+
+    Args:
+        mydb: database connection
+    """
+    _run_steps(mydb.cursor(), _rebuild_rollups_steps(_database(mydb)))
+    mydb.commit()
+    query_cache.invalidate(("SongGenre", "Rating", "Song"), _database_key(mydb))
+
+@_pooled
+def _import_progress(mydb, job_id: str) -> Dict[str,Tuple[int,int]]:
     cursor = mydb.cursor()
-    start_year, end_year = year_range
-    cursor.execute(
-        "SELECT u.username, COUNT(r.rating_id) as rating_count "
-        "FROM User u "
-        "JOIN Rating r ON u.user_id = r.user_id "
-        "WHERE YEAR(r.rating_date) BETWEEN %s AND %s "
-        "GROUP BY u.user_id "
-        "ORDER BY rating_count DESC, u.username ASC LIMIT %s",
-        (start_year, end_year, n)
-    )
-    return cursor.fetchall()
+    cursor.execute("SELECT step, records_done, rejected FROM ImportCheckpoint WHERE job_id = %s", (job_id,))
+    progress = {step: (int(done), int(rejected)) for step, done, rejected in cursor.fetchall()}
+    mydb.commit()
+    return progress
+
+@_pooled
+def _drop_import_checkpoints(mydb, job_id: str):
+    mydb.cursor().execute("DELETE FROM ImportCheckpoint WHERE job_id = %s", (job_id,))
+    mydb.commit()
+
+class ImportJob:
+    """
+    A named, resumable run of the loaders.
+
+    Each load_* method works like the module-level loader, but also counts
+    the input records it has consumed in the job's ImportCheckpoint row for
+    that loader, in the same transaction as each batch. A batch (e.g. an
+    album with all its songs and SongGenre rows) is therefore either
+    committed together with the checkpoint that covers it or not at all.
+    After a crash, run the same job again with the same input, in the same
+    order: the records the checkpoint covers are skipped without touching
+    the database, and loading resumes with the first uncommitted batch.
+
+    Rejections of batches committed by an earlier run are not reported
+    again; their number is kept in the checkpoint (see progress()).
+
+        job = ImportJob(mydb, "catalog-2024-06-01")
+        job.load_albums(read_albums("albums.csv"))
+        job.load_song_ratings(read_ratings("ratings.csv"))
+        job.finish()
+    """
+
+    def __init__(self, mydb, job_id: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 cache: Optional[DimensionCache] = None):
+        """
+        Args:
+            mydb: database connection or PooledDatabase
+            job_id: name identifying the job across runs (at most 100 characters)
+            batch_size: number of input records written per transaction
+            cache: dimension id cache, the default_dimension_cache of mydb
+        """
+        self.mydb = mydb
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def _load(self, step: str, items: Iterable, load_batch: Callable, tables: Sequence[str],
+              on_reject: Optional[Callable]) -> Set:
+        return _collect_rejections(_stream_batches(self.mydb, items, self.batch_size, self.cache, load_batch,
+                                                   tables, f"ImportJob.load_{step}", (self.job_id, step)),
+                                   on_reject)
+
+    def load_single_songs(self, single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]],
+                          on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+        """
+        Resumable load_single_songs; returns the rejections of this run.
+        """
+        return self._load("single_songs", single_songs, _load_single_songs_batch,
+                          ("Artist", "Song", "Genre", "SongGenre"), on_reject)
+
+    def load_albums(self, albums: Iterable[Tuple[str,str,str,str,List[str]]],
+                    on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+        """
+        Resumable load_albums; returns the rejections of this run.
+        """
+        return self._load("albums", albums, _load_albums_batch,
+                          ("Artist", "Album", "Song", "Genre", "SongGenre"), on_reject)
+
+    def load_users(self, users: Iterable[str],
+                   on_reject: Optional[Callable[[str], None]] = None) -> Set[str]:
+        """
+        Resumable load_users; returns the rejections of this run.
+        """
+        return self._load("users", users, _load_users_batch, ("User",), on_reject)
+
+    def load_song_ratings(self, song_ratings: Iterable[Tuple[str,Tuple[str,str],int, str]],
+                          on_reject: Optional[Callable[[Tuple[str,str,str]], None]] = None
+                          ) -> Set[Tuple[str,str,str]]:
+        """
+        Resumable load_song_ratings; returns the rejections of this run.
+        """
+        return _collect_rejections(_song_rating_batches(self.mydb, song_ratings, self.batch_size, self.cache,
+                                                        "ImportJob.load_song_ratings",
+                                                        (self.job_id, "song_ratings")),
+                                   on_reject)
+
+    def progress(self) -> Dict[str,Tuple[int,int]]:
+        """
+        Return {step: (records_done, rejected)} for the loaders the job has run,
+        steps being "single_songs", "albums", "users" and "song_ratings".
+        """
+        return _import_progress(self.mydb, self.job_id)
+
+    def finish(self):
+        """
+        Drop the job's checkpoints once the import is complete; running the
+        job again afterwards loads its input from the start.
+        """
+        _drop_import_checkpoints(self.mydb, self.job_id)
 
 def main():
     pass
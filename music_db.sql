@@ -4,6 +4,15 @@
 -- ====================================================
 
 -- DROP TABLES IF THEY EXIST (to start fresh)
+DROP TABLE IF EXISTS ImportCheckpoint;
+DROP TABLE IF EXISTS FeedFingerprint;
+DROP TABLE IF EXISTS ArtistYearSingleCount;
+DROP TABLE IF EXISTS ArtistSummary;
+DROP TABLE IF EXISTS RatingArchive;
+DROP TABLE IF EXISTS RatingKey;
+DROP TABLE IF EXISTS UserYearRatingCount;
+DROP TABLE IF EXISTS SongYearRatingCount;
+DROP TABLE IF EXISTS GenreSongCount;
 DROP TABLE IF EXISTS Rating;
 DROP TABLE IF EXISTS SongGenre;
 DROP TABLE IF EXISTS Song;
@@ -77,6 +86,8 @@ CREATE TABLE User (
 
 -- ====================================================
 -- Rating Table
+-- (music_db_partitioning.sql turns it into a table
+-- range-partitioned by rating_date, see music_db_partitions.py)
 -- ====================================================
 CREATE TABLE Rating (
     rating_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -88,3 +99,120 @@ CREATE TABLE Rating (
     FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE,
     UNIQUE (user_id, song_id)
 );
+
+-- ====================================================
+-- Rollup tables for the top-N queries
+-- Kept up to date by the AFTER INSERT triggers below, so
+-- get_top_song_genres, get_most_rated_songs and
+-- get_most_engaged_users read counts instead of
+-- re-aggregating SongGenre / Rating on every call.
+-- (Rows are only ever added by the loaders; clear_database
+-- empties these tables together with their sources.)
+-- ====================================================
+CREATE TABLE GenreSongCount (
+    genre_id INT PRIMARY KEY,
+    song_count INT NOT NULL,
+    FOREIGN KEY (genre_id) REFERENCES Genre(genre_id) ON DELETE CASCADE
+);
+
+CREATE TABLE SongYearRatingCount (
+    song_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (song_id, rating_year),
+    INDEX (rating_year, song_id),
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE
+);
+
+CREATE TABLE UserYearRatingCount (
+    user_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (user_id, rating_year),
+    INDEX (rating_year, user_id),
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER song_genre_count AFTER INSERT ON SongGenre FOR EACH ROW
+    INSERT INTO GenreSongCount (genre_id, song_count) VALUES (NEW.genre_id, 1)
+    ON DUPLICATE KEY UPDATE song_count = song_count + 1;
+
+CREATE TRIGGER rating_song_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO SongYearRatingCount (song_id, rating_year, rating_count)
+    VALUES (NEW.song_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
+
+CREATE TRIGGER rating_user_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO UserYearRatingCount (user_id, rating_year, rating_count)
+    VALUES (NEW.user_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
+
+-- ====================================================
+-- Per-artist song facts, kept up to date by AFTER INSERT
+-- triggers on Song, for get_album_and_single_artists,
+-- get_artists_last_single_in_year and
+-- get_most_prolific_individual_artists.
+-- ====================================================
+CREATE TABLE ArtistSummary (
+    artist_id INT PRIMARY KEY,
+    single_count INT NOT NULL,
+    album_song_count INT NOT NULL,
+    first_single_date DATE NULL,
+    last_single_date DATE NULL,
+    last_album_date DATE NULL,
+    INDEX (last_single_date),
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+
+CREATE TABLE ArtistYearSingleCount (
+    artist_id INT NOT NULL,
+    release_year SMALLINT NOT NULL,
+    single_count INT NOT NULL,
+    PRIMARY KEY (artist_id, release_year),
+    INDEX (release_year, artist_id),
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER song_artist_summary AFTER INSERT ON Song FOR EACH ROW
+    INSERT INTO ArtistSummary (artist_id, single_count, album_song_count,
+                               first_single_date, last_single_date, last_album_date)
+    VALUES (NEW.artist_id, NEW.album_id IS NULL, NEW.album_id IS NOT NULL,
+            CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END,
+            CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END,
+            CASE WHEN NEW.album_id IS NOT NULL THEN NEW.release_date END)
+    ON DUPLICATE KEY UPDATE
+        single_count = single_count + (NEW.album_id IS NULL),
+        album_song_count = album_song_count + (NEW.album_id IS NOT NULL),
+        first_single_date = CASE WHEN NEW.album_id IS NULL AND (first_single_date IS NULL OR NEW.release_date < first_single_date)
+                                 THEN NEW.release_date ELSE first_single_date END,
+        last_single_date = CASE WHEN NEW.album_id IS NULL AND (last_single_date IS NULL OR NEW.release_date > last_single_date)
+                                THEN NEW.release_date ELSE last_single_date END,
+        last_album_date = CASE WHEN NEW.album_id IS NOT NULL AND (last_album_date IS NULL OR NEW.release_date > last_album_date)
+                               THEN NEW.release_date ELSE last_album_date END;
+
+CREATE TRIGGER song_artist_year_singles AFTER INSERT ON Song FOR EACH ROW
+    INSERT INTO ArtistYearSingleCount (artist_id, release_year, single_count)
+    SELECT NEW.artist_id, YEAR(NEW.release_date), 1 FROM DUAL WHERE NEW.album_id IS NULL
+    ON DUPLICATE KEY UPDATE single_count = single_count + 1;
+
+-- ====================================================
+-- ImportCheckpoint Table
+-- How far each step of a resumable ImportJob has consumed
+-- its input; updated in the same transaction as every batch.
+-- ====================================================
+CREATE TABLE ImportCheckpoint (
+    job_id VARCHAR(100) NOT NULL,
+    step VARCHAR(50) NOT NULL,
+    records_done BIGINT NOT NULL,
+    rejected BIGINT NOT NULL,
+    PRIMARY KEY (job_id, step)
+);
+
+-- ====================================================
+-- FeedFingerprint Table
+-- Digests of the feed records sync_single_songs and
+-- sync_albums have already applied (loaded or rejected).
+-- ====================================================
+CREATE TABLE FeedFingerprint (
+    fingerprint BINARY(16) PRIMARY KEY
+);
@@ -0,0 +1,54 @@
+-- ====================================================
+-- Migration: per-artist song summaries
+-- File: music_db_artist_summaries.sql
+-- Upgrades a database created from a music_db.sql that
+-- predates these tables (the current one creates them).
+-- Apply once, then call music_db.rebuild_rollups(mydb) to
+-- summarize the songs it already holds.
+-- ====================================================
+
+-- Per-artist song facts, kept up to date by AFTER INSERT
+-- triggers on Song, for get_album_and_single_artists,
+-- get_artists_last_single_in_year and
+-- get_most_prolific_individual_artists.
+CREATE TABLE ArtistSummary (
+    artist_id INT PRIMARY KEY,
+    single_count INT NOT NULL,
+    album_song_count INT NOT NULL,
+    first_single_date DATE NULL,
+    last_single_date DATE NULL,
+    last_album_date DATE NULL,
+    INDEX (last_single_date),
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+
+CREATE TABLE ArtistYearSingleCount (
+    artist_id INT NOT NULL,
+    release_year SMALLINT NOT NULL,
+    single_count INT NOT NULL,
+    PRIMARY KEY (artist_id, release_year),
+    INDEX (release_year, artist_id),
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER song_artist_summary AFTER INSERT ON Song FOR EACH ROW
+    INSERT INTO ArtistSummary (artist_id, single_count, album_song_count,
+                               first_single_date, last_single_date, last_album_date)
+    VALUES (NEW.artist_id, NEW.album_id IS NULL, NEW.album_id IS NOT NULL,
+            CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END,
+            CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END,
+            CASE WHEN NEW.album_id IS NOT NULL THEN NEW.release_date END)
+    ON DUPLICATE KEY UPDATE
+        single_count = single_count + (NEW.album_id IS NULL),
+        album_song_count = album_song_count + (NEW.album_id IS NOT NULL),
+        first_single_date = CASE WHEN NEW.album_id IS NULL AND (first_single_date IS NULL OR NEW.release_date < first_single_date)
+                                 THEN NEW.release_date ELSE first_single_date END,
+        last_single_date = CASE WHEN NEW.album_id IS NULL AND (last_single_date IS NULL OR NEW.release_date > last_single_date)
+                                THEN NEW.release_date ELSE last_single_date END,
+        last_album_date = CASE WHEN NEW.album_id IS NOT NULL AND (last_album_date IS NULL OR NEW.release_date > last_album_date)
+                               THEN NEW.release_date ELSE last_album_date END;
+
+CREATE TRIGGER song_artist_year_singles AFTER INSERT ON Song FOR EACH ROW
+    INSERT INTO ArtistYearSingleCount (artist_id, release_year, single_count)
+    SELECT NEW.artist_id, YEAR(NEW.release_date), 1 FROM DUAL WHERE NEW.album_id IS NULL
+    ON DUPLICATE KEY UPDATE single_count = single_count + 1;
@@ -0,0 +1,426 @@
+"""
+Asyncio API for the music database.
+
+Every loader and query of music_db is available here as a coroutine with the
+same arguments and results. The SQL is not duplicated: music_db writes each
+operation as a generator of (kind, sql, params) steps, and this module awaits
+those steps on an asyncio connection instead of running them on a blocking
+cursor, so both APIs reject, insert and return exactly the same things.
+
+`db` is either
+  - an asyncio connection whose cursor() gives a cursor with awaitable
+    execute/executemany/fetchall/fetchone and a lastrowid (aiomysql), or
+  - a pool with an `acquire()` async context manager (aiomysql.create_pool,
+    ThreadedPool); each call then borrows its own connection, so calls
+    gathered with asyncio.gather run concurrently.
+
+ThreadedPool runs any blocking DB-API driver (mysql.connector by default)
+off the event loop, one worker thread per connection.
+"""
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import music_db
+from music_db import (DEFAULT_BATCH_SIZE, EXECUTEMANY, FETCHALL, FETCHONE, INSERT, _MISS,
+                      DimensionCache, _copy_result, _database_key, _invalidate_dimension_caches, _invalidating,
+                      _query_cache_key, default_dimension_cache, query_cache)
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+async def _end_transaction(connection):
+    """
+    Roll back whatever `connection` left uncommitted, including the read view
+    of a query, before it goes back to a pool (see music_db.PooledDatabase.session).
+    """
+    if getattr(connection, "in_transaction", True):
+        await _maybe_await(connection.rollback())
+
+async def _execute_step(cursor, kind: str, sql: str, params):
+    """
+    Await one step on an asyncio cursor and return what the step asks for.
+    """
+    if kind == EXECUTEMANY:
+        await cursor.executemany(sql, params)
+        return None
+    await cursor.execute(sql, params)
+    if kind == FETCHALL:
+        return await _maybe_await(cursor.fetchall())
+    if kind == FETCHONE:
+        return await _maybe_await(cursor.fetchone())
+    if kind == INSERT:
+        return cursor.lastrowid
+    return None
+
+async def _run_steps(cursor, steps):
+    """
+    Drive a music_db step generator to completion on `cursor` and return its result.
+    """
+    result, error = None, None
+    while True:
+        try:
+            if error is None:
+                kind, sql, params = steps.send(result)
+            else:
+                kind, sql, params = steps.throw(error)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = await _execute_step(cursor, kind, sql, params), None
+        except Exception as err:
+            result, error = None, err
+
+class ThreadedConnection:
+    """
+    A blocking DB-API connection driven from asyncio. The connection is
+    opened, used and closed on its own single worker thread, which keeps
+    drivers that are bound to one thread (sqlite3) working.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, connection):
+        self._executor = executor
+        self.connection = connection
+
+    @classmethod
+    async def open(cls, connect: Callable, **connect_kwargs) -> "ThreadedConnection":
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        connection = await loop.run_in_executor(executor, functools.partial(connect, **connect_kwargs))
+        return cls(executor, connection)
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def cursor(self) -> "_ThreadedCursor":
+        return _ThreadedCursor(self, await self._call(self.connection.cursor))
+
+    async def commit(self):
+        await self._call(self.connection.commit)
+
+    async def rollback(self):
+        await self._call(self.connection.rollback)
+
+    async def close(self):
+        try:
+            await self._call(self.connection.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+class _ThreadedCursor:
+    """
+    Awaitable facade over a blocking cursor of a ThreadedConnection.
+    """
+
+    def __init__(self, connection: ThreadedConnection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+
+    async def execute(self, sql: str, params=()):
+        await self._connection._call(self._cursor.execute, sql, params)
+
+    async def executemany(self, sql: str, seq_params):
+        await self._connection._call(self._cursor.executemany, sql, seq_params)
+
+    async def fetchall(self):
+        return await self._connection._call(self._cursor.fetchall)
+
+    async def fetchone(self):
+        return await self._connection._call(self._cursor.fetchone)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+class ThreadedPool:
+    """
+    A pool of ThreadedConnections with the `acquire()` interface of an
+    asyncio driver pool. Connections are opened lazily, at most `size` of them.
+    """
+
+    def __init__(self, size: int = 5, connect: Optional[Callable] = None, **connect_kwargs):
+        """
+        Args:
+            size: maximum number of open connections
+            connect: blocking connection factory, mysql.connector.connect by default
+            **connect_kwargs: arguments for the factory (host, user, database, ...)
+        """
+        if connect is None:
+            import mysql.connector
+            connect = mysql.connector.connect
+        self.size = size
+        self._connect = connect
+        self._connect_kwargs = connect_kwargs
+        self._idle: List[ThreadedConnection] = []
+        self._slots = asyncio.Semaphore(size)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[ThreadedConnection]:
+        """
+        Borrow a connection; whatever it leaves uncommitted is rolled back
+        when it is returned, and the connection discarded if even that fails.
+        """
+        async with self._slots:
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connection = await ThreadedConnection.open(self._connect, **self._connect_kwargs)
+            try:
+                yield connection
+            finally:
+                try:
+                    await _end_transaction(connection)
+                except Exception:
+                    await connection.close()
+                    raise
+                self._idle.append(connection)
+
+    async def close(self):
+        """
+        Close the idle connections of the pool.
+        """
+        while self._idle:
+            await self._idle.pop().close()
+
+@asynccontextmanager
+async def _connection(db):
+    """
+    Yield a connection for one call: `db` itself, or one borrowed from `db`
+    when it is a pool, whose transaction is then ended before it is returned
+    (a driver pool may keep it open, or close the connection).
+    """
+    if hasattr(db, "acquire"):
+        async with db.acquire() as connection:
+            try:
+                yield connection
+            finally:
+                await _end_transaction(connection)
+    else:
+        yield db
+
+async def _query(db, steps):
+    async with _connection(db) as connection:
+        cursor = await _maybe_await(connection.cursor())
+        return await _run_steps(cursor, steps)
+
+def _cached_query(*tables: str):
+    """
+    Async counterpart of music_db._cached_query, keyed and invalidated the
+    same way in music_db.query_cache.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(db, *args, **kwargs):
+            if not query_cache.enabled:
+                return await func(db, *args, **kwargs)
+            key = _query_cache_key(func.__name__, db, args, kwargs)
+            if key is None:
+                return await func(db, *args, **kwargs)
+            value = query_cache.get(key)
+            if value is _MISS:
+                value = await func(db, *args, **kwargs)
+                query_cache.put(key, tables, value, key[0])
+            return _copy_result(value)
+        return wrapper
+    return decorate
+
+async def _chunked(items: Union[Iterable, AsyncIterable], size: int) -> AsyncIterator[list]:
+    """
+    Split a plain or async iterable into lists of at most `size` items.
+    """
+    if not hasattr(items, "__aiter__"):
+        for chunk in music_db._chunked(items, size):
+            yield chunk
+        return
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def _stream_batches(db, items, batch_size: int, cache: Optional[DimensionCache],
+                          load_batch: Callable, tables: Tuple[str,...],
+                          on_commit: Optional[Callable[[], None]] = None) -> AsyncIterator:
+    """
+    Async counterpart of music_db._stream_batches: one transaction per chunk
+    of `batch_size` items, yielding each chunk's rejections once committed.
+    `on_commit`, if given, is called after each chunk's commit.
+    """
+    cache = default_dimension_cache(db) if cache is None else cache
+    async with _connection(db) as connection:
+        cursor = await _maybe_await(connection.cursor())
+        async for batch in _chunked(items, batch_size):
+            with _invalidating(cache):
+                try:
+                    rejected = await _run_steps(cursor, load_batch(batch, cache))
+                    await connection.commit()
+                finally:
+                    query_cache.invalidate(tables, _database_key(db))
+                if on_commit is not None:
+                    on_commit()
+            for rejection in rejected:
+                yield rejection
+
+async def _collect_rejections(rejections: AsyncIterator, on_reject: Optional[Callable]) -> Set:
+    if on_reject is None:
+        return {rejection async for rejection in rejections}
+    async for rejection in rejections:
+        on_reject(rejection)
+    return set()
+
+async def clear_database(db, mode: str = "delete", schema_files: Optional[Sequence[str]] = None):
+    """
+    Deletes all the rows from all the tables of the database, and invalidates
+    the dimension and query caches (see music_db.clear_database for the modes).
+    """
+    async with _connection(db) as connection:
+        cursor = await _maybe_await(connection.cursor())
+        partitioned = await _run_steps(cursor, music_db._partitioned_steps())
+        if schema_files is None:
+            schema_files = music_db._default_schema_files(connection, partitioned)
+        await _run_steps(cursor, music_db._clear_database_steps(mode, schema_files, partitioned))
+        await connection.commit()
+    music_db._forget_partitioning(db)
+    _invalidate_dimension_caches()
+    query_cache.invalidate()
+
+async def rebuild_rollups(db):
+    """
+    Recompute the rollup tables from SongGenre and Rating (see music_db.rebuild_rollups).
+    """
+    async with _connection(db) as connection:
+        cursor = await _maybe_await(connection.cursor())
+        await _run_steps(cursor, music_db._rebuild_rollups_steps(music_db._database(db)))
+        await connection.commit()
+    query_cache.invalidate(("SongGenre", "Rating", "Song"), _database_key(db))
+
+def iter_load_single_songs(db, single_songs, batch_size: int = DEFAULT_BATCH_SIZE,
+                           cache: Optional[DimensionCache] = None) -> AsyncIterator[Tuple[str,str]]:
+    """
+    Async generator version of load_single_songs; `single_songs` may be a
+    plain or an async iterable.
+    """
+    return _stream_batches(db, single_songs, batch_size, cache, music_db._load_single_songs_batch,
+                           ("Artist", "Song", "Genre", "SongGenre"))
+
+async def load_single_songs(db, single_songs, batch_size: int = DEFAULT_BATCH_SIZE,
+                            cache: Optional[DimensionCache] = None,
+                            on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+    """
+    Add single songs to the database (see music_db.load_single_songs).
+
+    Returns:
+        set of (title, artist_name) for the rejected songs (empty with on_reject)
+    """
+    return await _collect_rejections(iter_load_single_songs(db, single_songs, batch_size, cache), on_reject)
+
+def iter_load_albums(db, albums, batch_size: int = DEFAULT_BATCH_SIZE,
+                     cache: Optional[DimensionCache] = None) -> AsyncIterator[Tuple[str,str]]:
+    """
+    Async generator version of load_albums.
+    """
+    return _stream_batches(db, albums, batch_size, cache, music_db._load_albums_batch,
+                           ("Artist", "Album", "Song", "Genre", "SongGenre"))
+
+async def load_albums(db, albums, batch_size: int = DEFAULT_BATCH_SIZE,
+                      cache: Optional[DimensionCache] = None,
+                      on_reject: Optional[Callable[[Tuple[str,str]], None]] = None) -> Set[Tuple[str,str]]:
+    """
+    Add albums to the database (see music_db.load_albums).
+
+    Returns:
+        set of (album_name, artist_name) for the rejected albums (empty with on_reject)
+    """
+    return await _collect_rejections(iter_load_albums(db, albums, batch_size, cache), on_reject)
+
+def iter_load_users(db, users, batch_size: int = DEFAULT_BATCH_SIZE,
+                    cache: Optional[DimensionCache] = None) -> AsyncIterator[str]:
+    """
+    Async generator version of load_users.
+    """
+    return _stream_batches(db, users, batch_size, cache, music_db._load_users_batch, ("User",))
+
+async def load_users(db, users, batch_size: int = DEFAULT_BATCH_SIZE,
+                     cache: Optional[DimensionCache] = None,
+                     on_reject: Optional[Callable[[str], None]] = None) -> Set[str]:
+    """
+    Add users to the database (see music_db.load_users).
+
+    Returns:
+        set of usernames that already existed (empty with on_reject)
+    """
+    return await _collect_rejections(iter_load_users(db, users, batch_size, cache), on_reject)
+
+def iter_load_song_ratings(db, song_ratings, batch_size: int = DEFAULT_BATCH_SIZE,
+                           cache: Optional[DimensionCache] = None) -> AsyncIterator[Tuple[str,str,str]]:
+    """
+    Async generator version of load_song_ratings; like it, hands the rows of
+    each committed batch to music_db.rating_listeners.
+    """
+    load_batch, notify = music_db._rating_batch_loader(music_db._database(db))
+    return _stream_batches(db, song_ratings, batch_size, cache, load_batch, ("Rating",), notify)
+
+async def load_song_ratings(db, song_ratings, batch_size: int = DEFAULT_BATCH_SIZE,
+                            cache: Optional[DimensionCache] = None,
+                            on_reject: Optional[Callable[[Tuple[str,str,str]], None]] = None) -> Set[Tuple[str,str,str]]:
+    """
+    Load ratings for songs (see music_db.load_song_ratings).
+
+    Returns:
+        set of (username, artist_name, song_title) for the rejected ratings
+        (empty with on_reject)
+    """
+    return await _collect_rejections(iter_load_song_ratings(db, song_ratings, batch_size, cache), on_reject)
+
+@_cached_query("Artist", "Song")
+async def get_most_prolific_individual_artists(db, n: int, year_range: Tuple[int,int],
+                                               use_rollups: bool = True) -> List[Tuple[str,int]]:
+    return await _query(db, music_db._most_prolific_individual_artists_steps(n, year_range, use_rollups))
+
+@_cached_query("Artist", "Song")
+async def get_artists_last_single_in_year(db, year: int, use_rollups: bool = True) -> Set[str]:
+    return await _query(db, music_db._artists_last_single_in_year_steps(year, use_rollups))
+
+@_cached_query("Genre", "SongGenre")
+async def get_top_song_genres(db, n: int, use_rollups: bool = True) -> List[Tuple[str,int]]:
+    return await _query(db, music_db._top_song_genres_steps(n, use_rollups))
+
+@_cached_query("Artist", "Song")
+async def get_album_and_single_artists(db, use_rollups: bool = True) -> Set[str]:
+    return await _query(db, music_db._album_and_single_artists_steps(use_rollups))
+
+@_cached_query("Artist", "Song", "Rating")
+async def get_most_rated_songs(db, year_range: Tuple[int,int], n: int,
+                               use_rollups: bool = True) -> List[Tuple[str,str,int]]:
+    return await _query(db, music_db._most_rated_songs_steps(year_range, n, use_rollups))
+
+@_cached_query("User", "Rating")
+async def get_most_engaged_users(db, year_range: Tuple[int,int], n: int,
+                                 use_rollups: bool = True) -> List[Tuple[str,int]]:
+    return await _query(db, music_db._most_engaged_users_steps(year_range, n, use_rollups))
+
+@_cached_query("Artist", "Song", "Rating")
+async def get_most_rated_songs_batch(db, year_ranges: Sequence[Tuple[int,int]], n: int,
+                                     use_rollups: bool = True) -> Dict[Tuple[int,int],List[Tuple[str,str,int]]]:
+    return await _query(db, music_db._most_rated_songs_batch_steps(year_ranges, n, use_rollups))
+
+@_cached_query("User", "Rating")
+async def get_most_engaged_users_batch(db, year_ranges: Sequence[Tuple[int,int]], n: int,
+                                       use_rollups: bool = True) -> Dict[Tuple[int,int],List[Tuple[str,int]]]:
+    return await _query(db, music_db._most_engaged_users_batch_steps(year_ranges, n, use_rollups))
+
+@_cached_query("Artist", "Song")
+async def get_artists_last_single_in_years(db, years: Sequence[int],
+                                           use_rollups: bool = True) -> Dict[int,Set[str]]:
+    return await _query(db, music_db._artists_last_single_in_years_steps(years, use_rollups))
@@ -0,0 +1,320 @@
+"""
+Benchmarks for music_db.
+
+SyntheticCatalog deterministically generates artists, singles, albums, users
+and ratings for a target number of rows. Every record is derived from its
+index and the seed, so nothing has to be held in memory and the same
+arguments always produce the same catalog. Ratings pick songs and users from
+Zipf distributions, so a few songs and users get most of them, as in real
+listening data; the occasional repeated (user, song) pair exercises the
+rejection path of load_song_ratings.
+
+run_benchmark() times every loader (rows per second) and every get_* query
+(p50/p95/p99 latency over repeated calls with varying arguments); the result
+is a JSON-serializable dict that save_results() writes and compare_results()
+checks against an earlier run.
+
+    python music_db_bench.py --rows 100000 --output bench.json
+    python music_db_bench.py --rows 100000 --baseline bench.json
+
+runs against an in-memory SQLite database (music_db_sqlite) unless --backend
+mysql and the connection options are given. `--memory N` instead measures
+the memory taken by N ratings in each of the layouts of music_db_records.
+"""
+import argparse
+import datetime
+import json
+import math
+import platform
+import random
+import sys
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import music_db
+
+GENRES = 50
+TRACKS_PER_ALBUM = 8
+FIRST_YEAR = 2000
+LAST_YEAR = 2023
+
+def _zipf_index(rng: random.Random, count: int, s: float) -> int:
+    """
+    Draw an index in [0, count) with probability roughly proportional to
+    1 / (index + 1) ** s, by inverting the continuous approximation of the
+    Zipf CDF (constant time and memory, whatever the count).
+    """
+    u = rng.random()
+    if abs(s - 1.0) < 1e-9:
+        x = math.exp(u * math.log(count + 1))
+    else:
+        x = ((count + 1) ** (1 - s) * u + (1 - u)) ** (1 / (1 - s))
+    return min(int(x) - 1, count - 1)
+
+def _date(rng: random.Random) -> str:
+    start = datetime.date(FIRST_YEAR, 1, 1).toordinal()
+    end = datetime.date(LAST_YEAR, 12, 31).toordinal()
+    return datetime.date.fromordinal(rng.randint(start, end)).isoformat()
+
+class SyntheticCatalog:
+    """
+    A deterministic synthetic catalog of about `rows` input records.
+
+    The rows are split roughly as 2% artists (implicit in the songs), 10%
+    singles, 1% albums of TRACKS_PER_ALBUM tracks, 5% users and the rest
+    ratings.
+    """
+
+    def __init__(self, rows: int, seed: int = 0, zipf_s: float = 1.1):
+        self.rows = rows
+        self.seed = seed
+        self.zipf_s = zipf_s
+        self.artists = max(10, rows // 50)
+        self.singles = max(10, rows // 10)
+        self.albums = max(2, rows // 100)
+        self.users = max(10, rows // 20)
+        self.ratings = max(10, rows - self.singles - self.albums - self.users)
+
+    def _rng(self, stream: int) -> random.Random:
+        return random.Random(self.seed * 1_000_003 + stream)
+
+    def artist_name(self, index: int) -> str:
+        return f"Artist {index:08d}"
+
+    def username(self, index: int) -> str:
+        return f"user{index:09d}"
+
+    def song_key(self, song: int) -> Tuple[str,str]:
+        """
+        (artist_name, title) of song number `song`: singles come first, then
+        the album tracks.
+        """
+        if song < self.singles:
+            return self.artist_name(song % self.artists), f"Single {song:09d}"
+        album, track = divmod(song - self.singles, TRACKS_PER_ALBUM)
+        return self.artist_name(album % self.artists), f"Album {album:08d} Track {track}"
+
+    def single_songs(self) -> Iterator[Tuple[str,Tuple[str,...],str,str]]:
+        rng = self._rng(1)
+        for song in range(self.singles):
+            artist_name, title = self.song_key(song)
+            genres = tuple(f"Genre {g:02d}" for g in rng.sample(range(GENRES), rng.randint(1, 3)))
+            yield title, genres, artist_name, _date(rng)
+
+    def album_records(self) -> Iterator[Tuple[str,str,str,str,List[str]]]:
+        rng = self._rng(2)
+        for album in range(self.albums):
+            titles = [self.song_key(self.singles + album * TRACKS_PER_ALBUM + track)[1]
+                      for track in range(TRACKS_PER_ALBUM)]
+            yield (f"Album {album:08d}", f"Genre {rng.randrange(GENRES):02d}",
+                   self.artist_name(album % self.artists), _date(rng), titles)
+
+    def usernames(self) -> Iterator[str]:
+        return (self.username(user) for user in range(self.users))
+
+    def song_ratings(self) -> Iterator[Tuple[str,Tuple[str,str],int,str]]:
+        rng = self._rng(3)
+        songs = self.singles + self.albums * TRACKS_PER_ALBUM
+        for _ in range(self.ratings):
+            song = _zipf_index(rng, songs, self.zipf_s)
+            user = _zipf_index(rng, self.users, self.zipf_s)
+            yield self.username(user), self.song_key(song), rng.randint(1, 5), _date(rng)
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def _time_loader(loader: Callable, mydb, records: Iterable, batch_size: int) -> Dict:
+    count = 0
+    rejected = 0
+
+    def counted():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    def on_reject(_):
+        nonlocal rejected
+        rejected += 1
+
+    start = time.perf_counter()
+    loader(mydb, counted(), batch_size=batch_size, on_reject=on_reject)
+    seconds = time.perf_counter() - start
+    return {"rows": count, "rejected": rejected, "seconds": seconds,
+            "rows_per_second": count / seconds if seconds else 0.0}
+
+def _query_calls(rng: random.Random) -> Dict[str,Callable]:
+    """
+    A fresh set of randomized arguments for each timed query.
+    """
+    def year_range():
+        start = rng.randint(FIRST_YEAR, LAST_YEAR)
+        return start, rng.randint(start, LAST_YEAR)
+
+    n = lambda: rng.choice((5, 10, 50))
+    return {
+        "get_most_prolific_individual_artists":
+            lambda mydb: music_db.get_most_prolific_individual_artists(mydb, n(), year_range()),
+        "get_most_prolific_individual_artists[scan]":
+            lambda mydb: music_db.get_most_prolific_individual_artists(mydb, n(), year_range(), use_rollups=False),
+        "get_artists_last_single_in_year":
+            lambda mydb: music_db.get_artists_last_single_in_year(mydb, rng.randint(FIRST_YEAR, LAST_YEAR)),
+        "get_artists_last_single_in_year[scan]":
+            lambda mydb: music_db.get_artists_last_single_in_year(mydb, rng.randint(FIRST_YEAR, LAST_YEAR),
+                                                                  use_rollups=False),
+        "get_top_song_genres": lambda mydb: music_db.get_top_song_genres(mydb, n()),
+        "get_top_song_genres[scan]": lambda mydb: music_db.get_top_song_genres(mydb, n(), use_rollups=False),
+        "get_album_and_single_artists": lambda mydb: music_db.get_album_and_single_artists(mydb),
+        "get_album_and_single_artists[scan]":
+            lambda mydb: music_db.get_album_and_single_artists(mydb, use_rollups=False),
+        "get_most_rated_songs": lambda mydb: music_db.get_most_rated_songs(mydb, year_range(), n()),
+        "get_most_rated_songs[scan]":
+            lambda mydb: music_db.get_most_rated_songs(mydb, year_range(), n(), use_rollups=False),
+        "get_most_engaged_users": lambda mydb: music_db.get_most_engaged_users(mydb, year_range(), n()),
+        "get_most_engaged_users[scan]":
+            lambda mydb: music_db.get_most_engaged_users(mydb, year_range(), n(), use_rollups=False),
+    }
+
+def run_benchmark(mydb, rows: int, seed: int = 0, batch_size: int = music_db.DEFAULT_BATCH_SIZE,
+                  repeats: int = 50, zipf_s: float = 1.1) -> Dict:
+    """
+    Load a synthetic catalog into an emptied database and time the loaders
+    and queries. The query cache is turned off for the run.
+
+    Args:
+        mydb: database connection (or PooledDatabase)
+        rows: approximate number of input records
+        seed: generator seed
+        batch_size: loader batch size
+        repeats: timed calls per query
+        zipf_s: Zipf exponent of the rating distribution
+
+    Returns:
+        {"params": ..., "loaders": {name: {...}}, "queries": {name: {...}}}
+    """
+    catalog = SyntheticCatalog(rows, seed, zipf_s)
+    cache_enabled = music_db.query_cache.enabled
+    music_db.query_cache.enabled = False
+    try:
+        music_db.clear_database(mydb, mode="truncate")
+        loaders = {
+            "load_single_songs": _time_loader(music_db.load_single_songs, mydb, catalog.single_songs(), batch_size),
+            "load_albums": _time_loader(music_db.load_albums, mydb, catalog.album_records(), batch_size),
+            "load_users": _time_loader(music_db.load_users, mydb, catalog.usernames(), batch_size),
+            "load_song_ratings": _time_loader(music_db.load_song_ratings, mydb, catalog.song_ratings(), batch_size),
+        }
+        rng = random.Random(seed)
+        calls = _query_calls(rng)
+        queries = {}
+        for name, call in calls.items():
+            call(mydb)  # warm-up
+            latencies = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                call(mydb)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            queries[name] = {"calls": repeats, "p50": _percentile(latencies, 0.50),
+                             "p95": _percentile(latencies, 0.95), "p99": _percentile(latencies, 0.99),
+                             "mean": sum(latencies) / len(latencies)}
+    finally:
+        music_db.query_cache.enabled = cache_enabled
+    return {
+        "params": {"rows": rows, "seed": seed, "batch_size": batch_size, "repeats": repeats, "zipf_s": zipf_s},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "time": datetime.datetime.now(datetime.timezone.utc).isoformat()},
+        "loaders": loaders,
+        "queries": queries,
+    }
+
+def save_results(results: Dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def load_results(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def compare_results(baseline: Dict, current: Dict, tolerance: float = 0.10) -> List[str]:
+    """
+    List the regressions of `current` against `baseline`: loaders whose rows
+    per second dropped, and queries whose p50 or p95 grew, by more than
+    `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, before in baseline.get("loaders", {}).items():
+        after = current.get("loaders", {}).get(name)
+        if after and after["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {before['rows_per_second']:.0f} -> {after['rows_per_second']:.0f} rows/s")
+    for name, before in baseline.get("queries", {}).items():
+        after = current.get("queries", {}).get(name)
+        for stat in ("p50", "p95"):
+            if after and after[stat] > before[stat] * (1 + tolerance):
+                regressions.append(f"{name} {stat}: {before[stat] * 1000:.2f} -> {after[stat] * 1000:.2f} ms")
+    return regressions
+
+def _report(results: Dict):
+    print(f"{'loader':<44}{'rows':>12}{'rejected':>10}{'rows/s':>14}")
+    for name, stats in results["loaders"].items():
+        print(f"{name:<44}{stats['rows']:>12}{stats['rejected']:>10}{stats['rows_per_second']:>14.0f}")
+    print(f"\n{'query':<44}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results["queries"].items():
+        print(f"{name:<44}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}{stats['p99'] * 1000:>10.2f}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the music_db loaders and queries.")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=music_db.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--database", help="SQLite file (in-memory by default), or MySQL database name")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--memory", type=int, metavar="N",
+                        help="only measure the memory taken by N ratings as tuples, records and columns")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        from music_db_records import measure_rating_memory
+        ratings = list(islice(SyntheticCatalog(args.memory * 2, args.seed, args.zipf_s).song_ratings(), args.memory))
+        for layout, size in measure_rating_memory(ratings).items():
+            print(f"{layout:<12}{size:>10.1f} bytes/rating")
+        return 0
+
+    if args.backend == "sqlite":
+        import music_db_sqlite
+        mydb = music_db_sqlite.connect(args.database or ":memory:")
+    else:
+        import mysql.connector
+        mydb = mysql.connector.connect(host=args.host, user=args.user, password=args.password,
+                                       database=args.database or "music_db")
+    try:
+        results = run_benchmark(mydb, args.rows, args.seed, args.batch_size, args.repeats, args.zipf_s)
+    finally:
+        mydb.close()
+    results["params"]["backend"] = args.backend
+    _report(results)
+    if args.output:
+        save_results(results, args.output)
+    if args.baseline:
+        regressions = compare_results(load_results(args.baseline), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+-- ====================================================
+-- Migration: FeedFingerprint table for feed delta-sync
+-- File: music_db_feed_fingerprints.sql
+-- Upgrades a database created from a music_db.sql that
+-- predates this table (the current one creates it).
+-- Apply once.
+-- ====================================================
+
+-- Digests of the feed records sync_single_songs and
+-- sync_albums have already applied (loaded or rejected).
+CREATE TABLE FeedFingerprint (
+    fingerprint BINARY(16) PRIMARY KEY
+);
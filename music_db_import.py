@@ -0,0 +1,406 @@
+"""
+Cold-start import path for the music database.
+
+The loaders in music_db.py resolve keys and rejections in Python. For a first
+import into an empty or mostly empty database it is much faster to let MySQL
+do the work: every input is written to a TSV file, bulk loaded into a staging
+table with LOAD DATA LOCAL INFILE, and then keys, duplicates and rejections
+are resolved with set-based SQL inside the database.
+
+The connection must allow local infile, e.g.
+    mysql.connector.connect(..., allow_local_infile=True)
+and the server needs local_infile=ON. The staging tables are ordinary tables
+shared by every session, so only one import may run against a database at a time.
+"""
+import os
+import tempfile
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+from music_db import (_database, _database_key, _partitioned_steps, _pooled, _rating_key_table, _run_steps,
+                      query_cache)
+
+_STAGING_TABLES = [
+    "CREATE TABLE IF NOT EXISTS StageSingle ("
+    " seq INT PRIMARY KEY,"
+    " title VARCHAR(100) NOT NULL,"
+    " artist_name VARCHAR(100) NOT NULL,"
+    " release_date DATE NOT NULL,"
+    " artist_id INT NULL,"
+    " is_duplicate TINYINT NOT NULL DEFAULT 0,"
+    " rejected TINYINT NOT NULL DEFAULT 0,"
+    " INDEX (artist_id, title))",
+    "CREATE TABLE IF NOT EXISTS StageSingleGenre ("
+    " seq INT NOT NULL,"
+    " genre_name VARCHAR(50) NOT NULL,"
+    " INDEX (seq))",
+    "CREATE TABLE IF NOT EXISTS StageAlbum ("
+    " seq INT PRIMARY KEY,"
+    " album_name VARCHAR(100) NOT NULL,"
+    " genre_name VARCHAR(50) NOT NULL,"
+    " artist_name VARCHAR(100) NOT NULL,"
+    " release_date DATE NOT NULL,"
+    " artist_id INT NULL,"
+    " genre_id INT NULL,"
+    " album_id INT NULL,"
+    " title_conflict TINYINT NOT NULL DEFAULT 0,"
+    " name_conflict TINYINT NOT NULL DEFAULT 0,"
+    " INDEX (artist_id, album_name))",
+    "CREATE TABLE IF NOT EXISTS StageTrack ("
+    " seq INT NOT NULL,"
+    " pos INT NOT NULL,"
+    " title VARCHAR(100) NOT NULL,"
+    " PRIMARY KEY (seq, pos),"
+    " INDEX (title))",
+    "CREATE TABLE IF NOT EXISTS StageUser ("
+    " seq INT PRIMARY KEY,"
+    " username VARCHAR(50) NOT NULL,"
+    " is_duplicate TINYINT NOT NULL DEFAULT 0,"
+    " rejected TINYINT NOT NULL DEFAULT 0,"
+    " INDEX (username))",
+    "CREATE TABLE IF NOT EXISTS StageRating ("
+    " seq INT PRIMARY KEY,"
+    " username VARCHAR(50) NOT NULL,"
+    " artist_name VARCHAR(100) NOT NULL,"
+    " song_title VARCHAR(100) NOT NULL,"
+    " rating INT NOT NULL,"
+    " rating_date DATE NOT NULL,"
+    " user_id INT NULL,"
+    " song_id INT NULL,"
+    " is_duplicate TINYINT NOT NULL DEFAULT 0,"
+    " rejected TINYINT NOT NULL DEFAULT 0,"
+    " INDEX (user_id, song_id))",
+]
+
+def _tsv_field(value) -> str:
+    """
+    Escape one value for LOAD DATA's default FIELDS ESCAPED BY '\\\\'.
+    """
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+class _StagingFile:
+    """
+    A temporary TSV file that rows are streamed into and that is then bulk
+    loaded into a staging table.
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], staging_dir: Optional[str]):
+        self.table = table
+        self.columns = columns
+        self._file = tempfile.NamedTemporaryFile("w", suffix=".tsv", dir=staging_dir, delete=False,
+                                                 encoding="utf-8", newline="")
+
+    def write(self, *values):
+        self._file.write("\t".join(_tsv_field(value) for value in values) + "\n")
+
+    def load(self, cursor):
+        self._file.close()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {self.table} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+            f"({','.join(self.columns)})",
+            (self._file.name,)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        os.unlink(self._file.name)
+
+def _prepare_staging(cursor, tables: Sequence[str]):
+    """
+    Create the staging tables if needed and empty the ones about to be used.
+    """
+    for statement in _STAGING_TABLES:
+        cursor.execute(statement)
+    for table in tables:
+        cursor.execute(f"TRUNCATE TABLE {table}")
+
+def _run(cursor, statements: Sequence[str]):
+    for statement in statements:
+        cursor.execute(statement)
+
+@_pooled
+def import_single_songs(mydb, single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]],
+                        staging_dir: Optional[str] = None) -> Set[Tuple[str,str]]:
+    """
+    Bulk-load single songs through LOAD DATA; same result as load_single_songs.
+
+    Args:
+        mydb: database connection opened with allow_local_infile=True
+        single_songs: (title, genres, artist_name, release_date) tuples
+        staging_dir: directory for the temporary TSV files (system default if None)
+
+    Returns:
+        set of (title, artist_name) for the rejected songs
+    """
+    # A plain cursor: LOAD DATA can't go through a prepared statement.
+    cursor = mydb.cursor(buffered=True)
+    _prepare_staging(cursor, ["StageSingle", "StageSingleGenre"])
+
+    with _StagingFile("StageSingle", ("seq", "title", "artist_name", "release_date"), staging_dir) as songs, \
+         _StagingFile("StageSingleGenre", ("seq", "genre_name"), staging_dir) as genres:
+        for seq, (title, song_genres, artist_name, release_date) in enumerate(single_songs):
+            songs.write(seq, title, artist_name, release_date)
+            for genre_name in song_genres:
+                genres.write(seq, genre_name)
+        songs.load(cursor)
+        genres.load(cursor)
+
+    _run(cursor, [
+        # 1. Get or Insert every Artist
+        "INSERT IGNORE INTO Artist (name) SELECT DISTINCT artist_name FROM StageSingle",
+        "UPDATE StageSingle st JOIN Artist a ON a.name = st.artist_name SET st.artist_id = a.artist_id",
+        # 2. Reject titles the artist already has, in the database or earlier in the input
+        "UPDATE StageSingle st JOIN Song s ON s.artist_id = st.artist_id AND s.title = st.title "
+        "SET st.rejected = 1",
+        "UPDATE StageSingle st JOIN StageSingle earlier "
+        "ON earlier.artist_id = st.artist_id AND earlier.title = st.title AND earlier.seq < st.seq "
+        "SET st.is_duplicate = 1",
+        "UPDATE StageSingle SET rejected = 1 WHERE is_duplicate = 1",
+        # 3. Insert Songs (Single -> album_id is NULL)
+        "INSERT INTO Song (title, artist_id, album_id, release_date) "
+        "SELECT title, artist_id, NULL, release_date FROM StageSingle WHERE rejected = 0 ORDER BY seq",
+        # 4. Handle Genres
+        "INSERT IGNORE INTO Genre (name) "
+        "SELECT DISTINCT sg.genre_name FROM StageSingleGenre sg "
+        "JOIN StageSingle st ON st.seq = sg.seq WHERE st.rejected = 0",
+        "INSERT IGNORE INTO SongGenre (song_id, genre_id) "
+        "SELECT s.song_id, g.genre_id FROM StageSingle st "
+        "JOIN Song s ON s.artist_id = st.artist_id AND s.title = st.title "
+        "JOIN StageSingleGenre sg ON sg.seq = st.seq "
+        "JOIN Genre g ON g.name = sg.genre_name "
+        "WHERE st.rejected = 0",
+    ])
+    cursor.execute("SELECT title, artist_name FROM StageSingle WHERE rejected = 1")
+    rejected_songs = set(cursor.fetchall())
+    mydb.commit()
+    query_cache.invalidate(("Artist", "Song", "Genre", "SongGenre"), _database_key(mydb))
+    return rejected_songs
+
+def _settle_album_conflicts(cursor):
+    """
+    Resolve rejections that depend on other albums of the same input.
+
+    An album conflicts with an earlier one of the same artist if they share a
+    song title or the album name, but only if the earlier album was accepted.
+    The candidate pairs are found with one self-join; they are rare, so their
+    outcome is decided in input order here and written back.
+    """
+    cursor.execute(
+        "SELECT DISTINCT later.seq, earlier.seq, 'title' "
+        "FROM StageAlbum later "
+        "JOIN StageTrack lt ON lt.seq = later.seq "
+        "JOIN StageAlbum earlier ON earlier.artist_id = later.artist_id AND earlier.seq < later.seq "
+        "JOIN StageTrack et ON et.seq = earlier.seq AND et.title = lt.title "
+        "WHERE later.title_conflict = 0 AND earlier.title_conflict = 0 "
+        "UNION "
+        "SELECT later.seq, earlier.seq, 'name' "
+        "FROM StageAlbum later "
+        "JOIN StageAlbum earlier ON earlier.artist_id = later.artist_id "
+        "AND earlier.album_name = later.album_name AND earlier.seq < later.seq "
+        "WHERE later.title_conflict = 0 AND earlier.title_conflict = 0"
+    )
+    pairs = cursor.fetchall()
+    if not pairs:
+        return
+
+    involved = sorted({seq for pair in pairs for seq in pair[:2]})
+    cursor.execute(
+        "SELECT seq, name_conflict FROM StageAlbum "
+        f"WHERE seq IN ({','.join(['%s'] * len(involved))})",
+        tuple(involved)
+    )
+    name_conflict = dict(cursor.fetchall())
+    title_conflict = dict.fromkeys(involved, 0)
+    blockers = {}
+    for later, earlier, kind in pairs:
+        blockers.setdefault(later, []).append((earlier, kind))
+
+    for seq in involved:
+        for earlier, kind in blockers.get(seq, []):
+            if title_conflict[earlier] or name_conflict[earlier]:
+                continue  # the earlier album was rejected and recorded nothing
+            if kind == "title":
+                title_conflict[seq] = 1
+            else:
+                name_conflict[seq] = 1
+
+    cursor.executemany(
+        "UPDATE StageAlbum SET title_conflict = %s, name_conflict = %s WHERE seq = %s",
+        [(title_conflict[seq], name_conflict[seq], seq) for seq in involved]
+    )
+
+@_pooled
+def import_albums(mydb, albums: Iterable[Tuple[str,str,str,str,List[str]]],
+                  staging_dir: Optional[str] = None) -> Set[Tuple[str,str]]:
+    """
+    Bulk-load albums through LOAD DATA; same result as load_albums.
+
+    Args:
+        mydb: database connection opened with allow_local_infile=True
+        albums: (album_name, genre_name, artist_name, release_date, songs) tuples
+        staging_dir: directory for the temporary TSV files (system default if None)
+
+    Returns:
+        set of (album_name, artist_name) for the rejected albums
+    """
+    # A plain cursor: LOAD DATA can't go through a prepared statement.
+    cursor = mydb.cursor(buffered=True)
+    _prepare_staging(cursor, ["StageAlbum", "StageTrack"])
+
+    with _StagingFile("StageAlbum", ("seq", "album_name", "genre_name", "artist_name", "release_date"),
+                      staging_dir) as album_file, \
+         _StagingFile("StageTrack", ("seq", "pos", "title"), staging_dir) as track_file:
+        for seq, (album_name, genre_name, artist_name, release_date, songs) in enumerate(albums):
+            album_file.write(seq, album_name, genre_name, artist_name, release_date)
+            for pos, title in enumerate(songs):
+                track_file.write(seq, pos, title)
+        album_file.load(cursor)
+        track_file.load(cursor)
+
+    accepted = "sa.title_conflict = 0 AND sa.name_conflict = 0"
+    _run(cursor, [
+        # 1. Get or Insert every Artist
+        "INSERT IGNORE INTO Artist (name) SELECT DISTINCT artist_name FROM StageAlbum",
+        "UPDATE StageAlbum sa JOIN Artist a ON a.name = sa.artist_name SET sa.artist_id = a.artist_id",
+        # 2. Conflicts with songs and albums already in the database
+        "UPDATE StageAlbum sa JOIN StageTrack t ON t.seq = sa.seq "
+        "JOIN Song s ON s.artist_id = sa.artist_id AND s.title = t.title "
+        "SET sa.title_conflict = 1",
+        "UPDATE StageAlbum sa JOIN Album al ON al.artist_id = sa.artist_id AND al.name = sa.album_name "
+        "SET sa.name_conflict = 1",
+    ])
+    # 3. Conflicts between albums of the input
+    _settle_album_conflicts(cursor)
+    _run(cursor, [
+        # 4. Get or Insert Genres (also for albums only rejected by name, as load_albums does)
+        "INSERT IGNORE INTO Genre (name) SELECT DISTINCT genre_name FROM StageAlbum WHERE title_conflict = 0",
+        "UPDATE StageAlbum sa JOIN Genre g ON g.name = sa.genre_name SET sa.genre_id = g.genre_id "
+        "WHERE sa.title_conflict = 0",
+        # 5. Insert Albums
+        "INSERT INTO Album (name, artist_id, release_date, genre_id) "
+        f"SELECT album_name, artist_id, release_date, genre_id FROM StageAlbum sa WHERE {accepted} ORDER BY seq",
+        "UPDATE StageAlbum sa JOIN Album al ON al.artist_id = sa.artist_id AND al.name = sa.album_name "
+        f"SET sa.album_id = al.album_id WHERE {accepted}",
+        # 6. Insert Songs; IGNORE drops a title repeated inside one album
+        "INSERT IGNORE INTO Song (title, artist_id, album_id, release_date) "
+        "SELECT t.title, sa.artist_id, sa.album_id, sa.release_date "
+        f"FROM StageAlbum sa JOIN StageTrack t ON t.seq = sa.seq WHERE {accepted} ORDER BY sa.seq, t.pos",
+        "INSERT IGNORE INTO SongGenre (song_id, genre_id) "
+        f"SELECT s.song_id, sa.genre_id FROM StageAlbum sa JOIN Song s ON s.album_id = sa.album_id WHERE {accepted}",
+    ])
+    cursor.execute("SELECT album_name, artist_name FROM StageAlbum sa WHERE NOT (" + accepted + ")")
+    rejected_albums = set(cursor.fetchall())
+    mydb.commit()
+    query_cache.invalidate(("Artist", "Album", "Song", "Genre", "SongGenre"), _database_key(mydb))
+    return rejected_albums
+
+@_pooled
+def import_users(mydb, users: Iterable[str], staging_dir: Optional[str] = None) -> Set[str]:
+    """
+    Bulk-load users through LOAD DATA; same result as load_users.
+
+    Args:
+        mydb: database connection opened with allow_local_infile=True
+        users: usernames
+        staging_dir: directory for the temporary TSV files (system default if None)
+
+    Returns:
+        set of usernames that already existed
+    """
+    # A plain cursor: LOAD DATA can't go through a prepared statement.
+    cursor = mydb.cursor(buffered=True)
+    _prepare_staging(cursor, ["StageUser"])
+
+    with _StagingFile("StageUser", ("seq", "username"), staging_dir) as user_file:
+        for seq, username in enumerate(users):
+            user_file.write(seq, username)
+        user_file.load(cursor)
+
+    _run(cursor, [
+        "UPDATE StageUser su JOIN User u ON u.username = su.username SET su.rejected = 1",
+        "UPDATE StageUser su JOIN StageUser earlier "
+        "ON earlier.username = su.username AND earlier.seq < su.seq SET su.is_duplicate = 1",
+        "UPDATE StageUser SET rejected = 1 WHERE is_duplicate = 1",
+        "INSERT INTO User (username) SELECT username FROM StageUser WHERE rejected = 0 ORDER BY seq",
+    ])
+    cursor.execute("SELECT username FROM StageUser WHERE rejected = 1")
+    rejected_users = {row[0] for row in cursor.fetchall()}
+    mydb.commit()
+    query_cache.invalidate(("User",), _database_key(mydb))
+    return rejected_users
+
+@_pooled
+def import_song_ratings(mydb, song_ratings: Iterable[Tuple[str,Tuple[str,str],int, str]],
+                        staging_dir: Optional[str] = None) -> Set[Tuple[str,str,str]]:
+    """
+    Bulk-load ratings through LOAD DATA; same result as load_song_ratings.
+
+    Args:
+        mydb: database connection opened with allow_local_infile=True
+        song_ratings: (username, (artist_name, song_title), rating, rating_date) tuples
+        staging_dir: directory for the temporary TSV files (system default if None)
+
+    Returns:
+        set of (username, artist_name, song_title) for the rejected ratings
+    """
+    # A plain cursor: LOAD DATA can't go through a prepared statement.
+    cursor = mydb.cursor(buffered=True)
+    rating_key_table = _rating_key_table(_run_steps(cursor, _partitioned_steps(_database(mydb))))
+    _prepare_staging(cursor, ["StageRating"])
+
+    with _StagingFile("StageRating",
+                      ("seq", "username", "artist_name", "song_title", "rating", "rating_date"),
+                      staging_dir) as rating_file:
+        for seq, (username, (artist_name, song_title), rating, rating_date) in enumerate(song_ratings):
+            rating_file.write(seq, username, artist_name, song_title, rating, rating_date)
+        rating_file.load(cursor)
+
+    _run(cursor, [
+        # Condition (d): rating range
+        "UPDATE StageRating SET rejected = 1 WHERE rating NOT BETWEEN 1 AND 5",
+        # Conditions (a) and (b): user and (artist, title) exist
+        "UPDATE StageRating sr JOIN User u ON u.username = sr.username "
+        "SET sr.user_id = u.user_id WHERE sr.rejected = 0",
+        "UPDATE StageRating sr JOIN Artist a ON a.name = sr.artist_name "
+        "JOIN Song s ON s.artist_id = a.artist_id AND s.title = sr.song_title "
+        "SET sr.song_id = s.song_id WHERE sr.rejected = 0",
+        "UPDATE StageRating SET rejected = 1 WHERE user_id IS NULL OR song_id IS NULL",
+        # Condition (c): duplicates of an existing rating, archived ones included
+        # (rating_key_table), or of an earlier one in the input
+        f"UPDATE StageRating sr JOIN {rating_key_table} r "
+        "ON r.user_id = sr.user_id AND r.song_id = sr.song_id SET sr.rejected = 1",
+        "UPDATE StageRating sr JOIN StageRating earlier "
+        "ON earlier.user_id = sr.user_id AND earlier.song_id = sr.song_id "
+        "AND earlier.seq < sr.seq AND earlier.rejected = 0 "
+        "SET sr.is_duplicate = 1 WHERE sr.rejected = 0",
+        "UPDATE StageRating SET rejected = 1 WHERE is_duplicate = 1",
+        "INSERT INTO Rating (user_id, song_id, rating, rating_date) "
+        "SELECT user_id, song_id, rating, rating_date FROM StageRating WHERE rejected = 0 ORDER BY seq",
+    ])
+    cursor.execute("SELECT username, artist_name, song_title FROM StageRating WHERE rejected = 1")
+    rejected_ratings = set(cursor.fetchall())
+    mydb.commit()
+    query_cache.invalidate(("Rating",), _database_key(mydb))
+    return rejected_ratings
+
+def import_catalog(mydb, single_songs: Iterable = (), albums: Iterable = (), users: Iterable = (),
+                   song_ratings: Iterable = (),
+                   staging_dir: Optional[str] = None) -> Tuple[Set[Tuple[str,str]], Set[Tuple[str,str]],
+                                                               Set[str], Set[Tuple[str,str,str]]]:
+    """
+    Import a whole catalog in dependency order: singles, albums, users, ratings.
+
+    Returns:
+        the rejected singles, albums, users and ratings, as the four
+        corresponding import_* functions return them
+    """
+    return (import_single_songs(mydb, single_songs, staging_dir),
+            import_albums(mydb, albums, staging_dir),
+            import_users(mydb, users, staging_dir),
+            import_song_ratings(mydb, song_ratings, staging_dir))
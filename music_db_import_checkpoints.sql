@@ -0,0 +1,17 @@
+-- ====================================================
+-- Migration: ImportCheckpoint table for resumable imports
+-- File: music_db_import_checkpoints.sql
+-- Upgrades a database created from a music_db.sql that
+-- predates this table (the current one creates it).
+-- Apply once.
+-- ====================================================
+
+-- How far each step of a resumable ImportJob has consumed
+-- its input; updated in the same transaction as every batch.
+CREATE TABLE ImportCheckpoint (
+    job_id VARCHAR(100) NOT NULL,
+    step VARCHAR(50) NOT NULL,
+    records_done BIGINT NOT NULL,
+    rejected BIGINT NOT NULL,
+    PRIMARY KEY (job_id, step)
+);
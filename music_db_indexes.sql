@@ -0,0 +1,16 @@
+-- ====================================================
+-- Migration: covering indexes for the date-range queries
+-- File: music_db_indexes.sql
+-- Apply once to a database created from music_db.sql.
+-- ====================================================
+
+-- get_most_rated_songs: range scan on rating_date, grouped by song_id
+-- (InnoDB secondary indexes carry the primary key, so rating_id is covered too)
+CREATE INDEX idx_rating_date_song ON Rating (rating_date, song_id);
+
+-- get_most_engaged_users: range scan on rating_date, grouped by user_id
+CREATE INDEX idx_rating_date_user ON Rating (rating_date, user_id);
+
+-- get_most_prolific_individual_artists and get_artists_last_single_in_year:
+-- singles (album_id IS NULL) by release_date, with the artist they belong to
+CREATE INDEX idx_song_album_date_artist ON Song (album_id, release_date, artist_id);
@@ -0,0 +1,193 @@
+"""
+In-memory leaderboards of the most rated songs and most engaged users.
+
+A Leaderboard keeps, for every rating year, the number of ratings of each
+song and of each user in NumPy int32 arrays indexed by song_id / user_id.
+rebuild() fills them from the Rating table; attach() then registers the
+leaderboard in music_db.rating_listeners, so every batch committed by
+load_song_ratings (or ImportJob.load_song_ratings) is added as it is written.
+get_most_rated_songs and get_most_engaged_users answer from the arrays: the
+counts of the years in the range are summed and the top n are picked with a
+partial sort, without a database round trip. Ties are broken with the
+collation sort key of each title and username (WEIGHT_STRING()), read once
+with the name, so they follow the database collation.
+
+The results are those of the SQL versions: same rows, same order, ties
+broken by title or username, songs tied on both by song_id.
+
+Ratings written any other way (music_db_import, other processes, manual SQL)
+and clear_database are not seen; call rebuild() after them.
+"""
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import music_db
+from music_db import _connection
+
+def _grow(counts: np.ndarray, size: int) -> np.ndarray:
+    """
+    Return `counts` extended with zeros to at least `size` entries.
+    """
+    if size <= len(counts):
+        return counts
+    grown = np.zeros(max(size, 2 * len(counts)), dtype=counts.dtype)
+    grown[:len(counts)] = counts
+    return grown
+
+def _year(rating_date) -> int:
+    return int(str(rating_date)[:4])
+
+class _YearCounts:
+    """
+    Per-year rating counts of one key (song_id or user_id).
+    """
+
+    def __init__(self):
+        self.years: Dict[int,np.ndarray] = {}
+
+    def add(self, year: int, ids: np.ndarray, counts: Optional[np.ndarray] = None):
+        array = _grow(self.years.get(year, np.zeros(0, dtype=np.int32)), int(ids.max()) + 1)
+        np.add.at(array, ids, 1 if counts is None else counts)
+        self.years[year] = array
+
+    def total(self, start_year: int, end_year: int) -> np.ndarray:
+        arrays = [array for year, array in self.years.items() if start_year <= year <= end_year]
+        total = np.zeros(max((len(array) for array in arrays), default=0), dtype=np.int64)
+        for array in arrays:
+            total[:len(array)] += array
+        return total
+
+def _top(counts: np.ndarray, n: int, sort_key) -> List[int]:
+    """
+    Ids of the (at most) n nonzero counts, by count descending and then by
+    sort_key(id) ascending.
+    """
+    candidates = np.flatnonzero(counts)
+    if n <= 0 or len(candidates) == 0:
+        return []
+    if n < len(candidates):
+        # Everything tied with the n-th largest count may still make the cut.
+        threshold = np.partition(counts[candidates], len(candidates) - n)[len(candidates) - n]
+        candidates = candidates[counts[candidates] >= threshold]
+    return sorted(candidates.tolist(), key=lambda id_: (-counts[id_], sort_key(id_)))[:n]
+
+class Leaderboard:
+    """
+    Rating counts per year, kept in memory and answering the top-n rating queries.
+    """
+
+    def __init__(self, mydb):
+        """
+        Args:
+            mydb: database connection or PooledDatabase, used by rebuild() and
+                to look up the names of songs and users rated for the first time
+        """
+        self.mydb = mydb
+        self._songs = _YearCounts()
+        self._users = _YearCounts()
+        # id -> (title, artist_name, title sort key) and id -> (username, username sort key);
+        # a sort key is the collation weight of the name, compared like ORDER BY compares names.
+        self._song_names: Dict[int,Tuple[str,str,bytes]] = {}
+        self._usernames: Dict[int,Tuple[str,bytes]] = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        """
+        Recount everything from the Rating table (one grouped read per key).
+        """
+        songs, users = _YearCounts(), _YearCounts()
+        with _connection(self.mydb) as connection:
+            cursor = connection.cursor()
+            for counts, key in ((songs, "song_id"), (users, "user_id")):
+                cursor.execute(f"SELECT YEAR(rating_date), {key}, COUNT(*) FROM Rating "
+                               f"GROUP BY YEAR(rating_date), {key}")
+                rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+                for year in np.unique(rows[:, 0]):
+                    of_year = rows[rows[:, 0] == year]
+                    counts.add(int(year), of_year[:, 1], of_year[:, 2])
+            song_names = self._select_song_names(cursor, None)
+            usernames = self._select_usernames(cursor, None)
+            connection.commit()
+        with self._lock:
+            self._songs, self._users = songs, users
+            self._song_names, self._usernames = song_names, usernames
+
+    @staticmethod
+    def _select_song_names(cursor, song_ids: Optional[Sequence[int]]) -> Dict[int,Tuple[str,str,bytes]]:
+        sql = ("SELECT s.song_id, s.title, a.name, WEIGHT_STRING(s.title) "
+               "FROM Song s JOIN Artist a ON a.artist_id = s.artist_id")
+        if song_ids is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(f"{sql} WHERE s.song_id IN ({','.join(['%s'] * len(song_ids))})", tuple(song_ids))
+        return {song_id: (title, artist_name, weight) for song_id, title, artist_name, weight in cursor.fetchall()}
+
+    @staticmethod
+    def _select_usernames(cursor, user_ids: Optional[Sequence[int]]) -> Dict[int,Tuple[str,bytes]]:
+        sql = "SELECT user_id, username, WEIGHT_STRING(username) FROM User"
+        if user_ids is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(f"{sql} WHERE user_id IN ({','.join(['%s'] * len(user_ids))})", tuple(user_ids))
+        return {user_id: (username, weight) for user_id, username, weight in cursor.fetchall()}
+
+    def add_ratings(self, ratings: Sequence[Tuple[int,int,str]]):
+        """
+        Count newly committed ratings, given as (user_id, song_id, rating_date);
+        this is the rating_listeners callback.
+        """
+        if not ratings:
+            return
+        new_songs = sorted({song_id for _, song_id, _ in ratings if song_id not in self._song_names})
+        new_users = sorted({user_id for user_id, _, _ in ratings if user_id not in self._usernames})
+        song_names, usernames = {}, {}
+        if new_songs or new_users:
+            with _connection(self.mydb) as connection:
+                cursor = connection.cursor()
+                for chunk in music_db._chunked(new_songs, music_db.MAX_ROWS_PER_STATEMENT):
+                    song_names.update(self._select_song_names(cursor, chunk))
+                for chunk in music_db._chunked(new_users, music_db.MAX_ROWS_PER_STATEMENT):
+                    usernames.update(self._select_usernames(cursor, chunk))
+                connection.commit()
+        by_year: Dict[int,Tuple[List[int],List[int]]] = {}
+        for user_id, song_id, rating_date in ratings:
+            users, songs = by_year.setdefault(_year(rating_date), ([], []))
+            users.append(user_id)
+            songs.append(song_id)
+        with self._lock:
+            self._song_names.update(song_names)
+            self._usernames.update(usernames)
+            for year, (users, songs) in by_year.items():
+                self._users.add(year, np.array(users, dtype=np.int64))
+                self._songs.add(year, np.array(songs, dtype=np.int64))
+
+    def attach(self):
+        """
+        Start counting the ratings committed by load_song_ratings.
+        """
+        if self.add_ratings not in music_db.rating_listeners:
+            music_db.rating_listeners.append(self.add_ratings)
+
+    def detach(self):
+        if self.add_ratings in music_db.rating_listeners:
+            music_db.rating_listeners.remove(self.add_ratings)
+
+    def get_most_rated_songs(self, year_range: Tuple[int,int], n: int) -> List[Tuple[str,str,int]]:
+        """
+        Get the top n most rated songs in the given year range (both inclusive).
+        """
+        with self._lock:
+            counts = self._songs.total(*year_range)
+            top = _top(counts, n, lambda song_id: (self._song_names[song_id][2], song_id))
+            return [self._song_names[song_id][:2] + (int(counts[song_id]),) for song_id in top]
+
+    def get_most_engaged_users(self, year_range: Tuple[int,int], n: int) -> List[Tuple[str,int]]:
+        """
+        Get the top n most engaged users.
+        """
+        with self._lock:
+            counts = self._users.total(*year_range)
+            top = _top(counts, n, lambda user_id: (self._usernames[user_id][1], user_id))
+            return [(self._usernames[user_id][0], int(counts[user_id])) for user_id in top]
@@ -0,0 +1,283 @@
+"""
+Opt-in instrumentation for music_db.
+
+Wrap a connection with instrument() and pass the result wherever a connection
+is accepted, or build a pool of wrapped connections:
+
+    registry = MetricsRegistry(slow_threshold=0.05, hook=forward_to_tracer)
+    mydb = instrument(mysql.connector.connect(...), registry)
+    pool = PooledDatabase(connect=lambda: instrument(mysql.connector.connect(...), registry))
+
+Every statement run through the wrapped cursors is timed, from execute() until
+its result is fetched, and attributed to the public music_db function that ran
+it (one "operation" per call, see music_db._Operation; calls nested in another
+call count towards the outer one). The registry keeps, per operation, the
+number of calls, statements, round trips and commits and the time spent in
+SQL; per normalized statement text, the count and timings; and the slowest
+statements with their EXPLAIN plans. `hook`, if given, receives one event
+dict per statement and per commit, e.g. to forward them as tracing spans.
+
+Statements are counted as the server sees them: executemany() of N parameter
+sets counts N statements but one round trip, as the MySQL driver sends a
+batched INSERT as one multi-row statement.
+"""
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from music_db import _current_operation
+
+_PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+_ROW_LIST = re.compile(r"\(%s, \.\.\.\)(?:\s*,\s*\(%s(?:, \.\.\.)?\))+|\(%s\)(?:\s*,\s*\(%s\))+")
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapse the variable-length placeholder lists of the batched statements,
+    so all the executions of one statement share a key.
+    """
+    sql = _PLACEHOLDER_LIST.sub("%s, ...", sql)
+    return _ROW_LIST.sub("(%s, ...), ...", sql)
+
+class _OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.statements = 0
+        self.round_trips = 0
+        self.commits = 0
+        self.sql_seconds = 0.0
+        self.max_statements_per_call = 0
+
+    def as_dict(self) -> Dict:
+        return {"calls": self.calls, "statements": self.statements, "round_trips": self.round_trips,
+                "commits": self.commits, "sql_seconds": self.sql_seconds,
+                "max_statements_per_call": self.max_statements_per_call}
+
+class _StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+    def as_dict(self) -> Dict:
+        return {"count": self.count, "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds, "rows": self.rows}
+
+class MetricsRegistry:
+    """
+    Collects what the instrumented connections observe.
+    """
+
+    def __init__(self, slow_threshold: Optional[float] = 0.1, explain: bool = True,
+                 hook: Optional[Callable[[Dict], None]] = None, max_slow_statements: int = 100):
+        """
+        Args:
+            slow_threshold: seconds above which a statement is kept as slow
+                (None to keep none)
+            explain: run EXPLAIN for slow SELECT statements and keep the plan
+            hook: called with an event dict for every statement and commit;
+                its exceptions are counted in `hook_errors`, never raised
+            max_slow_statements: how many slow statements are kept (the most recent)
+        """
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.hook = hook
+        self.hook_errors = 0
+        self.operations: Dict[str,_OperationStats] = {}
+        self.statements: Dict[str,_StatementStats] = {}
+        self.slow_statements: Deque[Dict] = deque(maxlen=max_slow_statements)
+        # Statements so far of each call still running; an operation seen for
+        # the first time is a new call.
+        self._per_call: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _stats_for_current_operation(self):
+        """
+        Return the active operation (or None) and its stats; call with the lock held.
+        """
+        operation = _current_operation.get()
+        name = operation.name if operation is not None else "<outside music_db>"
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = self.operations[name] = _OperationStats()
+        if operation is not None and operation not in self._per_call:
+            self._per_call[operation] = 0
+            stats.calls += 1
+        return operation, name, stats
+
+    def record_statement(self, sql: str, seconds: float, statements: int, rows: int,
+                         plan: Optional[list] = None):
+        key = normalize_sql(sql)
+        with self._lock:
+            operation, name, stats = self._stats_for_current_operation()
+            stats.statements += statements
+            stats.round_trips += 1
+            stats.sql_seconds += seconds
+            if operation is not None:
+                self._per_call[operation] += statements
+                stats.max_statements_per_call = max(stats.max_statements_per_call, self._per_call[operation])
+            statement = self.statements.get(key)
+            if statement is None:
+                statement = self.statements[key] = _StatementStats()
+            statement.count += statements
+            statement.total_seconds += seconds
+            statement.max_seconds = max(statement.max_seconds, seconds)
+            statement.rows += rows
+            slow = self.is_slow(seconds)
+            if slow:
+                self.slow_statements.append({"operation": name, "sql": sql, "seconds": seconds,
+                                             "plan": plan, "time": time.time()})
+        self._emit({"type": "statement", "operation": name, "sql": key, "seconds": seconds,
+                    "statements": statements, "rows": rows, "slow": slow, "plan": plan})
+
+    def record_commit(self, seconds: float):
+        with self._lock:
+            _, name, stats = self._stats_for_current_operation()
+            stats.commits += 1
+            stats.round_trips += 1
+            stats.sql_seconds += seconds
+        self._emit({"type": "commit", "operation": name, "seconds": seconds})
+
+    def is_slow(self, seconds: float) -> bool:
+        return self.slow_threshold is not None and seconds >= self.slow_threshold
+
+    def _emit(self, event: Dict):
+        if self.hook is None:
+            return
+        try:
+            self.hook(event)
+        except Exception:
+            self.hook_errors += 1
+
+    def snapshot(self) -> Dict:
+        """
+        Return the collected metrics as plain dicts.
+        """
+        with self._lock:
+            return {
+                "operations": {name: stats.as_dict() for name, stats in self.operations.items()},
+                "statements": {sql: stats.as_dict() for sql, stats in self.statements.items()},
+                "slow_statements": list(self.slow_statements),
+                "hook_errors": self.hook_errors,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.statements.clear()
+            self.slow_statements.clear()
+            self._per_call.clear()
+            self.hook_errors = 0
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper timing each statement until its result has been fetched.
+    """
+
+    def __init__(self, connection: "InstrumentedConnection", cursor):
+        self._connection = connection
+        self._cursor = cursor
+        self._pending = None  # [sql, params, statements, seconds, rows]
+
+    def _finish(self):
+        if self._pending is None:
+            return
+        sql, params, statements, seconds, rows = self._pending
+        self._pending = None
+        registry = self._connection.registry
+        plan = None
+        if registry.explain and registry.is_slow(seconds) and _EXPLAINABLE.match(sql):
+            plan = self._connection.explain(sql, params)
+        registry.record_statement(sql, seconds, statements, rows, plan)
+
+    def _timed_fetch(self, fetch, count_rows: Callable, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._pending is not None:
+            self._pending[3] += time.perf_counter() - start
+            self._pending[4] += count_rows(result)
+        return result
+
+    def execute(self, sql: str, params=()):
+        self._finish()
+        start = time.perf_counter()
+        result = self._cursor.execute(sql, params)
+        self._pending = [sql, params, 1, time.perf_counter() - start, 0]
+        if self._cursor.description is None:
+            # No result set to wait for.
+            self._finish()
+        return result
+
+    def executemany(self, sql: str, seq_params):
+        self._finish()
+        seq_params = list(seq_params)
+        start = time.perf_counter()
+        result = self._cursor.executemany(sql, seq_params)
+        self._pending = [sql, None, len(seq_params), time.perf_counter() - start, 0]
+        self._finish()
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone, lambda row: row is not None)
+
+    def fetchmany(self, *args):
+        return self._timed_fetch(self._cursor.fetchmany, len, *args)
+
+    def fetchall(self):
+        result = self._timed_fetch(self._cursor.fetchall, len)
+        self._finish()
+        return result
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class InstrumentedConnection:
+    """
+    Connection wrapper whose cursors report to `registry`.
+    """
+
+    def __init__(self, connection, registry: MetricsRegistry):
+        self.connection = connection
+        self.registry = registry
+
+    def cursor(self, *args, **kwargs) -> InstrumentedCursor:
+        return InstrumentedCursor(self, self.connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        start = time.perf_counter()
+        self.connection.commit()
+        self.registry.record_commit(time.perf_counter() - start)
+
+    def explain(self, sql: str, params) -> list:
+        """
+        EXPLAIN a statement on a separate cursor; a failure is returned as the plan.
+        """
+        try:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(f"EXPLAIN {sql}", params)
+                return [tuple(row) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as err:
+            return [f"EXPLAIN failed: {err}"]
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+def instrument(connection, registry: MetricsRegistry) -> InstrumentedConnection:
+    """
+    Wrap `connection` so that everything music_db runs on it reports to `registry`.
+    """
+    return InstrumentedConnection(connection, registry)
@@ -0,0 +1,125 @@
+"""
+Parallel partitioned ingest for the music database.
+
+The input of a loader is split into partitions such that rows which can
+conflict with each other always land in the same partition: singles and
+albums are partitioned by artist (UNIQUE(artist_id, title) and
+UNIQUE(artist_id, name) never span artists), ratings by user
+(UNIQUE(user_id, song_id) never spans users). Each partition is loaded in its
+own process on its own connection with the regular music_db loader, keeping
+input order within the partition, and the rejection sets are merged at the end.
+
+Artist and Genre rows may still be created by two workers at once. The loaders
+create them with INSERT IGNORE in sorted order and re-read them, the workers
+run at READ COMMITTED so that re-read sees the other worker's row, and a batch
+that still deadlocks is rolled back and retried.
+"""
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import music_db
+from music_db import DEFAULT_BATCH_SIZE, _chunked, _fold
+
+# MySQL errors after which InnoDB has rolled back the transaction and it is
+# safe to run the same batch again: deadlock, lock wait timeout.
+RETRYABLE_ERRNOS = (1213, 1205)
+MAX_RETRIES = 5
+
+def _partition(items: Iterable, key: Callable, partitions: int) -> List[list]:
+    """
+    Split `items` into `partitions` lists by a stable hash of key(item),
+    keeping the input order inside each list.
+    """
+    parts = [[] for _ in range(partitions)]
+    for item in items:
+        parts[zlib.crc32(_fold(key(item)).encode("utf-8")) % partitions].append(item)
+    return parts
+
+def _connect(connect: Optional[Callable], connect_kwargs: Dict):
+    if connect is None:
+        import mysql.connector
+        connect = mysql.connector.connect
+    mydb = connect(**connect_kwargs)
+    cursor = mydb.cursor()
+    cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+    cursor.close()
+    return mydb
+
+def _load_partition(loader_name: str, items: list, batch_size: int,
+                    connect: Optional[Callable], connect_kwargs: Dict) -> Set:
+    """
+    Worker: load one partition batch by batch, retrying a batch that was
+    rolled back by a deadlock or lock wait timeout.
+    """
+    loader = getattr(music_db, loader_name)
+    mydb = _connect(connect, connect_kwargs)
+    rejected = set()
+    try:
+        for batch in _chunked(items, batch_size):
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    rejected |= loader(mydb, batch, batch_size=len(batch))
+                    break
+                except Exception as err:
+                    if getattr(err, "errno", None) not in RETRYABLE_ERRNOS or attempt == MAX_RETRIES:
+                        raise
+                    mydb.rollback()
+    finally:
+        mydb.close()
+    return rejected
+
+def _parallel_load(loader_name: str, items: Iterable, key: Callable, workers: int,
+                   batch_size: int, connect: Optional[Callable], connect_kwargs: Dict) -> Set:
+    parts = [part for part in _partition(items, key, workers) if part]
+    rejected = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load_partition, loader_name, part, batch_size, connect, connect_kwargs)
+                   for part in parts]
+        for future in futures:
+            rejected |= future.result()
+    music_db.query_cache.invalidate()
+    return rejected
+
+def parallel_load_single_songs(single_songs: Iterable[Tuple[str,Tuple[str,...],str,str]], workers: int = 4,
+                               batch_size: int = DEFAULT_BATCH_SIZE, connect: Optional[Callable] = None,
+                               **connect_kwargs) -> Set[Tuple[str,str]]:
+    """
+    load_single_songs partitioned by artist over `workers` processes.
+
+    Args:
+        single_songs: (title, genres, artist_name, release_date) tuples
+        workers: number of worker processes (and connections)
+        batch_size: number of songs written per transaction in each worker
+        connect: picklable connection factory, mysql.connector.connect by default
+        **connect_kwargs: arguments for the factory (host, user, database, ...)
+
+    Returns:
+        the merged set of rejected (title, artist_name)
+    """
+    return _parallel_load("load_single_songs", single_songs, lambda song: tuple(song)[2],
+                          workers, batch_size, connect, connect_kwargs)
+
+def parallel_load_albums(albums: Iterable[Tuple[str,str,str,str,List[str]]], workers: int = 4,
+                         batch_size: int = DEFAULT_BATCH_SIZE, connect: Optional[Callable] = None,
+                         **connect_kwargs) -> Set[Tuple[str,str]]:
+    """
+    load_albums partitioned by artist over `workers` processes.
+
+    Returns:
+        the merged set of rejected (album_name, artist_name)
+    """
+    return _parallel_load("load_albums", albums, lambda album: tuple(album)[2],
+                          workers, batch_size, connect, connect_kwargs)
+
+def parallel_load_song_ratings(song_ratings: Iterable[Tuple[str,Tuple[str,str],int, str]], workers: int = 4,
+                               batch_size: int = DEFAULT_BATCH_SIZE, connect: Optional[Callable] = None,
+                               **connect_kwargs) -> Set[Tuple[str,str,str]]:
+    """
+    load_song_ratings partitioned by user over `workers` processes.
+
+    Returns:
+        the merged set of rejected (username, artist_name, song_title)
+    """
+    return _parallel_load("load_song_ratings", song_ratings, lambda rating: tuple(rating)[0],
+                          workers, batch_size, connect, connect_kwargs)
@@ -0,0 +1,107 @@
+-- ====================================================
+-- Migration: range-partition Rating by rating_date
+-- File: music_db_partitioning.sql
+-- MySQL only. Apply after music_db.sql and music_db_indexes.sql; the
+-- application finds RatingKey on its next connection.
+--
+-- Every unique key of a partitioned table must contain the partitioning
+-- column, and partitioned InnoDB tables cannot have foreign keys, so
+-- UNIQUE (user_id, song_id) and the foreign keys of Rating move to the
+-- RatingKey table, filled by a BEFORE INSERT trigger on Rating: a
+-- duplicate rating fails on RatingKey's primary key. RatingKey keeps the
+-- keys of archived ratings, so a user still cannot rate a song twice.
+-- ====================================================
+
+CREATE TABLE RatingKey (
+    user_id INT NOT NULL,
+    song_id INT NOT NULL,
+    PRIMARY KEY (user_id, song_id),
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE
+);
+
+INSERT INTO RatingKey (user_id, song_id) SELECT user_id, song_id FROM Rating;
+
+-- One partition per year; the date-range queries are pruned to the years
+-- they cover. music_db_partitions.add_rating_partitions() splits new years
+-- off p_future, archive_rating_years() drops the old ones.
+CREATE TABLE RatingPartitioned (
+    rating_id INT AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    song_id INT NOT NULL,
+    rating TINYINT NOT NULL CHECK (rating >= 1 AND rating <= 5),
+    rating_date DATE NOT NULL,
+    PRIMARY KEY (rating_id, rating_date),
+    INDEX (user_id, song_id),
+    INDEX idx_rating_date_song (rating_date, song_id),
+    INDEX idx_rating_date_user (rating_date, user_id)
+)
+PARTITION BY RANGE COLUMNS (rating_date) (
+    PARTITION p_old VALUES LESS THAN ('2000-01-01'),
+    PARTITION p2000 VALUES LESS THAN ('2001-01-01'),
+    PARTITION p2001 VALUES LESS THAN ('2002-01-01'),
+    PARTITION p2002 VALUES LESS THAN ('2003-01-01'),
+    PARTITION p2003 VALUES LESS THAN ('2004-01-01'),
+    PARTITION p2004 VALUES LESS THAN ('2005-01-01'),
+    PARTITION p2005 VALUES LESS THAN ('2006-01-01'),
+    PARTITION p2006 VALUES LESS THAN ('2007-01-01'),
+    PARTITION p2007 VALUES LESS THAN ('2008-01-01'),
+    PARTITION p2008 VALUES LESS THAN ('2009-01-01'),
+    PARTITION p2009 VALUES LESS THAN ('2010-01-01'),
+    PARTITION p2010 VALUES LESS THAN ('2011-01-01'),
+    PARTITION p2011 VALUES LESS THAN ('2012-01-01'),
+    PARTITION p2012 VALUES LESS THAN ('2013-01-01'),
+    PARTITION p2013 VALUES LESS THAN ('2014-01-01'),
+    PARTITION p2014 VALUES LESS THAN ('2015-01-01'),
+    PARTITION p2015 VALUES LESS THAN ('2016-01-01'),
+    PARTITION p2016 VALUES LESS THAN ('2017-01-01'),
+    PARTITION p2017 VALUES LESS THAN ('2018-01-01'),
+    PARTITION p2018 VALUES LESS THAN ('2019-01-01'),
+    PARTITION p2019 VALUES LESS THAN ('2020-01-01'),
+    PARTITION p2020 VALUES LESS THAN ('2021-01-01'),
+    PARTITION p2021 VALUES LESS THAN ('2022-01-01'),
+    PARTITION p2022 VALUES LESS THAN ('2023-01-01'),
+    PARTITION p2023 VALUES LESS THAN ('2024-01-01'),
+    PARTITION p2024 VALUES LESS THAN ('2025-01-01'),
+    PARTITION p2025 VALUES LESS THAN ('2026-01-01'),
+    PARTITION p2026 VALUES LESS THAN ('2027-01-01'),
+    PARTITION p2027 VALUES LESS THAN ('2028-01-01'),
+    PARTITION p2028 VALUES LESS THAN ('2029-01-01'),
+    PARTITION p2029 VALUES LESS THAN ('2030-01-01'),
+    PARTITION p2030 VALUES LESS THAN ('2031-01-01'),
+    PARTITION p_future VALUES LESS THAN (MAXVALUE)
+);
+
+INSERT INTO RatingPartitioned (rating_id, user_id, song_id, rating, rating_date)
+SELECT rating_id, user_id, song_id, rating, rating_date FROM Rating;
+
+-- Also drops the rollup triggers of the old table.
+DROP TABLE Rating;
+RENAME TABLE RatingPartitioned TO Rating;
+
+CREATE TRIGGER rating_key BEFORE INSERT ON Rating FOR EACH ROW
+    INSERT INTO RatingKey (user_id, song_id) VALUES (NEW.user_id, NEW.song_id);
+
+CREATE TRIGGER rating_song_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO SongYearRatingCount (song_id, rating_year, rating_count)
+    VALUES (NEW.song_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
+
+CREATE TRIGGER rating_user_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO UserYearRatingCount (user_id, rating_year, rating_count)
+    VALUES (NEW.user_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
+
+-- ====================================================
+-- RatingArchive Table
+-- One row per partition dropped by archive_rating_years(); the
+-- ratings themselves live on in SongYearRatingCount and
+-- UserYearRatingCount (and in RatingKey).
+-- ====================================================
+CREATE TABLE RatingArchive (
+    partition_name VARCHAR(64) PRIMARY KEY,
+    upper_bound DATE NOT NULL,
+    rating_count BIGINT NOT NULL,
+    archive_table VARCHAR(64) NULL,
+    archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
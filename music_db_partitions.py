@@ -0,0 +1,143 @@
+"""
+Maintenance of the range-partitioned Rating table (MySQL only).
+
+music_db_partitioning.sql rebuilds Rating with one partition per year of
+rating_date (p2000, p2001, ..., plus p_old below the first year and
+p_future above the last) and moves its uniqueness to RatingKey. The
+date-range queries then only read the partitions of the years they cover.
+The loaders, clear_database and rebuild_rollups tell a partitioned Rating
+by its RatingKey table, probed once per connection or PooledDatabase:
+reconnect after applying the script to a database already in use.
+
+    add_rating_partitions(mydb, 2035)     # split p2031..p2035 off p_future
+    archive_rating_years(mydb, 2010)      # drop the partitions before 2010
+
+Archiving needs no large DELETE: each partition is dropped whole (after
+being exchanged into a table of its own, if asked). Its counts live on in
+the SongYearRatingCount and UserYearRatingCount rollups, which the triggers
+kept up to date as the ratings were written, so get_most_rated_songs and
+get_most_engaged_users (with their default use_rollups=True) still count
+the archived years; queries that read Rating itself (use_rollups=False,
+snapshots, Leaderboard.rebuild) no longer see them. rebuild_rollups()
+leaves the rollup rows of the archived years alone and only recomputes
+the later ones from Rating.
+"""
+import datetime
+from typing import List, Optional, Tuple
+
+from music_db import EXECUTE, FETCHALL, FETCHONE, _database_key, _pooled, _run_steps, query_cache
+
+def _partition_name(year: int) -> str:
+    return f"p{year:04d}"
+
+def _rating_partitions_steps():
+    rows = yield (FETCHALL,
+                  "SELECT partition_name, partition_description FROM information_schema.partitions "
+                  "WHERE table_schema = DATABASE() AND table_name = 'Rating' AND partition_name IS NOT NULL "
+                  "ORDER BY partition_ordinal_position",
+                  ())
+    # RANGE COLUMNS bounds read back as quoted literals, e.g. '2001-01-01'.
+    return [(name, None if bound == "MAXVALUE" else datetime.date.fromisoformat(bound.strip("'")))
+            for name, bound in rows]
+
+@_pooled
+def rating_partitions(mydb) -> List[Tuple[str,datetime.date]]:
+    """
+    Return (partition_name, upper_bound) for every partition of Rating, in
+    order; the bound is exclusive, and None for p_future.
+    """
+    partitions = _run_steps(mydb.cursor(), _rating_partitions_steps())
+    mydb.commit()
+    return partitions
+
+def _add_rating_partitions_steps(through_year: int, from_year: Optional[int]):
+    partitions = yield from _rating_partitions_steps()
+    future, _ = partitions[-1]
+    bounds = [bound for _, bound in partitions if bound is not None]
+    if bounds:
+        first_year = max(bounds).year
+    elif from_year is not None:
+        first_year = from_year
+    else:
+        # Archiving left only p_future: go on from the last archived year.
+        row = yield FETCHONE, "SELECT MAX(upper_bound) FROM RatingArchive", ()
+        if row[0] is None:
+            raise ValueError("Rating has no partition bound to continue from; pass from_year")
+        first_year = int(str(row[0])[:4])
+    years = range(first_year, through_year + 1)
+    if not years:
+        return []
+    definitions = [f"PARTITION {_partition_name(year)} VALUES LESS THAN ('{year + 1:04d}-01-01')" for year in years]
+    yield (EXECUTE,
+           f"ALTER TABLE Rating REORGANIZE PARTITION {future} INTO "
+           f"({', '.join(definitions)}, PARTITION {future} VALUES LESS THAN (MAXVALUE))",
+           ())
+    return [_partition_name(year) for year in years]
+
+@_pooled
+def add_rating_partitions(mydb, through_year: int, from_year: Optional[int] = None) -> List[str]:
+    """
+    Give every year up to `through_year` its own partition, splitting them
+    off p_future (whose rows, if any, are moved into them).
+
+    Args:
+        mydb: database connection
+        through_year: last year to partition
+        from_year: first year to partition when archiving has left only
+            p_future; by default the year after the last archived one
+
+    Returns:
+        the names of the partitions created
+    """
+    created = _run_steps(mydb.cursor(), _add_rating_partitions_steps(through_year, from_year))
+    mydb.commit()
+    return created
+
+def _archive_rating_years_steps(before_year: int, keep_tables: bool):
+    partitions = yield from _rating_partitions_steps()
+    cutoff = datetime.date(before_year, 1, 1)
+    # Ratings dated before the cutoff that are written later land in the
+    # lowest remaining partition, and are archived with it.
+    cold = [(name, bound) for name, bound in partitions if bound is not None and bound <= cutoff]
+    archived = []
+    for name, bound in cold:
+        row = yield FETCHONE, f"SELECT COUNT(*) FROM Rating PARTITION ({name})", ()
+        archive_table = None
+        if keep_tables:
+            archive_table = f"Rating_{name}"
+            yield EXECUTE, f"CREATE TABLE {archive_table} LIKE Rating", ()
+            yield EXECUTE, f"ALTER TABLE {archive_table} REMOVE PARTITIONING", ()
+            yield EXECUTE, f"ALTER TABLE Rating EXCHANGE PARTITION {name} WITH TABLE {archive_table}", ()
+        yield EXECUTE, f"ALTER TABLE Rating DROP PARTITION {name}", ()
+        yield (EXECUTE,
+               "INSERT INTO RatingArchive (partition_name, upper_bound, rating_count, archive_table) "
+               "VALUES (%s,%s,%s,%s)",
+               (name, bound, row[0], archive_table))
+        archived.append(name)
+    return archived
+
+@_pooled
+def archive_rating_years(mydb, before_year: int, keep_tables: bool = False) -> List[str]:
+    """
+    Drop the Rating partitions that only hold ratings from before
+    `before_year`, recording each in RatingArchive. The ratings stay counted
+    in the per-year rollups and their keys in RatingKey.
+
+    Partition DDL commits implicitly: partitions archived before a failure
+    stay archived.
+
+    Args:
+        mydb: database connection
+        before_year: first year to keep
+        keep_tables: first exchange each partition into a table of its own,
+            Rating_<partition>, which can be dumped or moved elsewhere
+
+    Returns:
+        the names of the partitions archived
+    """
+    try:
+        archived = _run_steps(mydb.cursor(), _archive_rating_years_steps(before_year, keep_tables))
+        mydb.commit()
+    finally:
+        query_cache.invalidate(("Rating",), _database_key(mydb))
+    return archived
@@ -0,0 +1,220 @@
+"""
+Compact record types for the music_db loaders and queries.
+
+The loaders take tuples, e.g. (username, (artist_name, song_title), rating,
+rating_date) for a rating. The dataclasses below hold the same fields in
+__slots__, without a per-instance __dict__, and iterate as those tuples,
+so an iterable of records can be passed to a loader unchanged. from_tuple()
+converts a loader tuple, interning the names (which repeat across records)
+and parsing the ISO date strings into dates:
+
+    music_db.load_song_ratings(mydb, [SongRating("ann", "Queen", "Bohemian Rhapsody", 5, date(2020, 1, 1))])
+
+RatingColumns stores any number of ratings as parallel arrays: names are
+interned once in a string table and referenced by index, dates are ordinals.
+It iterates as SongRating records, so it can be passed to load_song_ratings
+too, one batch of records being materialized at a time.
+
+as_records() turns the (name, count) style rows returned by the get_*
+functions into the result records below; the records unpack like the rows.
+
+measure_rating_memory() (also `python music_db_bench.py --memory N`) compares
+the memory taken by N ratings held as tuples, as records and as columns.
+"""
+import datetime
+import sys
+import tracemalloc
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Type, TypeVar, Union
+
+Date = Union[str, datetime.date]
+
+def _as_date(value: Date) -> datetime.date:
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+
+@dataclass(frozen=True, slots=True)
+class SingleSong:
+    title: str
+    genres: Tuple[str,...]
+    artist_name: str
+    release_date: datetime.date
+
+    def __iter__(self):
+        return iter((self.title, self.genres, self.artist_name, self.release_date))
+
+    @classmethod
+    def from_tuple(cls, single_song: Tuple[str,Tuple[str,...],str,Date]) -> "SingleSong":
+        title, genres, artist_name, release_date = single_song
+        return cls(title, tuple(sys.intern(genre) for genre in genres), sys.intern(artist_name),
+                   _as_date(release_date))
+
+@dataclass(frozen=True, slots=True)
+class Album:
+    name: str
+    genre_name: str
+    artist_name: str
+    release_date: datetime.date
+    songs: Tuple[str,...]
+
+    def __iter__(self):
+        return iter((self.name, self.genre_name, self.artist_name, self.release_date, self.songs))
+
+    @classmethod
+    def from_tuple(cls, album: Tuple[str,str,str,Date,Sequence[str]]) -> "Album":
+        name, genre_name, artist_name, release_date, songs = album
+        return cls(name, sys.intern(genre_name), sys.intern(artist_name), _as_date(release_date), tuple(songs))
+
+@dataclass(frozen=True, slots=True)
+class SongRating:
+    username: str
+    artist_name: str
+    song_title: str
+    rating: int
+    rating_date: datetime.date
+
+    def __iter__(self):
+        return iter((self.username, (self.artist_name, self.song_title), self.rating, self.rating_date))
+
+    @classmethod
+    def from_tuple(cls, song_rating: Tuple[str,Tuple[str,str],int,Date]) -> "SongRating":
+        username, (artist_name, song_title), rating, rating_date = song_rating
+        return cls(sys.intern(username), sys.intern(artist_name), sys.intern(song_title), rating,
+                   _as_date(rating_date))
+
+@dataclass(frozen=True, slots=True)
+class ArtistCount:
+    """
+    Row of get_most_prolific_individual_artists.
+    """
+    name: str
+    song_count: int
+
+    def __iter__(self):
+        return iter((self.name, self.song_count))
+
+@dataclass(frozen=True, slots=True)
+class GenreCount:
+    """
+    Row of get_top_song_genres.
+    """
+    name: str
+    song_count: int
+
+    def __iter__(self):
+        return iter((self.name, self.song_count))
+
+@dataclass(frozen=True, slots=True)
+class RatedSong:
+    """
+    Row of get_most_rated_songs.
+    """
+    title: str
+    artist_name: str
+    rating_count: int
+
+    def __iter__(self):
+        return iter((self.title, self.artist_name, self.rating_count))
+
+@dataclass(frozen=True, slots=True)
+class UserCount:
+    """
+    Row of get_most_engaged_users.
+    """
+    username: str
+    rating_count: int
+
+    def __iter__(self):
+        return iter((self.username, self.rating_count))
+
+R = TypeVar("R")
+
+def as_records(rows: Iterable[tuple], record_type: Type[R]) -> List[R]:
+    """
+    Convert the rows of a get_* result, e.g.
+    as_records(get_most_rated_songs(mydb, (2019, 2022), 10), RatedSong).
+    """
+    return [record_type(*row) for row in rows]
+
+class RatingColumns:
+    """
+    Song ratings as parallel arrays, with interned names and ordinal dates.
+    """
+
+    def __init__(self, song_ratings: Iterable = ()):
+        """
+        Args:
+            song_ratings: loader tuples or SongRating records to start with
+        """
+        self.strings: List[str] = []
+        self._string_ids: Dict[str,int] = {}
+        self.usernames = array("I")
+        self.artist_names = array("I")
+        self.song_titles = array("I")
+        self.ratings = array("i")
+        self.rating_dates = array("i")
+        self.extend(song_ratings)
+
+    def _intern(self, value: str) -> int:
+        index = self._string_ids.get(value)
+        if index is None:
+            index = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def append(self, username: str, artist_name: str, song_title: str, rating: int, rating_date: Date):
+        self.usernames.append(self._intern(username))
+        self.artist_names.append(self._intern(artist_name))
+        self.song_titles.append(self._intern(song_title))
+        self.ratings.append(rating)
+        self.rating_dates.append(_as_date(rating_date).toordinal())
+
+    def extend(self, song_ratings: Iterable):
+        for username, (artist_name, song_title), rating, rating_date in song_ratings:
+            self.append(username, artist_name, song_title, rating, rating_date)
+
+    def __len__(self) -> int:
+        return len(self.ratings)
+
+    def __getitem__(self, index: int) -> SongRating:
+        strings = self.strings
+        return SongRating(strings[self.usernames[index]], strings[self.artist_names[index]],
+                          strings[self.song_titles[index]], self.ratings[index],
+                          datetime.date.fromordinal(self.rating_dates[index]))
+
+    def __iter__(self) -> Iterator[SongRating]:
+        return (self[index] for index in range(len(self)))
+
+def _traced_size(build) -> Tuple[int,object]:
+    """
+    Bytes still allocated by build() once it returns, and its result.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+def measure_rating_memory(song_ratings: Sequence[Tuple[str,Tuple[str,str],int,str]]) -> Dict[str,float]:
+    """
+    Bytes per rating of `song_ratings` held as a list of tuples (with their own
+    strings, as parsed from a file), as a list of SongRating records and as
+    RatingColumns, each built from a fresh copy.
+
+    Returns:
+        {"tuples": ..., "records": ..., "columns": ...}, in bytes per rating
+    """
+    def copied():
+        # Fresh strings per row, as a CSV reader would produce them.
+        return ((username.encode().decode(), (artist_name.encode().decode(), song_title.encode().decode()),
+                 rating, str(rating_date).encode().decode())
+                for username, (artist_name, song_title), rating, rating_date in song_ratings)
+
+    count = max(1, len(song_ratings))
+    sizes = {}
+    sizes["tuples"], _ = _traced_size(lambda: list(copied()))
+    sizes["records"], _ = _traced_size(lambda: [SongRating.from_tuple(rating) for rating in copied()])
+    sizes["columns"], _ = _traced_size(lambda: RatingColumns(copied()))
+    return {name: size / count for name, size in sizes.items()}
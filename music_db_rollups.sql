@@ -0,0 +1,52 @@
+-- ====================================================
+-- Migration: rollup tables for the top-N queries
+-- File: music_db_rollups.sql
+-- Upgrades a database created from a music_db.sql that
+-- predates these tables (the current one creates them).
+-- Apply once, then call music_db.rebuild_rollups(mydb) to
+-- count the rows it already holds.
+-- ====================================================
+
+-- Kept up to date by the AFTER INSERT triggers below, so
+-- get_top_song_genres, get_most_rated_songs and
+-- get_most_engaged_users read counts instead of
+-- re-aggregating SongGenre / Rating on every call.
+-- (Rows are only ever added by the loaders; clear_database
+-- empties these tables together with their sources.)
+CREATE TABLE GenreSongCount (
+    genre_id INT PRIMARY KEY,
+    song_count INT NOT NULL,
+    FOREIGN KEY (genre_id) REFERENCES Genre(genre_id) ON DELETE CASCADE
+);
+
+CREATE TABLE SongYearRatingCount (
+    song_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (song_id, rating_year),
+    INDEX (rating_year, song_id),
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE
+);
+
+CREATE TABLE UserYearRatingCount (
+    user_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (user_id, rating_year),
+    INDEX (rating_year, user_id),
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER song_genre_count AFTER INSERT ON SongGenre FOR EACH ROW
+    INSERT INTO GenreSongCount (genre_id, song_count) VALUES (NEW.genre_id, 1)
+    ON DUPLICATE KEY UPDATE song_count = song_count + 1;
+
+CREATE TRIGGER rating_song_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO SongYearRatingCount (song_id, rating_year, rating_count)
+    VALUES (NEW.song_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
+
+CREATE TRIGGER rating_user_year_count AFTER INSERT ON Rating FOR EACH ROW
+    INSERT INTO UserYearRatingCount (user_id, rating_year, rating_count)
+    VALUES (NEW.user_id, YEAR(NEW.rating_date), 1)
+    ON DUPLICATE KEY UPDATE rating_count = rating_count + 1;
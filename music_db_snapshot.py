@@ -0,0 +1,192 @@
+"""
+In-memory columnar snapshots of the music database.
+
+take_snapshot() reads Artist, Genre, User, Song, SongGenre and Rating once
+into NumPy arrays: every row becomes an int32 index into its table, names
+are dictionary-encoded (a list of the strings plus their rank in the
+database's ORDER BY name order) and dates are int32 day numbers. A Snapshot answers the six get_* queries with
+bincount group-bys and partial sorts over those arrays, so a parameter sweep
+costs no database round trip at all.
+
+The results are those of the SQL versions: same rows, same order, same
+ties broken by name. The name ranks are computed by the database itself
+(DENSE_RANK() OVER (ORDER BY name)), so they follow its collation, e.g.
+the UCA weights of utf8mb4_0900_ai_ci, and names it considers equal share
+a rank. Songs tied on both rating count and title, which SQL leaves in
+unspecified order, come out by song_id.
+
+A snapshot does not see writes made after it was taken; take a new one.
+"""
+from typing import List, Sequence, Set, Tuple
+
+import numpy as np
+
+from music_db import _pooled, _year_bounds
+
+def _day_numbers(dates: Sequence) -> np.ndarray:
+    """
+    Days since 1970-01-01 of DATE values (date objects or ISO strings).
+    """
+    return np.array(dates, dtype="datetime64[D]").astype(np.int32)
+
+def _ranks(rows: List[Tuple], column: int) -> np.ndarray:
+    return np.array([row[column] for row in rows], dtype=np.int32)
+
+def _index_of(ids: np.ndarray, values: Sequence[int]) -> np.ndarray:
+    """
+    Map foreign key values to row indexes of a table whose ids are sorted.
+    """
+    return np.searchsorted(ids, np.asarray(values, dtype=ids.dtype)).astype(np.int32)
+
+def _top_k(counts: np.ndarray, n: int, *tie_breakers: np.ndarray) -> np.ndarray:
+    """
+    Indexes of the (at most) n nonzero counts, ordered by count descending
+    and then by each tie breaker ascending.
+    """
+    candidates = np.flatnonzero(counts)
+    if n <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    if n < len(candidates):
+        # Everything tied with the n-th largest count may still make the cut.
+        threshold = np.partition(counts[candidates], len(candidates) - n)[len(candidates) - n]
+        candidates = candidates[counts[candidates] >= threshold]
+    keys = [tie[candidates] for tie in reversed(tie_breakers)] + [-counts[candidates]]
+    return candidates[np.lexsort(keys)][:n]
+
+class Snapshot:
+    """
+    Columnar copy of the catalog answering the get_* queries in memory.
+    """
+
+    def __init__(self, artists: List[Tuple[int,str]], genres: List[Tuple[int,str]],
+                 users: List[Tuple[int,str]], songs: List[Tuple], song_genres: List[Tuple[int,int]],
+                 ratings: List[Tuple]):
+        """
+        Args (rows as read by take_snapshot, each table ordered by id; a
+        rank is the position of the name in ORDER BY name order, equal
+        for names the collation considers equal):
+            artists: (artist_id, name, name_rank)
+            genres: (genre_id, name, name_rank)
+            users: (user_id, username, username_rank)
+            songs: (song_id, artist_id, is_single, release_date, title, title_rank)
+            song_genres: (song_id, genre_id)
+            ratings: (user_id, song_id, rating_date)
+        """
+        artist_ids = np.array([row[0] for row in artists], dtype=np.int64)
+        genre_ids = np.array([row[0] for row in genres], dtype=np.int64)
+        user_ids = np.array([row[0] for row in users], dtype=np.int64)
+        song_ids = np.array([row[0] for row in songs], dtype=np.int64)
+
+        self.artist_names = [row[1] for row in artists]
+        self.artist_rank = _ranks(artists, 2)
+        self.genre_names = [row[1] for row in genres]
+        self.genre_rank = _ranks(genres, 2)
+        self.usernames = [row[1] for row in users]
+        self.user_rank = _ranks(users, 2)
+
+        self.song_titles = [row[4] for row in songs]
+        self.song_title_rank = _ranks(songs, 5)
+        self.song_order = np.arange(len(songs), dtype=np.int32)
+        self.song_artist = _index_of(artist_ids, [row[1] for row in songs])
+        self.song_is_single = np.array([bool(row[2]) for row in songs], dtype=bool)
+        self.song_day = _day_numbers([row[3] for row in songs])
+
+        self.song_genre_genre = _index_of(genre_ids, [row[1] for row in song_genres])
+
+        self.rating_user = _index_of(user_ids, [row[0] for row in ratings])
+        self.rating_song = _index_of(song_ids, [row[1] for row in ratings])
+        self.rating_day = _day_numbers([row[2] for row in ratings])
+
+        # Last single of every artist, for get_artists_last_single_in_year.
+        self.artist_last_single_day = np.full(len(artists), np.iinfo(np.int32).min, dtype=np.int32)
+        np.maximum.at(self.artist_last_single_day, self.song_artist[self.song_is_single],
+                      self.song_day[self.song_is_single])
+        # Artists with at least one single / one album track.
+        self.artist_has_single = np.bincount(self.song_artist[self.song_is_single],
+                                             minlength=len(artists)) > 0
+        self.artist_has_album_song = np.bincount(self.song_artist[~self.song_is_single],
+                                                 minlength=len(artists)) > 0
+
+    def _day_bounds(self, start_year: int, end_year: int) -> Tuple[int,int]:
+        start, end = _year_bounds(start_year, end_year)
+        return int(_day_numbers([start])[0]), int(_day_numbers([end])[0])
+
+    def get_most_prolific_individual_artists(self, n: int, year_range: Tuple[int,int]) -> List[Tuple[str,int]]:
+        """
+        Get the top n most prolific individual artists by number of singles released in a year range.
+        """
+        start, end = self._day_bounds(*year_range)
+        mask = self.song_is_single & (self.song_day >= start) & (self.song_day < end)
+        counts = np.bincount(self.song_artist[mask], minlength=len(self.artist_names))
+        top = _top_k(counts, n, self.artist_rank)
+        return [(self.artist_names[i], int(counts[i])) for i in top]
+
+    def get_artists_last_single_in_year(self, year: int) -> Set[str]:
+        """
+        Get all artists who released their last single in the given year.
+        """
+        start, end = self._day_bounds(year, year)
+        last = self.artist_last_single_day
+        return {self.artist_names[i] for i in np.flatnonzero((last >= start) & (last < end))}
+
+    def get_top_song_genres(self, n: int) -> List[Tuple[str,int]]:
+        """
+        Get n genres that are most represented in terms of number of songs in that genre.
+        """
+        counts = np.bincount(self.song_genre_genre, minlength=len(self.genre_names))
+        top = _top_k(counts, n, self.genre_rank)
+        return [(self.genre_names[i], int(counts[i])) for i in top]
+
+    def get_album_and_single_artists(self) -> Set[str]:
+        """
+        Get artists who have released albums as well as singles.
+        """
+        both = self.artist_has_single & self.artist_has_album_song
+        return {self.artist_names[i] for i in np.flatnonzero(both)}
+
+    def get_most_rated_songs(self, year_range: Tuple[int,int], n: int) -> List[Tuple[str,str,int]]:
+        """
+        Get the top n most rated songs in the given year range (both inclusive).
+        """
+        start, end = self._day_bounds(*year_range)
+        mask = (self.rating_day >= start) & (self.rating_day < end)
+        counts = np.bincount(self.rating_song[mask], minlength=len(self.song_titles))
+        top = _top_k(counts, n, self.song_title_rank, self.song_order)
+        return [(self.song_titles[i], self.artist_names[self.song_artist[i]], int(counts[i])) for i in top]
+
+    def get_most_engaged_users(self, year_range: Tuple[int,int], n: int) -> List[Tuple[str,int]]:
+        """
+        Get the top n most engaged users.
+        """
+        start, end = self._day_bounds(*year_range)
+        mask = (self.rating_day >= start) & (self.rating_day < end)
+        counts = np.bincount(self.rating_user[mask], minlength=len(self.usernames))
+        top = _top_k(counts, n, self.user_rank)
+        return [(self.usernames[i], int(counts[i])) for i in top]
+
+@_pooled
+def take_snapshot(mydb) -> Snapshot:
+    """
+    Read the tables the get_* queries use into a Snapshot, with the rank of
+    every name in the database's collation order. The reads share one
+    transaction, so under REPEATABLE READ the copy is consistent.
+
+    Args:
+        mydb: database connection
+
+    Returns:
+        the Snapshot
+    """
+    cursor = mydb.cursor()
+    tables = []
+    for sql in ("SELECT artist_id, name, DENSE_RANK() OVER (ORDER BY name) FROM Artist ORDER BY artist_id",
+                "SELECT genre_id, name, DENSE_RANK() OVER (ORDER BY name) FROM Genre ORDER BY genre_id",
+                "SELECT user_id, username, DENSE_RANK() OVER (ORDER BY username) FROM User ORDER BY user_id",
+                "SELECT song_id, artist_id, album_id IS NULL, release_date, title, "
+                "DENSE_RANK() OVER (ORDER BY title) FROM Song ORDER BY song_id",
+                "SELECT song_id, genre_id FROM SongGenre",
+                "SELECT user_id, song_id, rating_date FROM Rating"):
+        cursor.execute(sql)
+        tables.append(cursor.fetchall())
+    mydb.commit()
+    return Snapshot(*tables)
@@ -0,0 +1,185 @@
+"""
+Embedded SQLite backend for the music database.
+
+connect() returns a DB-API connection that every music_db function accepts in
+place of a MySQL connection, directly or through PooledDatabase(connect=...).
+The functions keep issuing their MySQL statements; the connection's cursors
+translate the few dialect differences they use:
+
+  - %s placeholders -> ?
+  - INSERT IGNORE -> INSERT OR IGNORE
+  - CAST(... AS SIGNED) -> CAST(... AS INTEGER)
+  - YEAR(date) -> a registered YEAR() function
+  - WEIGHT_STRING(name) -> a registered function returning the MUSIC_DB_CI
+    sort key of the name
+  - SET FOREIGN_KEY_CHECKS -> PRAGMA foreign_keys
+  - SET SESSION TRANSACTION ISOLATION LEVEL -> ignored, SQLite transactions
+    are serializable (music_db_parallel sets READ COMMITTED on its workers)
+  - TRUNCATE TABLE t -> DELETE FROM t, resetting its AUTOINCREMENT counter
+  - EXPLAIN -> EXPLAIN QUERY PLAN
+  - datetime.date parameters are stored as ISO strings (music_db_records)
+  - a multi-row INSERT reports the id of its first row as lastrowid, as MySQL
+    does, so music_db can derive the ids of the whole insert
+
+The schema is music_db_sqlite.sql, created on first connect. Names compare
+through the MUSIC_DB_CI collation (music_db._fold), matching the case- and
+accent-insensitive MySQL default that the loaders rely on.
+"""
+import datetime
+import os
+import re
+import sqlite3
+from typing import Optional
+
+from music_db import _fold
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "music_db_sqlite.sql")
+
+_INSERT_IGNORE = re.compile(r"\bINSERT\s+IGNORE\b", re.IGNORECASE)
+_CAST_SIGNED = re.compile(r"\bAS\s+SIGNED\b", re.IGNORECASE)
+_FOREIGN_KEY_CHECKS = re.compile(r"^\s*SET\s+FOREIGN_KEY_CHECKS\s*=\s*([01])\s*$", re.IGNORECASE)
+_ISOLATION_LEVEL = re.compile(r"^\s*SET\s+(?:SESSION\s+)?TRANSACTION\s+ISOLATION\s+LEVEL\b", re.IGNORECASE)
+_TRUNCATE = re.compile(r"^\s*TRUNCATE\s+(?:TABLE\s+)?(\w+)\s*$", re.IGNORECASE)
+_EXPLAIN = re.compile(r"^\s*EXPLAIN\s+(?!QUERY\s+PLAN\b)", re.IGNORECASE)
+
+# The implicit date adapter of sqlite3 is deprecated since Python 3.12.
+sqlite3.register_adapter(datetime.date, datetime.date.isoformat)
+
+def _translate(sql: str) -> str:
+    sql = _INSERT_IGNORE.sub("INSERT OR IGNORE", sql)
+    sql = _CAST_SIGNED.sub("AS INTEGER", sql)
+    sql = _EXPLAIN.sub("EXPLAIN QUERY PLAN ", sql)
+    return sql.replace("%s", "?")
+
+def _collate(a: str, b: str) -> int:
+    a, b = _fold(a), _fold(b)
+    return (a > b) - (a < b)
+
+def _year(date) -> Optional[int]:
+    return None if date is None else int(str(date)[:4])
+
+class SQLiteCursor:
+    """
+    Cursor translating music_db's MySQL statements to SQLite.
+    """
+
+    def __init__(self, connection: "SQLiteConnection"):
+        self._connection = connection
+        self._cursor = connection.connection.cursor()
+        self.lastrowid = None
+
+    def execute(self, sql: str, params=()):
+        fk_checks = _FOREIGN_KEY_CHECKS.match(sql)
+        if fk_checks:
+            # The pragma is a no-op inside a transaction; MySQL's TRUNCATE
+            # commits implicitly anyway.
+            self._connection.commit()
+            self._cursor.execute(f"PRAGMA foreign_keys = {'ON' if fk_checks.group(1) == '1' else 'OFF'}")
+            return self
+        if _ISOLATION_LEVEL.match(sql):
+            return self
+        truncate = _TRUNCATE.match(sql)
+        if truncate:
+            table = truncate.group(1)
+            self._cursor.execute(f"DELETE FROM {table}")
+            self._cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            self._connection.commit()
+            return self
+        self._cursor.execute(_translate(sql), params or ())
+        self.lastrowid = self._cursor.lastrowid
+        if self._cursor.rowcount > 1 and sql.lstrip()[:6].upper() == "INSERT":
+            # MySQL reports the first id of a multi-row insert, SQLite the last.
+            self.lastrowid -= self._cursor.rowcount - 1
+        return self
+
+    def executemany(self, sql: str, seq_params):
+        self._cursor.executemany(_translate(sql), seq_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: Optional[int] = None):
+        return self._cursor.fetchmany(self._cursor.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    """
+    A sqlite3 connection with the MySQL-connection surface music_db uses.
+    """
+
+    # Scripts replayed by clear_database(mode="recreate").
+    schema_files = (SCHEMA_FILE,)
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def cursor(self, *args, **kwargs) -> SQLiteCursor:
+        # buffered= / prepared= are MySQL cursor options; SQLite needs neither.
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.connection.in_transaction
+
+    def close(self):
+        self.connection.close()
+
+def connect(database: str = ":memory:", wal: bool = True, mmap_size: int = 0,
+            create_schema: bool = True, **sqlite_kwargs) -> SQLiteConnection:
+    """
+    Open (and, if needed, create) an embedded music database.
+
+    Args:
+        database: database file, or ":memory:" for a private in-memory database
+        wal: use write-ahead logging for a file database, so readers don't
+            block the writer and commits only append to the log
+        mmap_size: bytes of the file to memory-map (e.g. 1 << 30); reads are
+            then served from the page cache without read() system calls,
+            which suits read-heavy analytics
+        create_schema: create the tables from music_db_sqlite.sql if the
+            database has none yet
+        **sqlite_kwargs: passed on to sqlite3.connect (timeout, ...)
+
+    Returns:
+        a connection accepted by every music_db function
+    """
+    # Pooled connections move between threads, one at a time.
+    sqlite_kwargs.setdefault("check_same_thread", False)
+    connection = sqlite3.connect(database, **sqlite_kwargs)
+    connection.create_collation("MUSIC_DB_CI", _collate)
+    connection.create_function("YEAR", 1, _year, deterministic=True)
+    connection.create_function("WEIGHT_STRING", 1, _fold, deterministic=True)
+    connection.execute("PRAGMA foreign_keys = ON")
+    if wal and database != ":memory:":
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+    if mmap_size:
+        connection.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    if create_schema and connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Artist'").fetchone() is None:
+        with open(SCHEMA_FILE, encoding="utf-8") as f:
+            connection.executescript(f.read())
+    return SQLiteConnection(connection)
@@ -0,0 +1,176 @@
+-- ====================================================
+-- Music Database Schema (SQLite)
+-- File: music_db_sqlite.sql
+-- The tables, keys, rollups and indexes of music_db.sql and
+-- music_db_indexes.sql for the embedded backend (music_db_sqlite.py).
+-- Names use the MUSIC_DB_CI collation registered by the backend,
+-- which compares like the case- and accent-insensitive MySQL default.
+-- ====================================================
+
+DROP TABLE IF EXISTS ImportCheckpoint;
+DROP TABLE IF EXISTS FeedFingerprint;
+DROP TABLE IF EXISTS ArtistYearSingleCount;
+DROP TABLE IF EXISTS ArtistSummary;
+DROP TABLE IF EXISTS UserYearRatingCount;
+DROP TABLE IF EXISTS SongYearRatingCount;
+DROP TABLE IF EXISTS GenreSongCount;
+DROP TABLE IF EXISTS Rating;
+DROP TABLE IF EXISTS SongGenre;
+DROP TABLE IF EXISTS Song;
+DROP TABLE IF EXISTS Album;
+DROP TABLE IF EXISTS User;
+DROP TABLE IF EXISTS Genre;
+DROP TABLE IF EXISTS Artist;
+
+CREATE TABLE Artist (
+    artist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL UNIQUE COLLATE MUSIC_DB_CI
+);
+
+CREATE TABLE Genre (
+    genre_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(50) NOT NULL UNIQUE COLLATE MUSIC_DB_CI
+);
+
+CREATE TABLE Album (
+    album_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    artist_id INT NOT NULL,
+    name VARCHAR(100) NOT NULL COLLATE MUSIC_DB_CI,
+    release_date DATE NOT NULL,
+    genre_id INT NOT NULL,
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE,
+    FOREIGN KEY (genre_id) REFERENCES Genre(genre_id) ON DELETE RESTRICT,
+    UNIQUE (artist_id, name)
+);
+
+CREATE TABLE Song (
+    song_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title VARCHAR(100) NOT NULL COLLATE MUSIC_DB_CI,
+    artist_id INT NOT NULL,
+    album_id INT NULL,
+    release_date DATE NOT NULL,
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE,
+    FOREIGN KEY (album_id) REFERENCES Album(album_id) ON DELETE SET NULL,
+    UNIQUE (artist_id, title)
+);
+
+CREATE TABLE SongGenre (
+    song_id INT NOT NULL,
+    genre_id INT NOT NULL,
+    PRIMARY KEY (song_id, genre_id),
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE,
+    FOREIGN KEY (genre_id) REFERENCES Genre(genre_id) ON DELETE CASCADE
+);
+
+CREATE TABLE User (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) NOT NULL UNIQUE COLLATE MUSIC_DB_CI
+);
+
+CREATE TABLE Rating (
+    rating_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL,
+    song_id INT NOT NULL,
+    rating TINYINT NOT NULL CHECK (rating >= 1 AND rating <= 5),
+    rating_date DATE NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE,
+    UNIQUE (user_id, song_id)
+);
+
+-- ====================================================
+-- Rollup tables for the top-N queries (see music_db.sql)
+-- ====================================================
+CREATE TABLE GenreSongCount (
+    genre_id INT PRIMARY KEY,
+    song_count INT NOT NULL,
+    FOREIGN KEY (genre_id) REFERENCES Genre(genre_id) ON DELETE CASCADE
+);
+
+CREATE TABLE SongYearRatingCount (
+    song_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (song_id, rating_year),
+    FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_song_year_rating_count_year ON SongYearRatingCount (rating_year, song_id);
+
+CREATE TABLE UserYearRatingCount (
+    user_id INT NOT NULL,
+    rating_year SMALLINT NOT NULL,
+    rating_count INT NOT NULL,
+    PRIMARY KEY (user_id, rating_year),
+    FOREIGN KEY (user_id) REFERENCES User(user_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_user_year_rating_count_year ON UserYearRatingCount (rating_year, user_id);
+
+CREATE TRIGGER song_genre_count AFTER INSERT ON SongGenre FOR EACH ROW BEGIN
+    INSERT INTO GenreSongCount (genre_id, song_count) VALUES (NEW.genre_id, 1)
+    ON CONFLICT (genre_id) DO UPDATE SET song_count = song_count + 1; END;
+
+CREATE TRIGGER rating_song_year_count AFTER INSERT ON Rating FOR EACH ROW BEGIN
+    INSERT INTO SongYearRatingCount (song_id, rating_year, rating_count)
+    VALUES (NEW.song_id, CAST(strftime('%Y', NEW.rating_date) AS INTEGER), 1)
+    ON CONFLICT (song_id, rating_year) DO UPDATE SET rating_count = rating_count + 1; END;
+
+CREATE TRIGGER rating_user_year_count AFTER INSERT ON Rating FOR EACH ROW BEGIN
+    INSERT INTO UserYearRatingCount (user_id, rating_year, rating_count)
+    VALUES (NEW.user_id, CAST(strftime('%Y', NEW.rating_date) AS INTEGER), 1)
+    ON CONFLICT (user_id, rating_year) DO UPDATE SET rating_count = rating_count + 1; END;
+
+-- ====================================================
+-- Per-artist song facts (see music_db.sql)
+-- ====================================================
+CREATE TABLE ArtistSummary (
+    artist_id INT PRIMARY KEY,
+    single_count INT NOT NULL,
+    album_song_count INT NOT NULL,
+    first_single_date DATE NULL,
+    last_single_date DATE NULL,
+    last_album_date DATE NULL,
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_artist_summary_last_single ON ArtistSummary (last_single_date);
+
+CREATE TABLE ArtistYearSingleCount (
+    artist_id INT NOT NULL,
+    release_year SMALLINT NOT NULL,
+    single_count INT NOT NULL,
+    PRIMARY KEY (artist_id, release_year),
+    FOREIGN KEY (artist_id) REFERENCES Artist(artist_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_artist_year_single_count_year ON ArtistYearSingleCount (release_year, artist_id);
+
+CREATE TRIGGER song_artist_summary AFTER INSERT ON Song FOR EACH ROW BEGIN
+    INSERT INTO ArtistSummary (artist_id, single_count, album_song_count, first_single_date, last_single_date, last_album_date)
+    VALUES (NEW.artist_id, NEW.album_id IS NULL, NEW.album_id IS NOT NULL, CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END, CASE WHEN NEW.album_id IS NULL THEN NEW.release_date END, CASE WHEN NEW.album_id IS NOT NULL THEN NEW.release_date END)
+    ON CONFLICT (artist_id) DO UPDATE SET single_count = single_count + (NEW.album_id IS NULL), album_song_count = album_song_count + (NEW.album_id IS NOT NULL), first_single_date = CASE WHEN NEW.album_id IS NULL AND (first_single_date IS NULL OR NEW.release_date < first_single_date) THEN NEW.release_date ELSE first_single_date END, last_single_date = CASE WHEN NEW.album_id IS NULL AND (last_single_date IS NULL OR NEW.release_date > last_single_date) THEN NEW.release_date ELSE last_single_date END, last_album_date = CASE WHEN NEW.album_id IS NOT NULL AND (last_album_date IS NULL OR NEW.release_date > last_album_date) THEN NEW.release_date ELSE last_album_date END; END;
+
+CREATE TRIGGER song_artist_year_singles AFTER INSERT ON Song FOR EACH ROW BEGIN
+    INSERT INTO ArtistYearSingleCount (artist_id, release_year, single_count)
+    SELECT NEW.artist_id, CAST(strftime('%Y', NEW.release_date) AS INTEGER), 1 WHERE NEW.album_id IS NULL
+    ON CONFLICT (artist_id, release_year) DO UPDATE SET single_count = single_count + 1; END;
+
+-- ====================================================
+-- Resumable import checkpoints (see music_db.sql)
+-- ====================================================
+CREATE TABLE ImportCheckpoint (
+    job_id VARCHAR(100) NOT NULL,
+    step VARCHAR(50) NOT NULL,
+    records_done BIGINT NOT NULL,
+    rejected BIGINT NOT NULL,
+    PRIMARY KEY (job_id, step)
+);
+
+-- Delta-sync fingerprints (see music_db.sql)
+CREATE TABLE FeedFingerprint (
+    fingerprint BLOB PRIMARY KEY
+);
+
+-- ====================================================
+-- Covering indexes for the date-range queries (see music_db_indexes.sql)
+-- ====================================================
+CREATE INDEX idx_rating_date_song ON Rating (rating_date, song_id);
+CREATE INDEX idx_rating_date_user ON Rating (rating_date, user_id);
+CREATE INDEX idx_song_album_date_artist ON Song (album_id, release_date, artist_id);
@@ -1,4 +1,6 @@
-import mysql.connector
+import os
+import sys
+
 from music_db import (
     clear_database,
     load_single_songs,
@@ -11,6 +13,20 @@ from music_db import (
     get_album_and_single_artists,
     get_most_rated_songs,
     get_most_engaged_users,
+    get_artists_last_single_in_years,
+    query_cache,
+    get_most_rated_songs_batch,
+    get_most_engaged_users_batch,
+    sync_single_songs,
+    sync_albums,
+    iter_get_most_prolific_individual_artists,
+    iter_get_artists_last_single_in_year,
+    iter_get_top_song_genres,
+    iter_get_album_and_single_artists,
+    iter_get_most_rated_songs,
+    iter_get_most_engaged_users,
+    rebuild_rollups,
+    ImportJob,
 )
 
 # ===========================
@@ -22,6 +38,10 @@ DB_USER = "root"
 DB_PASSWORD = ""      # your MySQL password
 DB_NAME = "music_db"  # your DB name
 
+# "mysql", or "sqlite" to run against an in-memory embedded database without a
+# server (also selected with `python test_music_db.py --sqlite`).
+DB_BACKEND = os.environ.get("MUSIC_DB_BACKEND", "mysql")
+
 
 # ===========================
 # TEST FRAMEWORK
@@ -376,6 +396,959 @@ def test_load_song_ratings(mydb):
              0)
 
 
+# ===========================
+# FEATURE TESTS
+# ===========================
+
+def test_import_catalog_parity(mydb):
+    """
+    Covers (MySQL only; the server needs local_infile=ON):
+      - import_catalog rejects exactly what the load_* functions reject for
+        the same input on the same database: rows already in the database,
+        duplicates within the input, ratings out of range or of unknown
+        users or songs
+      - An album conflicting only with an earlier, rejected album of the
+        input is accepted; one conflicting with an accepted album is not
+      - Both leave the database answering the queries alike
+    """
+    print("\n--- import_catalog Parity Tests (MySQL) ---")
+
+    from music_db_import import import_catalog
+
+    single_songs = [
+        ("Shine",  ("Pop",),         "Alice", "2019-03-01"),
+        ("Shine",  ("Rock",),        "Alice", "2019-04-01"),  # earlier in the input
+        ("Old",    ("Pop",),         "Alice", "2019-01-01"),  # already in the database
+        ("Noise",  ("Rock",),        "Bob",   "2021-01-01"),
+        ("Dreams", ("Indie", "Pop"), "Carla", "2020-02-02"),
+    ]
+    albums = [
+        ("First",  "Pop",  "Alice", "2020-01-01", ["Shine", "A1 Song"]),    # title of a single
+        ("Second", "Pop",  "Alice", "2020-02-01", ["A1 Song", "A2 Song"]),  # only First had it
+        ("Third",  "Pop",  "Alice", "2020-03-01", ["A2 Song"]),             # title of Second
+        ("Second", "Rock", "Alice", "2020-04-01", ["Other"]),               # name of Second
+        ("Fourth", "Jazz", "Bob",   "2021-02-01", ["Noise"]),               # title of a single
+        ("Fourth", "Jazz", "Bob",   "2021-03-01", ["Fresh"]),               # name of a rejected album
+        ("Vault",  "Rock", "Bob",   "2021-05-01", ["Brand New"]),           # album in the database
+        ("Twice",  "Pop",  "Eve",   "2022-01-01", ["Same", "Same"]),
+    ]
+    users = ["u1", "u2", "u1", "existing"]
+    song_ratings = [
+        ("u1",       ("Alice", "Shine"),   5, "2019-03-05"),
+        ("u2",       ("Alice", "Shine"),   6, "2019-03-06"),  # out of range
+        ("ghost",    ("Alice", "Shine"),   4, "2019-03-07"),  # unknown user
+        ("u1",       ("Alice", "Nope"),    4, "2019-03-08"),  # unknown song
+        ("u1",       ("Alice", "Shine"),   3, "2019-04-01"),  # earlier in the input
+        ("existing", ("Alice", "Old"),     4, "2019-05-01"),  # already in the database
+        ("u2",       ("Alice", "A1 Song"), 4, "2020-03-01"),
+        ("existing", ("Bob",   "Fresh"),   5, "2021-04-01"),
+    ]
+
+    def load_existing():
+        load_single_songs(mydb, [("Old", ("Pop",), "Alice", "2018-01-01")])
+        load_albums(mydb, [("Vault", "Rock", "Bob", "2018-06-01", ["Vault Song"])])
+        load_users(mydb, ["existing"])
+        load_song_ratings(mydb, [("existing", ("Alice", "Old"), 3, "2018-02-01")])
+
+    def answers():
+        return (get_most_prolific_individual_artists(mydb, 10, (2018, 2023)),
+                get_top_song_genres(mydb, 10),
+                get_album_and_single_artists(mydb),
+                get_most_rated_songs(mydb, (2018, 2023), 10),
+                get_most_engaged_users(mydb, (2018, 2023), 10))
+
+    load_existing()
+    loaded = (load_single_songs(mydb, single_songs), load_albums(mydb, albums),
+              load_users(mydb, users), load_song_ratings(mydb, song_ratings))
+    loaded_answers = answers()
+    clear_database(mydb)
+
+    load_existing()
+    imported = import_catalog(mydb, single_songs, albums, users, song_ratings)
+
+    for name, imported_rejects, loaded_rejects in zip(("singles", "albums", "users", "ratings"),
+                                                       imported, loaded):
+        run_test(f"import_catalog – rejected {name} match load_*", imported_rejects, loaded_rejects)
+    run_test("import_catalog – album conflicts follow the accepted albums",
+             imported[1],
+             {("First", "Alice"), ("Third", "Alice"), ("Second", "Alice"),
+              ("Fourth", "Bob"), ("Vault", "Bob")})
+    run_test("import_catalog – queries answer as after load_*", answers(), loaded_answers)
+
+
+def test_pooled_database(sqlite):
+    """
+    Covers:
+      - Loaders and queries accept a PooledDatabase in place of a connection
+      - run_concurrently returns the result of each call, in the order given
+      - The pool opens at most pool_size connections
+      - What a session leaves uncommitted is rolled back when it ends
+    """
+    print("\n--- Connection Pool Tests ---")
+
+    import tempfile
+    from music_db import PooledDatabase, run_concurrently
+
+    opened = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_connect, connect_kwargs = connection_factory(sqlite, tmp_dir)
+
+        def connect(**kwargs):
+            opened.append(kwargs)
+            return base_connect(**kwargs)
+
+        pool = PooledDatabase(pool_size=3, connect=connect, **connect_kwargs)
+        try:
+            load_base_data(pool)
+            calls = [
+                (get_most_rated_songs, (2019, 2022), 4),
+                (get_most_engaged_users, (2019, 2022), 3),
+                (get_top_song_genres, 3),
+                (get_album_and_single_artists,),
+            ] * 5
+            run_test("pool – run_concurrently returns each call's result, in order",
+                     run_concurrently(pool, calls),
+                     [func(pool, *args) for func, *args in calls])
+            run_test("pool – at most pool_size connections opened", len(opened) <= 3, True)
+
+            with pool.session() as session:
+                session.cursor().execute("INSERT INTO User (username) VALUES (%s)", ("uncommitted",))
+            run_test("pool – uncommitted writes of a session are rolled back",
+                     load_users(pool, ["uncommitted"]),
+                     set())
+        finally:
+            pool.close()
+
+
+def test_parallel_loaders(mydb, sqlite):
+    """
+    Covers:
+      - Partitioning keeps all the rows of an artist, however its name is
+        cased, in one partition and in input order
+      - The parallel loaders reject what the sequential loaders reject and
+        leave the database answering the queries alike
+      - A batch that fails with a deadlock is rolled back and retried;
+        other errors propagate
+    """
+    print("\n--- Parallel Loader Tests ---")
+
+    import tempfile
+    import music_db
+    import music_db_parallel
+    from music_db_parallel import parallel_load_albums, parallel_load_single_songs, parallel_load_song_ratings
+
+    single_songs = [
+        ("Shine",  ("Pop",),         "Alice", "2019-03-01"),
+        ("Noise",  ("Rock",),        "Bob",   "2021-01-01"),
+        ("Echo",   ("Pop",),         "ALICE", "2020-05-10"),
+        ("Shine",  ("Rock",),        "alice", "2019-04-01"),  # Alice already has it
+        ("Dreams", ("Indie", "Pop"), "Carla", "2020-02-02"),
+        ("Pulse",  ("EDM",),         "Dave",  "2022-09-09"),
+        ("Alone",  ("Rock",),        "Bob",   "2020-07-07"),
+    ]
+    albums = [
+        ("Skyline",  "Pop",  "Alice", "2020-08-01", ["Sky Intro", "Echo"]),  # Alice's single
+        ("Skyline",  "Pop",  "Alice", "2020-09-01", ["Skyline"]),           # only the rejected one
+        ("Roadtrip", "Rock", "Bob",   "2021-06-15", ["Start", "End"]),
+        ("Detour",   "Rock", "Bob",   "2021-07-15", ["Start"]),             # title of Roadtrip
+        ("Debut",    "Jazz", "Eve",   "2021-01-01", ["Eve Intro"]),
+    ]
+    users = ["u1", "u2", "u3"]
+    song_ratings = [
+        ("u1", ("Alice", "Shine"),   5, "2019-03-05"),
+        ("u2", ("Alice", "Shine"),   4, "2019-03-06"),
+        ("u1", ("Alice", "Shine"),   3, "2019-03-07"),  # u1 already rated it
+        ("u3", ("Bob",   "Start"),   5, "2021-07-01"),
+        ("u2", ("Eve",   "Nope"),    4, "2021-07-02"),  # unknown song
+        ("u3", ("Alice", "Skyline"), 2, "2020-10-01"),
+        ("u1", ("Dave",  "Pulse"),   6, "2022-09-10"),  # out of range
+    ]
+
+    parts = music_db_parallel._partition(single_songs, lambda song: song[2], 3)
+    run_test("parallel – partitions hold every row once",
+             sorted(song for part in parts for song in part),
+             sorted(single_songs))
+    run_test("parallel – each artist in a single partition",
+             [sum(any(song[2].lower() == artist for song in part) for part in parts)
+              for artist in ("alice", "bob", "carla", "dave")],
+             [1, 1, 1, 1])
+    run_test("parallel – input order kept inside each partition",
+             [part == [song for song in single_songs if song in part] for part in parts],
+             [True, True, True])
+
+    def answers(db):
+        return (get_most_prolific_individual_artists(db, 10, (2019, 2022)),
+                get_top_song_genres(db, 10),
+                get_album_and_single_artists(db),
+                get_most_rated_songs(db, (2019, 2022), 10))
+
+    load_users(mydb, users)
+    sequential = (load_single_songs(mydb, single_songs), load_albums(mydb, albums),
+                  load_song_ratings(mydb, song_ratings))
+    sequential_answers = answers(mydb)
+    clear_database(mydb)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        connect, connect_kwargs = connection_factory(sqlite, tmp_dir)
+        db = connect(**connect_kwargs)
+        try:
+            load_users(db, users)
+            parallel = (parallel_load_single_songs(single_songs, 3, 2, connect, **connect_kwargs),
+                        parallel_load_albums(albums, 3, 2, connect, **connect_kwargs),
+                        parallel_load_song_ratings(song_ratings, 3, 2, connect, **connect_kwargs))
+            run_test("parallel – rejections match the sequential loaders", parallel, sequential)
+            run_test("parallel – queries answer as after the sequential loaders",
+                     answers(db), sequential_answers)
+
+            class Deadlock(Exception):
+                errno = 1213  # ER_LOCK_DEADLOCK
+
+            class DuplicateKey(Exception):
+                errno = 1062  # ER_DUP_ENTRY
+
+            real_load_users = music_db.load_users
+            calls = []
+
+            def load_users_failing_once(error):
+                def loader(db, users, batch_size):
+                    calls.append(list(users))
+                    if len(calls) == 1:
+                        raise error("simulated")
+                    return real_load_users(db, users, batch_size=batch_size)
+                return loader
+
+            music_db.load_users = load_users_failing_once(Deadlock)
+            try:
+                rejected = music_db_parallel._load_partition("load_users", ["v1", "v2", "v1"], 2,
+                                                             connect, connect_kwargs)
+            finally:
+                music_db.load_users = real_load_users
+            run_test("parallel – a deadlocked batch is retried",
+                     (rejected, calls),
+                     ({"v1"}, [["v1", "v2"], ["v1", "v2"], ["v1"]]))
+
+            calls.clear()
+            music_db.load_users = load_users_failing_once(DuplicateKey)
+            try:
+                music_db_parallel._load_partition("load_users", ["v3"], 2, connect, connect_kwargs)
+                propagated = False
+            except DuplicateKey:
+                propagated = True
+            finally:
+                music_db.load_users = real_load_users
+            run_test("parallel – other errors are not retried", (propagated, calls), (True, [["v3"]]))
+        finally:
+            db.close()
+
+
+def test_async_parity(mydb, sqlite):
+    """
+    Covers:
+      - The music_db_async loaders reject what the music_db loaders reject,
+        from plain and async iterables
+      - Queries gathered concurrently on a ThreadedPool answer like the
+        music_db queries
+      - The async clear_database empties the database
+    """
+    print("\n--- Asyncio API Parity Tests ---")
+
+    import asyncio
+    import tempfile
+    import music_db
+    import music_db_async
+
+    single_songs = [
+        ("Shine", ("Pop",),  "Alice", "2019-03-01"),
+        ("Echo",  ("Pop",),  "Alice", "2020-05-10"),
+        ("shine", ("Rock",), "Alice", "2019-04-01"),  # Alice already has it
+        ("Noise", ("Rock",), "Bob",   "2021-01-01"),
+    ]
+    albums = [
+        ("Skyline",  "Pop",  "Alice", "2020-08-01", ["Sky Intro", "Skyline"]),
+        ("Roadtrip", "Rock", "Bob",   "2021-06-15", ["Noise", "End"]),  # Bob's single
+        ("Debut",    "Jazz", "Eve",   "2021-01-01", ["Eve Intro"]),
+    ]
+    users = ["u1", "u2", "u1"]
+    song_ratings = [
+        ("u1", ("Alice", "Shine"),     5, "2019-03-05"),
+        ("u2", ("Alice", "Shine"),     4, "2019-03-06"),
+        ("u1", ("Alice", "Shine"),     3, "2019-03-07"),  # u1 already rated it
+        ("u2", ("Alice", "Skyline"),   4, "2020-09-01"),
+        ("u3", ("Bob",   "Noise"),     4, "2021-02-01"),  # unknown user
+        ("u1", ("Eve",   "Eve Intro"), 0, "2021-02-02"),  # out of range
+    ]
+
+    def queries(module):
+        return [
+            (module.get_most_prolific_individual_artists, 4, (2019, 2022)),
+            (module.get_artists_last_single_in_year, 2020),
+            (module.get_top_song_genres, 3),
+            (module.get_album_and_single_artists,),
+            (module.get_most_rated_songs, (2019, 2022), 4),
+            (module.get_most_engaged_users, (2019, 2022), 3),
+        ]
+
+    sync_rejects = (load_single_songs(mydb, single_songs), load_albums(mydb, albums),
+                    load_users(mydb, users), load_song_ratings(mydb, song_ratings))
+    sync_answers = [func(mydb, *args) for func, *args in queries(music_db)]
+    clear_database(mydb)
+
+    async def from_async_iterable(items):
+        for item in items:
+            yield item
+
+    async def run(connect, connect_kwargs):
+        pool = music_db_async.ThreadedPool(size=3, connect=connect, **connect_kwargs)
+        try:
+            rejects = (await music_db_async.load_single_songs(pool, single_songs),
+                       await music_db_async.load_albums(pool, from_async_iterable(albums)),
+                       await music_db_async.load_users(pool, users),
+                       await music_db_async.load_song_ratings(pool, from_async_iterable(song_ratings),
+                                                              batch_size=2))
+            answers = await asyncio.gather(*[func(pool, *args) for func, *args in queries(music_db_async)])
+            await music_db_async.clear_database(pool)
+            cleared = await music_db_async.get_album_and_single_artists(pool, use_rollups=False)
+            return rejects, list(answers), cleared
+        finally:
+            await pool.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        async_rejects, async_answers, cleared = asyncio.run(run(*connection_factory(sqlite, tmp_dir)))
+    run_test("async – loaders reject what the sync loaders reject", async_rejects, sync_rejects)
+    run_test("async – gathered queries answer like the sync queries", async_answers, sync_answers)
+    run_test("async – clear_database empties the database", cleared, set())
+
+
+def test_clear_database_modes(mydb):
+    """
+    Covers:
+      - clear_database(mode="truncate") empties every table, restarts the
+        ids and turns foreign key checks back on
+      - clear_database(mode="recreate") leaves empty tables whose triggers
+        keep the rollups up to date again
+      - An unknown mode is refused
+    """
+    print("\n--- clear_database Mode Tests ---")
+
+    def load_catalog():
+        load_single_songs(mydb, [
+            ("Shine", ("Pop",),  "Alice", "2019-03-01"),
+            ("Noise", ("Rock",), "Bob",   "2021-01-01"),
+        ])
+        load_albums(mydb, [("Skyline", "Pop", "Alice", "2020-08-01", ["Sky Intro", "Skyline"])])
+        load_users(mydb, ["u1", "u2"])
+        load_song_ratings(mydb, [
+            ("u1", ("Alice", "Shine"),   5, "2019-03-05"),
+            ("u2", ("Alice", "Skyline"), 4, "2020-09-01"),
+        ])
+
+    def contents():
+        return (get_top_song_genres(mydb, 5, use_rollups=False),
+                get_album_and_single_artists(mydb, use_rollups=False),
+                get_most_rated_songs(mydb, (2019, 2022), 5, use_rollups=False))
+
+    empty = ([], set(), [])
+
+    load_catalog()
+    clear_database(mydb, mode="truncate")
+    run_test("clear_database truncate – every table emptied", contents(), empty)
+    load_catalog()
+    cursor = mydb.cursor()
+    cursor.execute("SELECT MIN(song_id) FROM Song")
+    run_test("clear_database truncate – ids restart at 1", cursor.fetchall(), [(1,)])
+    try:
+        cursor.execute("INSERT INTO SongGenre (song_id, genre_id) VALUES (%s, %s)", (999, 999))
+        foreign_keys_checked = False
+    except Exception:
+        foreign_keys_checked = True
+    mydb.rollback()
+    run_test("clear_database truncate – foreign key checks back on", foreign_keys_checked, True)
+
+    clear_database(mydb, mode="recreate")
+    run_test("clear_database recreate – every table emptied", contents(), empty)
+    load_catalog()
+    run_test("clear_database recreate – triggers keep the rollups up to date",
+             (get_top_song_genres(mydb, 5), get_most_rated_songs(mydb, (2019, 2022), 5)),
+             (get_top_song_genres(mydb, 5, use_rollups=False),
+              get_most_rated_songs(mydb, (2019, 2022), 5, use_rollups=False)))
+
+    try:
+        clear_database(mydb, mode="drop")
+        refused = False
+    except ValueError:
+        refused = True
+    run_test("clear_database – unknown mode refused", refused, True)
+
+
+def test_record_types(mydb):
+    """
+    Covers:
+      - SingleSong, Album and SongRating records and RatingColumns load with
+        the same rejections and results as the loader tuples they came from
+      - RatingColumns gives back the records it was built from
+      - The records keep their fields in slots, without a __dict__
+      - as_records rows unpack like the get_* rows
+    """
+    print("\n--- Record Type Tests ---")
+
+    from music_db_records import Album, RatedSong, RatingColumns, SingleSong, SongRating, as_records
+
+    single_songs = [
+        ("Shine", ("Pop",),  "Alice", "2019-03-01"),
+        ("Shine", ("Rock",), "Alice", "2019-04-01"),  # Alice already has it
+        ("Noise", ("Rock",), "Bob",   "2021-01-01"),
+    ]
+    albums = [
+        ("Skyline",  "Pop",  "Alice", "2020-08-01", ["Sky Intro", "Skyline"]),
+        ("Roadtrip", "Rock", "Bob",   "2021-06-15", ["Noise", "End"]),  # Bob's single
+    ]
+    users = ["u1", "u2"]
+    song_ratings = [
+        ("u1", ("Alice", "Shine"),   5, "2019-03-05"),
+        ("u2", ("Alice", "Shine"),   6, "2019-03-06"),  # out of range
+        ("u1", ("Alice", "Shine"),   3, "2019-03-07"),  # u1 already rated it
+        ("u2", ("Alice", "Skyline"), 4, "2020-09-01"),
+        ("u2", ("Bob",   "Noise"),   2, "2021-02-01"),
+    ]
+
+    def load(single_songs, albums, song_ratings):
+        load_users(mydb, users)
+        rejects = (load_single_songs(mydb, single_songs), load_albums(mydb, albums),
+                   load_song_ratings(mydb, song_ratings, batch_size=2))
+        answers = (get_most_prolific_individual_artists(mydb, 5, (2019, 2022)),
+                   get_album_and_single_artists(mydb),
+                   get_most_rated_songs(mydb, (2019, 2022), 5))
+        clear_database(mydb)
+        return rejects, answers
+
+    columns = RatingColumns(song_ratings)
+    run_test("records – RatingColumns gives back the records",
+             list(columns),
+             [SongRating.from_tuple(song_rating) for song_rating in song_ratings])
+    run_test("records – records load like the loader tuples",
+             load([SingleSong.from_tuple(song) for song in single_songs],
+                  [Album.from_tuple(album) for album in albums],
+                  columns),
+             load(single_songs, albums, song_ratings))
+    run_test("records – no per-instance __dict__",
+             [hasattr(record, "__dict__") for record in (SingleSong.from_tuple(single_songs[0]),
+                                                         Album.from_tuple(albums[0]), columns[0])],
+             [False, False, False])
+
+    load_users(mydb, users)
+    load_single_songs(mydb, single_songs)
+    load_song_ratings(mydb, song_ratings)
+    rows = get_most_rated_songs(mydb, (2019, 2022), 5)
+    run_test("records – as_records rows unpack like the get_* rows",
+             [tuple(record) for record in as_records(rows, RatedSong)],
+             rows)
+
+
+def test_rollup_parity(mydb):
+    """
+    Covers:
+      - Every query reading the rollup tables returns what the same query
+        over the base tables (use_rollups=False) returns
+    """
+    print("\n--- use_rollups Parity Tests ---")
+
+    queries = [
+        ("get_most_prolific_individual_artists",
+         lambda use_rollups: get_most_prolific_individual_artists(mydb, 4, (2019, 2022), use_rollups)),
+        ("get_artists_last_single_in_year",
+         lambda use_rollups: get_artists_last_single_in_year(mydb, 2020, use_rollups)),
+        ("get_artists_last_single_in_years",
+         lambda use_rollups: get_artists_last_single_in_years(mydb, [2019, 2020, 2021, 2022], use_rollups)),
+        ("get_top_song_genres",
+         lambda use_rollups: get_top_song_genres(mydb, 3, use_rollups)),
+        ("get_album_and_single_artists",
+         lambda use_rollups: get_album_and_single_artists(mydb, use_rollups)),
+        ("get_most_rated_songs",
+         lambda use_rollups: get_most_rated_songs(mydb, (2019, 2022), 4, use_rollups)),
+        ("get_most_engaged_users",
+         lambda use_rollups: get_most_engaged_users(mydb, (2020, 2021), 3, use_rollups)),
+    ]
+    for name, query in queries:
+        run_test(f"use_rollups – {name}: rollups match base tables", query(True), query(False))
+
+
+def test_query_cache(mydb):
+    """
+    Covers:
+      - Cached results are not shared between databases
+      - Writes invalidate the cached results that read their tables
+      - Mutating a returned result leaves the cached one intact
+      - Calls with list arguments are cached
+    """
+    print("\n--- Query Cache Tests ---")
+
+    import music_db_sqlite
+    other = music_db_sqlite.connect()  # a second, empty database
+    query_cache.enabled = True
+    query_cache.invalidate()
+    try:
+        before = get_most_engaged_users(mydb, (2019, 2022), 1)
+        run_test("query cache – another database gets its own results",
+                 get_most_engaged_users(other, (2019, 2022), 1),
+                 [])
+
+        load_users(mydb, ["cache_user"])
+        load_song_ratings(mydb, [
+            ("cache_user", ("Alice",     "Shine"),  5, "2022-11-01"),
+            ("cache_user", ("Alice",     "Echo"),   5, "2022-11-02"),
+            ("cache_user", ("Bob",       "Alone"),  5, "2022-11-03"),
+            ("cache_user", ("Bob",       "Noise"),  5, "2022-11-04"),
+            ("cache_user", ("Carla Duo", "Dreams"), 5, "2022-11-05"),
+        ])
+        after = get_most_engaged_users(mydb, (2019, 2022), 1)
+        run_test("query cache – a load invalidates the cached result",
+                 (after, after != before),
+                 ([("cache_user", 5)], True))
+
+        years = get_artists_last_single_in_years(mydb, [2020, 2021])
+        years[2020].add("Nobody")
+        hits = query_cache.stats()["hits"]
+        run_test("query cache – mutating a result leaves the cache intact",
+                 get_artists_last_single_in_years(mydb, [2020, 2021]),
+                 {2020: expected_last_single_2020(), 2021: expected_last_single_2021()})
+        run_test("query cache – list arguments are served from the cache",
+                 query_cache.stats()["hits"],
+                 hits + 1)
+    finally:
+        query_cache.enabled = False
+        query_cache.invalidate()
+        other.close()
+
+
+def test_snapshot_parity(mydb):
+    """
+    Covers:
+      - A snapshot answers like the database it was taken from
+    """
+    print("\n--- Snapshot Parity Tests ---")
+
+    try:
+        from music_db_snapshot import take_snapshot
+    except ImportError:
+        print("snapshot tests skipped (NumPy not installed)")
+        return
+    snapshot = take_snapshot(mydb)
+    run_test("snapshot – get_most_prolific_individual_artists",
+             snapshot.get_most_prolific_individual_artists(4, (2019, 2022)),
+             get_most_prolific_individual_artists(mydb, 4, (2019, 2022)))
+    run_test("snapshot – get_artists_last_single_in_year",
+             snapshot.get_artists_last_single_in_year(2021),
+             get_artists_last_single_in_year(mydb, 2021))
+    run_test("snapshot – get_top_song_genres",
+             snapshot.get_top_song_genres(3),
+             get_top_song_genres(mydb, 3))
+    run_test("snapshot – get_album_and_single_artists",
+             snapshot.get_album_and_single_artists(),
+             get_album_and_single_artists(mydb))
+    run_test("snapshot – get_most_rated_songs",
+             snapshot.get_most_rated_songs((2019, 2022), 4),
+             get_most_rated_songs(mydb, (2019, 2022), 4))
+    run_test("snapshot – get_most_engaged_users",
+             snapshot.get_most_engaged_users((2019, 2022), 3),
+             get_most_engaged_users(mydb, (2019, 2022), 3))
+
+
+def test_batch_parity(mydb):
+    """
+    Covers:
+      - The *_batch queries return what one query per range returns
+    """
+    print("\n--- Batch Query Parity Tests ---")
+
+    year_ranges = [(2019, 2019), (2019, 2022), (2021, 2022)]
+    run_test("batch – get_most_rated_songs_batch",
+             get_most_rated_songs_batch(mydb, year_ranges, 3),
+             {year_range: get_most_rated_songs(mydb, year_range, 3) for year_range in year_ranges})
+    run_test("batch – get_most_engaged_users_batch",
+             get_most_engaged_users_batch(mydb, year_ranges, 3),
+             {year_range: get_most_engaged_users(mydb, year_range, 3) for year_range in year_ranges})
+    run_test("batch – get_artists_last_single_in_years",
+             get_artists_last_single_in_years(mydb, [2019, 2020, 2021]),
+             {year: get_artists_last_single_in_year(mydb, year) for year in (2019, 2020, 2021)})
+
+
+def test_metrics(mydb):
+    """
+    Covers:
+      - Statements and commits are counted per call of each public function
+      - Executions of one statement with different numbers of values share
+        a normalized key
+      - Statements over slow_threshold are kept, SELECTs with their EXPLAIN
+        plan; none are kept without a threshold
+      - The hook gets every statement and commit, and its errors are counted
+    """
+    print("\n--- Metrics Tests ---")
+
+    from music_db_metrics import MetricsRegistry, instrument
+
+    events = []
+    registry = MetricsRegistry(slow_threshold=0.0, hook=events.append)
+    instrumented = instrument(mydb, registry)
+    load_users(instrumented, ["m1", "m2", "m3"])
+    load_users(instrumented, ["m4", "m5"])
+    get_top_song_genres(instrumented, 3)
+    get_top_song_genres(instrumented, 3)
+    metrics = registry.snapshot()
+
+    run_test("metrics – calls and commits per operation",
+             {name: (stats["calls"], stats["commits"]) for name, stats in metrics["operations"].items()},
+             {"load_users": (2, 2), "get_top_song_genres": (2, 0)})
+    user_lookups = [stats["count"] for sql, stats in metrics["statements"].items()
+                    if sql.startswith("SELECT username, user_id FROM User")]
+    run_test("metrics – one key for the lookups of 3 and 2 users", user_lookups, [2])
+    slow = metrics["slow_statements"]
+    run_test("metrics – every statement kept as slow with a threshold of 0",
+             len(slow),
+             sum(stats["statements"] for stats in metrics["operations"].values()))
+    run_test("metrics – slow SELECTs kept with their plan, other statements without",
+             {(entry["sql"].split()[0], entry["plan"] is not None
+               and not str(entry["plan"][0]).startswith("EXPLAIN failed")) for entry in slow},
+             {("SELECT", True), ("INSERT", False)})
+    run_test("metrics – hook gets every statement and commit",
+             sorted({event["type"] for event in events}) + [len(events)],
+             ["commit", "statement", len(slow) + 2])
+
+    def failing_hook(event):
+        raise RuntimeError("hook failed")
+
+    registry = MetricsRegistry(slow_threshold=None, hook=failing_hook)
+    get_top_song_genres(instrument(mydb, registry), 3)
+    metrics = registry.snapshot()
+    run_test("metrics – no slow statements without a threshold, hook errors counted",
+             (metrics["slow_statements"], metrics["hook_errors"]),
+             ([], 1))
+
+
+def test_import_job_resume(mydb):
+    """
+    Covers:
+      - A job interrupted mid-input keeps the batches it committed
+      - Rerunning it with the same input loads the rest exactly once
+      - finish() drops its checkpoints
+    """
+    print("\n--- ImportJob Resume Tests ---")
+
+    load_single_songs(mydb, [
+        ("Shine", ("Pop",), "Alice", "2019-03-01"),
+        ("Echo",  ("Pop",), "Alice", "2019-05-10"),
+    ])
+    load_users(mydb, ["u1", "u2", "u3"])
+    ratings = [
+        ("u1",    ("Alice", "Shine"), 5, "2019-06-01"),
+        ("u2",    ("Alice", "Shine"), 4, "2019-06-02"),
+        ("u3",    ("Alice", "Shine"), 3, "2019-06-03"),
+        ("u1",    ("Alice", "Echo"),  3, "2019-06-04"),
+        ("ghost", ("Alice", "Echo"),  3, "2019-06-05"),  # unknown user, rejected
+        ("u2",    ("Alice", "Echo"),  2, "2019-06-06"),
+    ]
+
+    def crash_after(items, count):
+        for i, item in enumerate(items):
+            if i == count:
+                raise RuntimeError("simulated crash")
+            yield item
+
+    job = ImportJob(mydb, "test-import-job", batch_size=2)
+    try:
+        job.load_song_ratings(crash_after(ratings, 5))
+    except RuntimeError:
+        pass
+    # Batches of 2: the first two were committed, the third never was.
+    run_test("ImportJob – checkpoint after the crash",
+             job.progress(),
+             {"song_ratings": (4, 0)})
+    run_test("ImportJob – committed batches kept",
+             get_most_rated_songs(mydb, (2019, 2019), 2),
+             [("Shine", "Alice", 3), ("Echo", "Alice", 1)])
+
+    rejects = job.load_song_ratings(ratings)
+    run_test("ImportJob – resumed run rejects only its own records",
+             rejects,
+             {("ghost", "Alice", "Echo")})
+    run_test("ImportJob – every rating loaded exactly once",
+             get_most_rated_songs(mydb, (2019, 2019), 2),
+             [("Shine", "Alice", 3), ("Echo", "Alice", 2)])
+    run_test("ImportJob – checkpoint after the resumed run",
+             job.progress(),
+             {"song_ratings": (6, 1)})
+
+    job.finish()
+    run_test("ImportJob – finish() drops the checkpoints", job.progress(), {})
+
+
+def test_sync_deltas(mydb):
+    """
+    Covers:
+      - Records synced before are skipped, not rejected as duplicates
+      - New records of a feed are loaded
+      - Changed records go through the loaders (and their duplicate checks)
+    """
+    print("\n--- Delta-Sync Tests ---")
+
+    feed = [
+        ("Shine", ("Pop",), "Alice", "2019-03-01"),
+        ("Echo",  ("Pop",), "Alice", "2020-05-10"),
+    ]
+    run_test("sync_single_songs – first sync (no rejects)", sync_single_songs(mydb, feed), set())
+    run_test("sync_single_songs – unchanged feed skipped (no rejects)", sync_single_songs(mydb, feed), set())
+
+    feed = feed + [
+        ("Noise", ("Rock",), "Bob", "2021-01-01"),           # new
+    ]
+    feed[1] = ("Echo", ("Pop", "Rock"), "Alice", "2020-05-10")  # changed genres
+    run_test("sync_single_songs – changed record rejected as existing song",
+             sync_single_songs(mydb, feed),
+             {("Echo", "Alice")})
+    run_test("sync_single_songs – new record loaded",
+             get_most_prolific_individual_artists(mydb, 5, (2019, 2021)),
+             [("Alice", 2), ("Bob", 1)])
+
+    albums = [("Roadtrip", "Rock", "Bob", "2021-06-15", ["Start", "Middle", "End"])]
+    run_test("sync_albums – first sync (no rejects)", sync_albums(mydb, albums), set())
+    run_test("sync_albums – unchanged feed skipped (no rejects)", sync_albums(mydb, albums), set())
+    run_test("sync_albums – album loaded once",
+             get_album_and_single_artists(mydb),
+             {"Bob"})
+
+
+def test_leaderboard_parity(mydb):
+    """
+    Covers:
+      - A rebuilt Leaderboard answers like the SQL queries
+      - An attached Leaderboard counts the ratings loaded afterwards
+    """
+    print("\n--- Leaderboard Parity Tests ---")
+
+    try:
+        from music_db_leaderboard import Leaderboard
+    except ImportError:
+        print("leaderboard tests skipped (NumPy not installed)")
+        return
+    leaderboard = Leaderboard(mydb)
+    leaderboard.rebuild()
+    run_test("leaderboard – most rated songs after rebuild",
+             leaderboard.get_most_rated_songs((2019, 2022), 4),
+             get_most_rated_songs(mydb, (2019, 2022), 4))
+    run_test("leaderboard – most engaged users after rebuild",
+             leaderboard.get_most_engaged_users((2019, 2022), 4),
+             get_most_engaged_users(mydb, (2019, 2022), 4))
+
+    leaderboard.attach()
+    try:
+        load_song_ratings(mydb, [
+            ("u1", ("Dave", "Pulse"),  4, "2022-10-01"),
+            ("u2", ("Dave", "Pulse"),  3, "2022-10-02"),
+            ("u3", ("Bob",  "Noise"),  5, "2021-02-01"),
+            ("u1", ("Dave", "Pulse"),  5, "2022-10-03"),  # duplicate, rejected
+        ])
+    finally:
+        leaderboard.detach()
+    run_test("leaderboard – most rated songs after attached load",
+             leaderboard.get_most_rated_songs((2019, 2022), 4),
+             get_most_rated_songs(mydb, (2019, 2022), 4))
+    run_test("leaderboard – most engaged users after attached load",
+             leaderboard.get_most_engaged_users((2021, 2022), 4),
+             get_most_engaged_users(mydb, (2021, 2022), 4))
+
+
+def test_iter_parity(mydb):
+    """
+    Covers:
+      - The iter_get_* queries yield what the get_* queries return
+    """
+    print("\n--- Streaming Query Parity Tests ---")
+
+    run_test("iter – iter_get_most_prolific_individual_artists",
+             list(iter_get_most_prolific_individual_artists(mydb, 4, (2019, 2022))),
+             get_most_prolific_individual_artists(mydb, 4, (2019, 2022)))
+    run_test("iter – iter_get_artists_last_single_in_year",
+             set(iter_get_artists_last_single_in_year(mydb, 2020)),
+             get_artists_last_single_in_year(mydb, 2020))
+    run_test("iter – iter_get_top_song_genres",
+             list(iter_get_top_song_genres(mydb, 3)),
+             get_top_song_genres(mydb, 3))
+    run_test("iter – iter_get_album_and_single_artists",
+             set(iter_get_album_and_single_artists(mydb)),
+             get_album_and_single_artists(mydb))
+    run_test("iter – iter_get_most_rated_songs",
+             list(iter_get_most_rated_songs(mydb, (2019, 2022), 4)),
+             get_most_rated_songs(mydb, (2019, 2022), 4))
+    run_test("iter – iter_get_most_engaged_users",
+             list(iter_get_most_engaged_users(mydb, (2019, 2022), 3)),
+             get_most_engaged_users(mydb, (2019, 2022), 3))
+
+
+def test_partition_archival(mydb, sqlite):
+    """
+    Covers:
+      - Archived rating years stay counted in the rollups
+      - A rating of an archived (user, song) is still rejected
+      - rebuild_rollups keeps the counts of the archived years
+      - clear_database empties RatingArchive
+
+    On MySQL, Rating is really partitioned (clear_database replays
+    music_db_partitioning.sql) and archived with archive_rating_years. SQLite
+    has no partitions: RatingKey and RatingArchive are created by hand and
+    archiving deletes the old ratings and logs them.
+    """
+    print("\n--- Partition Archival Tests ---")
+
+    import music_db
+    import music_db_partitions
+    try:
+        if sqlite:
+            mydb.connection.executescript("""
+                CREATE TABLE RatingKey (user_id INT NOT NULL, song_id INT NOT NULL,
+                                        PRIMARY KEY (user_id, song_id));
+                CREATE TABLE RatingArchive (partition_name TEXT PRIMARY KEY, upper_bound DATE NOT NULL,
+                                            rating_count INT NOT NULL, archive_table TEXT NULL);
+                CREATE TRIGGER rating_key BEFORE INSERT ON Rating FOR EACH ROW BEGIN
+                    INSERT INTO RatingKey (user_id, song_id) VALUES (NEW.user_id, NEW.song_id);
+                END;
+            """)
+            # Forgets that this connection found no RatingKey before.
+            clear_database(mydb)
+        else:
+            clear_database(mydb, mode="recreate",
+                           schema_files=music_db.SCHEMA_FILES + (music_db.PARTITIONING_FILE,))
+
+        load_single_songs(mydb, [
+            ("Shine", ("Pop",),  "Alice", "2017-03-01"),
+            ("Noise", ("Rock",), "Bob",   "2018-01-01"),
+        ])
+        load_users(mydb, ["u1", "u2", "u3"])
+        load_song_ratings(mydb, [
+            ("u1", ("Alice", "Shine"), 5, "2018-03-05"),
+            ("u2", ("Alice", "Shine"), 4, "2019-03-06"),
+            ("u3", ("Alice", "Shine"), 4, "2021-03-06"),
+            ("u1", ("Bob",   "Noise"), 2, "2021-01-10"),
+        ])
+        expected = [("Shine", "Alice", 3), ("Noise", "Bob", 1)]
+
+        if sqlite:
+            cursor = mydb.cursor()
+            cursor.execute("DELETE FROM Rating WHERE rating_date < '2020-01-01'")
+            cursor.execute("INSERT INTO RatingArchive (partition_name, upper_bound, rating_count) "
+                           "VALUES ('p2019', '2020-01-01', 2)")
+            mydb.commit()
+        else:
+            music_db_partitions.archive_rating_years(mydb, 2020)
+
+        run_test("partitions – rollups still count archived years",
+                 get_most_rated_songs(mydb, (2018, 2021), 2),
+                 expected)
+        run_test("partitions – Rating only holds the kept years",
+                 get_most_rated_songs(mydb, (2018, 2021), 2, use_rollups=False),
+                 [("Noise", "Bob", 1), ("Shine", "Alice", 1)])
+        run_test("partitions – rating of an archived (user, song) rejected",
+                 load_song_ratings(mydb, [("u1", ("Alice", "Shine"), 3, "2021-05-05")]),
+                 {("u1", "Alice", "Shine")})
+
+        rebuild_rollups(mydb)
+        run_test("partitions – rebuild_rollups keeps the archived years",
+                 get_most_rated_songs(mydb, (2018, 2021), 2),
+                 expected)
+
+        clear_database(mydb)
+        cursor = mydb.cursor()
+        cursor.execute("SELECT COUNT(*) FROM RatingArchive")
+        run_test("partitions – clear_database empties RatingArchive", cursor.fetchone()[0], 0)
+    finally:
+        if sqlite:
+            mydb.connection.executescript(
+                "DROP TRIGGER IF EXISTS rating_key; DROP TABLE IF EXISTS RatingKey; "
+                "DROP TABLE IF EXISTS RatingArchive;")
+            clear_database(mydb)
+        else:
+            clear_database(mydb, mode="recreate", schema_files=music_db.SCHEMA_FILES)
+
+
+def test_rating_partitions(mydb):
+    """
+    Covers (MySQL only, on the real partitions of music_db_partitioning.sql):
+      - Rating gets p_old, one partition per year from 2000 to 2030 and p_future
+      - add_rating_partitions splits new years off p_future, and continues
+        from the last archived year once archiving has left only p_future
+      - archive_rating_years drops the partitions before a year, logs them
+        in RatingArchive and can keep each in a table of its own
+      - clear_database drops the kept tables
+    """
+    print("\n--- Rating Partition Tests (MySQL) ---")
+
+    import datetime
+    import music_db
+    from music_db_partitions import add_rating_partitions, archive_rating_years, rating_partitions
+
+    clear_database(mydb, mode="recreate",
+                   schema_files=music_db.SCHEMA_FILES + (music_db.PARTITIONING_FILE,))
+    try:
+        partitions = rating_partitions(mydb)
+        run_test("partitions – music_db_partitioning.sql partitions by year",
+                 [name for name, _ in partitions],
+                 ["p_old"] + [f"p{year}" for year in range(2000, 2031)] + ["p_future"])
+        run_test("partitions – upper bounds",
+                 (partitions[0][1], partitions[-2][1], partitions[-1][1]),
+                 (datetime.date(2000, 1, 1), datetime.date(2031, 1, 1), None))
+
+        run_test("add_rating_partitions – new years split off p_future",
+                 add_rating_partitions(mydb, 2032),
+                 ["p2031", "p2032"])
+        run_test("add_rating_partitions – years already partitioned are skipped",
+                 add_rating_partitions(mydb, 2032),
+                 [])
+
+        load_single_songs(mydb, [
+            ("Shine", ("Pop",),  "Alice", "2017-03-01"),
+            ("Noise", ("Rock",), "Bob",   "2018-01-01"),
+        ])
+        load_users(mydb, ["u1", "u2", "u3"])
+        load_song_ratings(mydb, [
+            ("u1", ("Alice", "Shine"), 5, "2018-03-05"),
+            ("u2", ("Alice", "Shine"), 4, "2019-03-06"),
+            ("u3", ("Alice", "Shine"), 4, "2021-03-06"),
+            ("u1", ("Bob",   "Noise"), 2, "2032-01-10"),
+        ])
+
+        run_test("archive_rating_years – partitions before 2020 archived",
+                 archive_rating_years(mydb, 2020, keep_tables=True),
+                 ["p_old"] + [f"p{year}" for year in range(2000, 2020)])
+        cursor = mydb.cursor()
+        cursor.execute("SELECT partition_name, rating_count, archive_table FROM RatingArchive "
+                       "WHERE rating_count > 0")
+        run_test("archive_rating_years – RatingArchive counts the archived ratings",
+                 set(cursor.fetchall()),
+                 {("p2018", 1, "Rating_p2018"), ("p2019", 1, "Rating_p2019")})
+        cursor.execute("SELECT rating_date FROM Rating_p2019")
+        run_test("archive_rating_years – kept table holds the partition's ratings",
+                 cursor.fetchall(),
+                 [(datetime.date(2019, 3, 6),)])
+        run_test("archive_rating_years – Rating only holds the kept years",
+                 get_most_rated_songs(mydb, (2018, 2032), 2, use_rollups=False),
+                 [("Noise", "Bob", 1), ("Shine", "Alice", 1)])
+        run_test("archive_rating_years – rollups still count the archived years",
+                 get_most_rated_songs(mydb, (2018, 2032), 2),
+                 [("Shine", "Alice", 3), ("Noise", "Bob", 1)])
+
+        archive_rating_years(mydb, 2033)
+        run_test("add_rating_partitions – only p_future left: continues after the archive",
+                 add_rating_partitions(mydb, 2034),
+                 ["p2033", "p2034"])
+
+        clear_database(mydb)
+        cursor = mydb.cursor()
+        cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() "
+                       "AND table_name IN ('Rating_p_old', 'Rating_p2018', 'Rating_p2019')")
+        run_test("clear_database – drops the tables of kept partitions", cursor.fetchall()[0][0], 0)
+    finally:
+        clear_database(mydb, mode="recreate", schema_files=music_db.SCHEMA_FILES)
+
+
 # ===========================
 # EXPECTED VALUES (UPDATED)
 # ===========================
@@ -435,12 +1408,37 @@ def expected_engaged_2022():
 # MAIN
 # ===========================
 
+def use_sqlite():
+    return DB_BACKEND == "sqlite" or "--sqlite" in sys.argv[1:]
+
+def connect():
+    if use_sqlite():
+        import music_db_sqlite
+        return music_db_sqlite.connect()
+    import mysql.connector
+    return mysql.connector.connect(
+        host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME,
+        allow_local_infile=True,  # music_db_import's LOAD DATA LOCAL INFILE
+    )
+
+def connection_factory(sqlite, tmp_dir):
+    """
+    The connection factory and its arguments for tests that open connections
+    of their own (pools, worker processes) to the test database; with SQLite,
+    a database file in `tmp_dir`, since each in-memory connection is a
+    database of its own.
+    """
+    if sqlite:
+        import music_db_sqlite
+        return music_db_sqlite.connect, {"database": os.path.join(tmp_dir, "music.db"), "timeout": 30}
+    import mysql.connector
+    return mysql.connector.connect, {"host": DB_HOST, "user": DB_USER, "password": DB_PASSWORD,
+                                     "database": DB_NAME}
+
 def main():
     try:
-        mydb = mysql.connector.connect(
-            host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME
-        )
-    except mysql.connector.Error as err:
+        mydb = connect()
+    except Exception as err:
         print(f"Error: {err}")
         return
 
@@ -517,6 +1515,46 @@ def main():
         unordered=False,
     )
 
+    # 4. Feature tests, on the base data and then each on an empty database
+    print("\n--------- Feature Tests ---------")
+    test_rollup_parity(mydb)
+    test_batch_parity(mydb)
+    test_iter_parity(mydb)
+    test_snapshot_parity(mydb)
+    test_leaderboard_parity(mydb)
+    test_query_cache(mydb)
+    test_metrics(mydb)
+    clear_database(mydb)
+
+    if not use_sqlite():
+        test_import_catalog_parity(mydb)
+        clear_database(mydb)
+
+    test_pooled_database(use_sqlite())
+    clear_database(mydb)
+
+    test_parallel_loaders(mydb, use_sqlite())
+    clear_database(mydb)
+
+    test_async_parity(mydb, use_sqlite())
+    clear_database(mydb)
+
+    test_clear_database_modes(mydb)
+    clear_database(mydb)
+
+    test_record_types(mydb)
+    clear_database(mydb)
+
+    test_import_job_resume(mydb)
+    clear_database(mydb)
+
+    test_sync_deltas(mydb)
+    clear_database(mydb)
+
+    test_partition_archival(mydb, use_sqlite())
+    if not use_sqlite():
+        test_rating_partitions(mydb)
+
     mydb.close()
     
     print("\n" + "="*30)